@@ -344,6 +344,7 @@ class MultitaskLearningWorkflow(single_cell_workflow.SingleCellWorkflow):
             self.create_output_dir()
             rp = self._result_processor_driver(betas, rescaled_betas, filter_method=self.gold_standard_filter_method,
                                                metric=self.metric)
+            rp.network_writer, rp.matrix_writer = self.network_writer, self.matrix_writer
             rp.tasks_names = self._task_names
             self.results = rp.summarize_network(self.output_dir, gold_standard, self._task_priors)
             self.task_results = rp.tasks_networks
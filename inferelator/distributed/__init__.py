@@ -16,6 +16,7 @@ class AbstractController:
     # The name of this controller
     _controller_name = None
     _controller_dask = False
+    _controller_shared_memory = False
 
     @classmethod
     def name(cls):
@@ -30,6 +31,10 @@ class AbstractController:
     def is_dask(cls):
         return cls._controller_dask
 
+    @classmethod
+    def is_shared_memory(cls):
+        return cls._controller_shared_memory
+
     @classmethod
     @abstractmethod
     def connect(cls, *args, **kwargs):
@@ -48,6 +53,16 @@ class AbstractController:
         """
         raise NotImplementedError
 
+    @classmethod
+    def imap(cls, func, *args, **kwargs):
+        """
+        This implements a map function that returns an iterator of (index, result) tuples, where index is the position
+        of the task's arguments. Results may be in any order. Controllers which can return results as tasks finish
+        should override this; by default all the results from `map` are returned in order.
+        """
+        results = cls.map(func, *args, **kwargs)
+        return iter(()) if results is None else enumerate(results)
+
     @classmethod
     @abstractmethod
     def set_processes(cls, process_count):
@@ -65,6 +80,13 @@ class AbstractController:
         """
         raise NotImplementedError
 
+    @classmethod
+    def num_workers(cls):
+        """
+        Return the number of workers that tasks from `map` are spread across
+        """
+        return 1
+
     @classmethod
     @abstractmethod
     def shutdown(cls):
@@ -0,0 +1,136 @@
+"""
+ChunkTuner picks the number of tasks to send to a worker at once from the measured wall time of tasks that have
+already run, so that each chunk takes about the same amount of time regardless of how long single tasks take
+"""
+
+import math
+import time
+
+from inferelator.utils import Validator as check
+
+# Wall time (in seconds) that each chunk of tasks should take
+DEFAULT_TARGET_CHUNK_TIME = 0.5
+
+# Number of tasks for each worker to run one at a time (to measure task time) before chunks are sized
+DEFAULT_PROBE_TASKS_PER_WORKER = 2
+
+# Smallest number of chunks for each worker (so the load is balanced as chunks finish)
+DEFAULT_MIN_CHUNKS_PER_WORKER = 4
+
+
+class ChunkTuner(object):
+    """
+    Keep track of task wall times during a map call and size chunks of tasks to take target_time seconds
+    """
+
+    n_tasks = None  # int
+    n_workers = 1  # int
+    target_time = DEFAULT_TARGET_CHUNK_TIME  # float
+    min_chunks_per_worker = DEFAULT_MIN_CHUNKS_PER_WORKER  # int
+
+    # Measured tasks and their total wall time
+    measured_tasks = 0
+    measured_time = 0.
+
+    # Every chunk size that has been picked
+    chunk_sizes = None
+
+    def __init__(self, n_tasks=None, n_workers=1, target_time=DEFAULT_TARGET_CHUNK_TIME,
+                 min_chunks_per_worker=DEFAULT_MIN_CHUNKS_PER_WORKER):
+        """
+        :param n_tasks: int
+            The total number of tasks in the map call. If None, chunk sizes are not limited for load balancing
+        :param n_workers: int
+            The number of workers that the tasks are spread across
+        :param target_time: float
+            The wall time (in seconds) that each chunk should take
+        :param min_chunks_per_worker: int
+            Limit chunk sizes so that each worker gets at least this many chunks of the remaining tasks
+        """
+
+        assert check.argument_integer(n_tasks, low=0, allow_none=True)
+        assert check.argument_integer(n_workers, low=1)
+        assert check.argument_numeric(target_time, low=0)
+        assert check.argument_integer(min_chunks_per_worker, low=1)
+
+        self.n_tasks = n_tasks
+        self.n_workers = n_workers
+        self.target_time = target_time
+        self.min_chunks_per_worker = min_chunks_per_worker
+
+        self.measured_tasks = 0
+        self.measured_time = 0.
+        self.chunk_sizes = []
+
+    @property
+    def task_time(self):
+        """
+        The mean wall time of the measured tasks (None if nothing has been measured)
+        """
+        return self.measured_time / self.measured_tasks if self.measured_tasks > 0 else None
+
+    def add(self, elapsed, n_tasks=1):
+        """
+        Add the measured wall time of tasks
+
+        :param elapsed: float
+            Wall time in seconds
+        :param n_tasks: int
+            The number of tasks which ran in that time
+        """
+
+        self.measured_tasks += n_tasks
+        self.measured_time += elapsed
+
+    def chunksize(self, n_remaining=None):
+        """
+        Pick the size for the next chunk of tasks. This is 1 until some tasks have been measured
+
+        :param n_remaining: int
+            The number of tasks that have not been sent to workers yet. If None, use n_tasks
+        :return: int
+        """
+
+        if self.task_time is None:
+            size = 1
+        elif self.task_time <= 0:
+            size = self.n_tasks if self.n_tasks is not None else 1
+        else:
+            size = int(self.target_time / self.task_time)
+
+        n_remaining = self.n_tasks if n_remaining is None else n_remaining
+
+        if n_remaining is not None:
+            size = min(size, int(math.ceil(n_remaining / (self.n_workers * self.min_chunks_per_worker))))
+
+        size = max(size, 1)
+        self.chunk_sizes.append(size)
+        return size
+
+    @staticmethod
+    def timed(func):
+        """
+        Wrap a function so it returns (wall time, result)
+
+        :param func: callable
+        :return: callable
+        """
+
+        def timed_func(*args):
+            start = time.perf_counter()
+            result = func(*args)
+            return time.perf_counter() - start, result
+
+        return timed_func
+
+    def describe(self):
+        """
+        Describe the measured task time and the chosen chunk sizes for logging
+        :return: str
+        """
+
+        task_time = "unmeasured" if self.task_time is None else "{t:.2e}s".format(t=self.task_time)
+        sizes = sorted(set(self.chunk_sizes))
+        sizes = sizes[0] if len(sizes) == 1 else sizes
+
+        return "Chunk size {c} for {n} tasks ({t} per task)".format(c=sizes, n=self.n_tasks, t=task_time)
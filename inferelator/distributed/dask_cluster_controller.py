@@ -168,6 +168,10 @@ class DaskHPCClusterController(AbstractController):
     def map(cls, func, *args, **kwargs):
         raise NotImplementedError
 
+    @classmethod
+    def num_workers(cls):
+        return cls.maximum_cores
+
     @classmethod
     def set_processes(cls, process_count):
         """
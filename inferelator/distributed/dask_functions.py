@@ -15,10 +15,14 @@ more advanced memory and task tools of dask to be used)
 DASK_SCATTER_TIMEOUT = 120
 
 
-def amusr_regress_dask(X, Y, priors, prior_weight, n_tasks, genes, tfs, G, remove_autoregulation=True):
+def amusr_regress_dask(X, Y, priors, prior_weight, n_tasks, genes, tfs, G, remove_autoregulation=True,
+                       gene_blocks=None):
     """
     Execute multitask (AMUSR)
 
+    :param gene_blocks: list(range)
+        Blocks of gene indices to regress as single tasks. Defaults to one task per gene
+
     :return: list
         Returns a list of regression results that the amusr_regression pileup_data can process
     """
@@ -67,12 +71,11 @@ def amusr_regress_dask(X, Y, priors, prior_weight, n_tasks, genes, tfs, G, remov
     distributed.wait(scatter_x, timeout=DASK_SCATTER_TIMEOUT)
     distributed.wait(scatter_priors, timeout=DASK_SCATTER_TIMEOUT)
 
-    future_list = [DaskController.client.submit(regression_maker, i, scatter_x, response_maker(Y, i), scatter_priors,
-                                                tfs)
-                   for i in range(G)]
+    future_list = submit_gene_blocks(regression_maker, gene_blocks, G, scatter_x, lambda i: response_maker(Y, i),
+                                     scatter_priors, tfs)
 
     # Collect results as they finish instead of waiting for all workers to be done
-    result_list = process_futures_into_list(future_list)
+    result_list = process_gene_block_futures(future_list)
 
     DaskController.client.cancel(scatter_x)
     DaskController.client.cancel(scatter_priors)
@@ -80,10 +83,15 @@ def amusr_regress_dask(X, Y, priors, prior_weight, n_tasks, genes, tfs, G, remov
     return result_list
 
 
-def bbsr_regress_dask(X, Y, pp_mat, weights_mat, G, genes, nS):
+def bbsr_regress_dask(X, Y, pp_mat, weights_mat, G, genes, nS, gene_blocks=None, result_container=None):
     """
     Execute regression (BBSR)
 
+    :param gene_blocks: list(range)
+        Blocks of gene indices to regress as single tasks. Defaults to one task per gene
+    :param result_container: RegressionResults
+        Container class to pack each block of results into. Defaults to returning result dicts
+
     :return: list
         Returns a list of regression results that the pileup_data can process
     """
@@ -92,42 +100,49 @@ def bbsr_regress_dask(X, Y, pp_mat, weights_mat, G, genes, nS):
     from inferelator.regression import bayes_stats
     DaskController = MPControl.client
 
-    def regression_maker(j, x, y, pp, weights):
+    def regression_maker(j, x, y, pp, weights, xtx):
         level = 0 if j % 100 == 0 else 2
         utils.Debug.allprint(base_regression.PROGRESS_STR.format(gn=genes[j], i=j, total=G), level=level)
-        data = bayes_stats.bbsr(x, utils.scale_vector(y), pp[j, :].flatten(), weights[j, :].flatten(), nS)
+        data = bayes_stats.bbsr(x, utils.scale_vector(y), pp[j, :].flatten(), weights[j, :].flatten(), nS, xtx=xtx)
         data['ind'] = j
         return j, data
 
     # Scatter common data to workers
     [scatter_x] = DaskController.client.scatter([X.values], broadcast=True, hash=False)
+    [scatter_xtx] = DaskController.client.scatter([np.dot(X.values.T, X.values)], broadcast=True, hash=False)
     [scatter_pp] = DaskController.client.scatter([pp_mat.values], broadcast=True, hash=False)
     [scatter_weights] = DaskController.client.scatter([weights_mat.values], broadcast=True, hash=False)
 
     # Wait for scattering to finish before creating futures
     distributed.wait(scatter_x, timeout=DASK_SCATTER_TIMEOUT)
+    distributed.wait(scatter_xtx, timeout=DASK_SCATTER_TIMEOUT)
     distributed.wait(scatter_pp, timeout=DASK_SCATTER_TIMEOUT)
     distributed.wait(scatter_weights, timeout=DASK_SCATTER_TIMEOUT)
 
-    future_list = [DaskController.client.submit(regression_maker, i, scatter_x,
-                                                Y.get_gene_data(i, force_dense=True).flatten(),
-                                                scatter_pp, scatter_weights)
-                   for i in range(G)]
+    future_list = submit_gene_blocks(regression_maker, gene_blocks, G, scatter_x,
+                                     lambda i: Y.get_gene_data(i, force_dense=True).flatten(),
+                                     scatter_pp, scatter_weights, scatter_xtx, result_container=result_container)
 
     # Collect results as they finish instead of waiting for all workers to be done
-    result_list = process_futures_into_list(future_list)
+    result_list = process_gene_block_futures(future_list, flatten=result_container is None)
 
     DaskController.client.cancel(scatter_x)
+    DaskController.client.cancel(scatter_xtx)
     DaskController.client.cancel(scatter_pp)
     DaskController.client.cancel(scatter_weights)
 
     return result_list
 
 
-def elasticnet_regress_dask(X, Y, params, G, genes):
+def elasticnet_regress_dask(X, Y, params, G, genes, gene_blocks=None, result_container=None):
     """
     Execute regression (ElasticNet)
 
+    :param gene_blocks: list(range)
+        Blocks of gene indices to regress as single tasks. Defaults to one task per gene
+    :param result_container: RegressionResults
+        Container class to pack each block of results into. Defaults to returning result dicts
+
     :return: list
         Returns a list of regression results that the pileup_data can process
     """
@@ -149,12 +164,12 @@ def elasticnet_regress_dask(X, Y, params, G, genes):
     # Wait for scattering to finish before creating futures
     distributed.wait(scatter_x, timeout=DASK_SCATTER_TIMEOUT)
 
-    future_list = [DaskController.client.submit(regression_maker, i, scatter_x,
-                                                Y.get_gene_data(i, force_dense=True).flatten())
-                   for i in range(G)]
+    future_list = submit_gene_blocks(regression_maker, gene_blocks, G, scatter_x,
+                                     lambda i: Y.get_gene_data(i, force_dense=True).flatten(),
+                                     result_container=result_container)
 
     # Collect results as they finish instead of waiting for all workers to be done
-    result_list = process_futures_into_list(future_list)
+    result_list = process_gene_block_futures(future_list, flatten=result_container is None)
 
     DaskController.client.cancel(scatter_x)
 
@@ -214,6 +229,52 @@ def build_mi_array_dask(X, Y, bins, logtype):
     return mi
 
 
+def submit_gene_blocks(regression_maker, gene_blocks, G, scatter_x, gene_data, *args, result_container=None):
+    """
+    Submit one future for each block of genes. Each future calls the regression function on every gene in its block
+
+    :param regression_maker: func
+        Regression function which is called as regression_maker(i, x, data, *args) and returns i, result
+    :param gene_blocks: list(range)
+        Blocks of gene indices. If None, each gene is put in its own block
+    :param G: int
+        Number of genes
+    :param scatter_x: Future
+        Scattered design data
+    :param gene_data: func
+        Function which returns the response data for a gene index. This is called locally and sent with the block
+    :param args:
+        Any additional arguments (usually scattered data) are passed to regression_maker
+    :param result_container: RegressionResults
+        Container class to pack each block of results into. If None, each block returns a list of results
+    :return future_list: list(Futures)
+        Futures which return block_index, [results] or block_index, result_container
+    """
+
+    DaskController = MPControl.client
+    gene_blocks = [range(i, i + 1) for i in range(G)] if gene_blocks is None else gene_blocks
+
+    def block_maker(b, block, x, block_data, *block_args):
+        results = (regression_maker(i, x, data, *block_args)[1] for i, data in zip(block, block_data))
+        return b, list(results) if result_container is None else result_container.from_results(results)
+
+    return [DaskController.client.submit(block_maker, b, block, scatter_x, [gene_data(i) for i in block], *args)
+            for b, block in enumerate(gene_blocks)]
+
+
+def process_gene_block_futures(future_list, flatten=True):
+    """
+    Take a list of gene block futures from submit_gene_blocks and turn them into a list of results ordered by gene
+    :param future_list: list(Futures)
+    :param flatten: bool
+        Flatten the lists of results from each block into one list. Set False if blocks return result containers
+    :return output_list: list(Data)
+    """
+
+    block_list = process_futures_into_list(future_list)
+    return [result_data for block in block_list for result_data in block] if flatten else block_list
+
+
 def process_futures_into_list(future_list, raise_on_error=False, check_results=False):
     """
     Take a list of futures and turn them into a list of results
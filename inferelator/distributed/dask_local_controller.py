@@ -67,6 +67,10 @@ class DaskController(AbstractController):
     def map(cls, func, *args, **kwargs):
         raise NotImplementedError
 
+    @classmethod
+    def num_workers(cls):
+        return cls.processes
+
     @classmethod
     def set_processes(cls, process_count):
         """
@@ -36,6 +36,15 @@ class MPControl(AbstractController):
             return False
         return cls.client.is_dask()
 
+    @classmethod
+    def is_shared_memory(cls):
+        """
+        This returns True if shared memory functions should be used
+        """
+        if cls.client is None:
+            return False
+        return cls.client.is_shared_memory()
+
     @classmethod
     def set_multiprocess_engine(cls, engine):
         """
@@ -47,6 +56,8 @@ class MPControl(AbstractController):
         dask-local
         kvs
         multiprocessing
+        shared-memory
+        threads
         local
 
         :param engine: str / Controller object
@@ -70,6 +81,12 @@ class MPControl(AbstractController):
             elif engine == "multiprocessing":
                 from inferelator.distributed.multiprocessing_controller import MultiprocessingController
                 cls.client = MultiprocessingController
+            elif engine == "shared-memory":
+                from inferelator.distributed.shared_memory_controller import SharedMemoryController
+                cls.client = SharedMemoryController
+            elif engine == "threads":
+                from inferelator.distributed.thread_controller import ThreadController
+                cls.client = ThreadController
             elif engine == "local":
                 from inferelator.distributed.local_controller import LocalController
                 cls.client = LocalController
@@ -115,6 +132,25 @@ class MPControl(AbstractController):
             raise RuntimeError("Connect before calling map()")
         return cls.client.map(*args, **kwargs)
 
+    @classmethod
+    def imap(cls, *args, **kwargs):
+        """
+        Map using the `.imap()` implementation in the multiprocessing engine. This returns an iterator of
+        (index, result) tuples which may be in any order (results are returned as tasks finish if the engine can)
+        """
+        if not cls.is_initialized:
+            raise RuntimeError("Connect before calling imap()")
+        return cls.client.imap(*args, **kwargs)
+
+    @classmethod
+    def num_workers(cls):
+        """
+        Get the number of workers from the multiprocessing engine
+        """
+        if cls.client is None:
+            return 1
+        return cls.client.num_workers()
+
     @classmethod
     def set_processes(cls, process_count):
         """
@@ -140,13 +176,17 @@ class MPControl(AbstractController):
     def shutdown(cls):
         """
         Gracefully shut down the multiprocessing engine by calling `.shutdown()`
+        Any background output is flushed first (and errors from it are raised after the engine is shut down)
         """
 
-        if cls.is_initialized:
-            client_off = cls.client.shutdown()
-            cls.is_initialized = False
-            cls.client = None
-        else:
-            client_off = True
+        try:
+            utils.OutputQueue.flush()
+        finally:
+            if cls.is_initialized:
+                client_off = cls.client.shutdown()
+                cls.is_initialized = False
+                cls.client = None
+            else:
+                client_off = True
 
         return client_off
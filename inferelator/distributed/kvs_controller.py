@@ -7,11 +7,13 @@ It also keeps track of a bunch of SLURM related stuff that was previously workfl
 from kvsstcp import KVSClient
 
 from inferelator.distributed import AbstractController
+from inferelator.distributed.chunk_tuner import ChunkTuner, DEFAULT_TARGET_CHUNK_TIME
 from inferelator.utils import Validator as check
 from inferelator import utils
 from inferelator import default
 
 import os
+import time
 import warnings
 import collections
 import tempfile
@@ -46,9 +48,12 @@ class KVSController(AbstractController):
 
     # An active KVSClient object
     client = None
-    chunk = 25
     _controller_name = "kvs"
 
+    # "auto" sizes each chunk that a process claims from the wall time of the tasks it has already run
+    chunk = "auto"
+    target_chunk_time = DEFAULT_TARGET_CHUNK_TIME
+
     # Set from SLURM environment variables
     rank = None  # int
     tasks = None  # int
@@ -97,6 +102,10 @@ class KVSController(AbstractController):
         if cls.is_master:
             cls.client.get(kvs_key)
 
+    @classmethod
+    def num_workers(cls):
+        return cls.tasks if cls.tasks is not None else 1
+
     @classmethod
     def set_processes(cls, process_count):
         """
@@ -177,22 +186,41 @@ class KVSController(AbstractController):
         :param tell_children: bool
             If this is True, all processes will end up with the final data after assembly. If false, only the master
             will have the final data; others will return None
+        :param chunksize: int, str
+            Number of tasks for a process to take at once, or "auto". Defaults to the class chunk setting
         :return results: list
         """
 
         tmp_file_path = kwargs.pop("tmp_file_path", None)
         tell_children = kwargs.pop("tell_children", True)
+        chunksize = kwargs.pop("chunksize", None)
+        chunksize = cls.chunk if chunksize is None else chunksize
 
         assert check.argument_callable(func)
         assert check.argument_list_type(args, collections.Iterable)
 
+        # Size chunks from the wall time of this process's tasks
+        if chunksize == "auto":
+            n_tasks = min(len(a) for a in args) if all(hasattr(a, "__len__") for a in args) else None
+            tuner = ChunkTuner(n_tasks=n_tasks, n_workers=cls.num_workers(), target_time=cls.target_chunk_time)
+            chunksize = tuner
+        else:
+            tuner = None
+
         # Set up the multiprocessing
-        owncheck = cls.own_check(chunk=cls.chunk, kvs_key=COUNT)
+        owncheck = cls.own_check(chunk=chunksize, kvs_key=COUNT)
         results = dict()
         for pos, arg in enumerate(zip(*args)):
             if next(owncheck):
+                start = time.perf_counter()
                 results[pos] = func(*arg)
 
+                if tuner is not None:
+                    tuner.add(time.perf_counter() - start)
+
+        if tuner is not None:
+            utils.Debug.allprint(tuner.describe(), level=2)
+
         # Process results and synchronize exit from the get call
         results = cls.process_results(results, tmp_file_path=tmp_file_path, tell_children=tell_children)
         cls.sync_processes(pref=POST_SYNC)
@@ -281,8 +309,8 @@ def ownCheck(kvs, rank, chunk=1, kvs_key='count'):
     Generator
     :param kvs: KVSClient
         KVS object for server access
-    :param chunk: int
-        The size of the chunk given to each subprocess
+    :param chunk: int, ChunkTuner
+        The size of the chunk given to each subprocess, or a ChunkTuner which sizes each chunk
     :param kvs_key: str
         The KVS key to increment (default is 'count')
     :yield: bool
@@ -303,7 +331,13 @@ def ownCheck(kvs, rank, chunk=1, kvs_key='count'):
 
         if checks >= upper:
             lower = kvs.get(kvs_key)
-            upper = lower + chunk
+
+            if isinstance(chunk, ChunkTuner):
+                n_remaining = None if chunk.n_tasks is None else chunk.n_tasks - lower
+                upper = lower + chunk.chunksize(n_remaining=n_remaining)
+            else:
+                upper = lower + chunk
+
             kvs.put(kvs_key, upper)
 
         # Yield TRUE if this row belongs to this process and FALSE if it doesn't
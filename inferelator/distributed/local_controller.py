@@ -39,6 +39,21 @@ class LocalController(AbstractController):
         assert check.argument_list_type(arg, collections.Iterable)
         return list(map(func, *arg))
 
+    @classmethod
+    def imap(cls, func, *arg, **kwargs):
+        """
+        Map a function across iterable(s) and return an iterator of (index, result) tuples. Each result is calculated
+        as the iterator is consumed
+
+        :param func: function
+            Mappable function
+        :param args: iterable
+            Iterator(s)
+        """
+        assert check.argument_callable(func)
+        assert check.argument_list_type(arg, collections.Iterable)
+        return enumerate(map(func, *arg))
+
     @classmethod
     def set_processes(cls, process_count):
         """
@@ -5,8 +5,11 @@ This requires pathos because the default multiprocessing serializes with cPickle
 
 import pathos
 import collections
+import itertools
 
 from inferelator.distributed import AbstractController
+from inferelator.distributed.chunk_tuner import ChunkTuner, DEFAULT_TARGET_CHUNK_TIME, DEFAULT_PROBE_TASKS_PER_WORKER
+from inferelator import utils
 from inferelator.utils import Validator as check
 
 
@@ -16,7 +19,9 @@ class MultiprocessingController(AbstractController):
     is_master = True
 
     # Control variables
-    chunk = 25
+    # "auto" sizes chunks from the wall time of the first tasks in each map call
+    chunk = "auto"
+    target_chunk_time = DEFAULT_TARGET_CHUNK_TIME
 
     # Num processes
     processes = 4
@@ -50,10 +55,92 @@ class MultiprocessingController(AbstractController):
             Mappable function
         :param args: iterable
             Iterator(s)
+        :param chunksize: int, str
+            Number of tasks to send to a worker at once, or "auto". Defaults to the class chunk setting
         """
         assert check.argument_callable(func)
         assert check.argument_list_type(args, collections.Iterable)
-        return cls.client.map(func, *args, chunksize=cls.chunk)
+
+        chunksize = cls._chunksize(kwargs.pop("chunksize", None))
+
+        if chunksize != "auto":
+            return cls.client.map(func, *args, chunksize=chunksize)
+
+        probe_results, arg_list, chunksize = cls._probe_chunksize(func, args)
+
+        if len(arg_list) == 0:
+            return probe_results
+
+        return probe_results + cls.client.map(func, *zip(*arg_list), chunksize=chunksize)
+
+    @classmethod
+    def imap(cls, func, *args, **kwargs):
+        """
+        Map a function across iterable(s) and return an iterator of (index, result) tuples in the order that tasks
+        finish
+
+        :param func: function
+            Mappable function
+        :param args: iterable
+            Iterator(s)
+        :param chunksize: int, str
+            Number of tasks to send to a worker at once, or "auto". Defaults to the class chunk setting
+        """
+        assert check.argument_callable(func)
+        assert check.argument_list_type(args, collections.Iterable)
+
+        def indexed_func(i, *arg):
+            return i, func(*arg)
+
+        chunksize = cls._chunksize(kwargs.pop("chunksize", None))
+
+        if chunksize != "auto":
+            return cls.client.uimap(indexed_func, itertools.count(), *args, chunksize=chunksize)
+
+        probe_results, arg_list, chunksize = cls._probe_chunksize(func, args)
+
+        if len(arg_list) == 0:
+            return enumerate(probe_results)
+
+        return itertools.chain(enumerate(probe_results),
+                               cls.client.uimap(indexed_func, itertools.count(len(probe_results)), *zip(*arg_list),
+                                                chunksize=chunksize))
+
+    @classmethod
+    def _chunksize(cls, chunksize):
+        chunksize = cls.chunk if chunksize is None else chunksize
+        assert chunksize == "auto" or check.argument_integer(chunksize, low=1)
+        return chunksize
+
+    @classmethod
+    def _probe_chunksize(cls, func, args):
+        """
+        Run the first tasks one at a time and measure their wall time to pick a chunk size for the rest
+
+        :return: A list of results from the first tasks, a list of argument tuples for the remaining tasks, and the
+            chunk size to use for the remaining tasks
+        :rtype: list, list, int
+        """
+
+        arg_list = list(zip(*args))
+        tuner = ChunkTuner(n_tasks=len(arg_list), n_workers=cls.processes, target_time=cls.target_chunk_time)
+
+        n_probe = min(len(arg_list), cls.processes * DEFAULT_PROBE_TASKS_PER_WORKER)
+        probe_results = []
+
+        if n_probe > 0:
+            for elapsed, result in cls.client.map(tuner.timed(func), *zip(*arg_list[:n_probe]), chunksize=1):
+                tuner.add(elapsed)
+                probe_results.append(result)
+
+        chunksize = tuner.chunksize(n_remaining=len(arg_list) - n_probe)
+        utils.Debug.vprint(tuner.describe(), level=2)
+
+        return probe_results, arg_list[n_probe:], chunksize
+
+    @classmethod
+    def num_workers(cls):
+        return cls.processes
 
     @classmethod
     def shutdown(cls):
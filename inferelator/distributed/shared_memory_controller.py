@@ -0,0 +1,456 @@
+"""
+SharedMemoryController runs everything through a concurrent.futures process pool
+Arrays which are needed by every task are copied into multiprocessing.shared_memory blocks once, and the workers attach
+to those blocks without copying or pickling them. This requires python 3.8+ (for multiprocessing.shared_memory) and
+dill (because the default multiprocessing serializes with cPickle, which can't handle closures)
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import numbers
+from multiprocessing import shared_memory
+
+import dill
+import numpy as np
+import pandas as pd
+import scipy.sparse as sps
+
+from inferelator.distributed import AbstractController
+from inferelator.utils import Validator as check
+from inferelator import utils
+
+
+class SharedArrays(object):
+    """
+    Copy a set of named arrays into shared memory blocks. This object is a picklable reference to the blocks, which
+    can be sent to workers instead of the arrays themselves. The process which created the blocks must call .unlink()
+    (or use this as a context manager) to free them.
+    """
+
+    # Dict of array name: (shared memory block name, array shape, array dtype)
+    descriptors = None
+
+    # The shared memory blocks which were created by this process
+    _blocks = None
+
+    def __init__(self, arrays):
+        """
+        :param arrays: dict
+            Dict of array name: np.ndarray
+        """
+
+        self.descriptors = {}
+        self._blocks = []
+
+        try:
+            for name, arr in arrays.items():
+                arr = np.ascontiguousarray(arr)
+                block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+                self._blocks.append(block)
+
+                np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+                self.descriptors[name] = (block.name, arr.shape, arr.dtype.str)
+        except:
+            self.unlink()
+            raise
+
+    def __getstate__(self):
+        # Only the descriptors are sent to workers; the blocks belong to the process that created them
+        return {"descriptors": self.descriptors}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.unlink()
+
+    def unlink(self):
+        """
+        Close and free the shared memory blocks
+        """
+
+        for block in self._blocks if self._blocks is not None else []:
+            block.close()
+            block.unlink()
+
+        self._blocks = []
+
+    def attach(self):
+        """
+        Attach to the shared memory blocks
+
+        :return: A dict of array name: np.ndarray (read-only views into shared memory), and a list of the attached
+            blocks, which must be closed with close_blocks() after the views are no longer referenced
+        :rtype: dict, list
+        """
+
+        arrays, blocks = {}, []
+
+        for name, (block_name, shape, dtype) in self.descriptors.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            arrays[name].flags.writeable = False
+
+        return arrays, blocks
+
+    @staticmethod
+    def close_blocks(blocks):
+        """
+        Close attached shared memory blocks (without freeing them)
+        """
+
+        for block in blocks:
+            try:
+                block.close()
+            # Something is still holding a view into the block; it will be unmapped when the worker exits
+            except BufferError:
+                pass
+
+
+# The most recently deserialized mapped function in this worker, as (shared memory block name, function)
+_worker_function = (None, None)
+
+
+def _load_function(function_descriptor):
+    """
+    Deserialize a function from shared memory once for each map call (in each worker) and keep it
+    """
+
+    global _worker_function
+    block_name, size = function_descriptor
+
+    if _worker_function[0] != block_name:
+        block = shared_memory.SharedMemory(name=block_name)
+        try:
+            _worker_function = (block_name, dill.loads(bytes(block.buf[:size])))
+        finally:
+            block.close()
+
+    return _worker_function[1]
+
+
+def _run_function_chunk(function_descriptor, arg_chunk):
+    func = _load_function(function_descriptor)
+    return [func(*args) for args in arg_chunk]
+
+
+# Cached arrays which this worker is attached to, keyed by the shared memory block names, as (arrays, blocks)
+_worker_attachments = {}
+
+
+def _attach_cached(cached):
+    """
+    Get views into cached shared arrays. Attachments are kept open between tasks, and attachments to arrays which
+    are no longer being used (because the cache has been replaced) are closed.
+
+    :param cached: list(SharedArrays)
+    :return: dict
+    """
+
+    keys = [tuple(sorted(c[0] for c in shared.descriptors.values())) for shared in cached]
+
+    for stale in [k for k in _worker_attachments if k not in keys]:
+        _, blocks = _worker_attachments.pop(stale)
+        SharedArrays.close_blocks(blocks)
+
+    arrays = {}
+
+    for key, shared in zip(keys, cached):
+        if key not in _worker_attachments:
+            _worker_attachments[key] = shared.attach()
+
+        arrays.update(_worker_attachments[key][0])
+
+    return arrays
+
+
+def _run_shared_task(func, shared, item, args, cached=()):
+    arrays, blocks = shared.attach()
+    arrays.update(_attach_cached(cached))
+
+    try:
+        return func(item, arrays, *args)
+    finally:
+        del arrays
+        SharedArrays.close_blocks(blocks)
+
+
+def _same_source(source, other):
+    """
+    Check if two cache sources are the same. Objects must be identical, and numbers, strings, and indexes must be equal.
+    Tuples are compared element by element.
+    """
+
+    if isinstance(source, tuple) and isinstance(other, tuple):
+        return len(source) == len(other) and all(_same_source(s, o) for s, o in zip(source, other))
+    elif isinstance(source, pd.Index) and isinstance(other, pd.Index):
+        return source.equals(other)
+    elif isinstance(source, (numbers.Number, str)):
+        return type(source) == type(other) and source == other
+    else:
+        return source is other
+
+
+def _source_fingerprint(source):
+    """
+    Hash the contents of a cache source, so that a copy of the same data (like the deep copy of a workflow for each
+    cross-validation run) is recognized as the same source. Data objects are hashed by their shape, labels, and
+    values. Tuples are hashed element by element.
+
+    :param source: object
+    :return: str
+        Fingerprint, or None if the source contains an object which can't be hashed by content
+    """
+
+    fingerprint = hashlib.blake2b(digest_size=16)
+    return fingerprint.hexdigest() if _update_fingerprint(fingerprint, source) else None
+
+
+def _update_fingerprint(fingerprint, source):
+
+    def _update(*items):
+        for item in items:
+            fingerprint.update(repr(item).encode())
+
+    def _update_array(arr):
+        if sps.isspmatrix(arr):
+            arr = sps.csr_matrix(arr)
+            _update("sparse", arr.shape)
+            for a in (arr.data, arr.indices, arr.indptr):
+                _update_array(a)
+        else:
+            arr = np.ascontiguousarray(arr)
+            _update(arr.shape, arr.dtype.str)
+            fingerprint.update(pd.util.hash_array(arr.ravel()).tobytes() if arr.dtype == object else arr.data)
+
+    if isinstance(source, tuple):
+        _update("tuple", len(source))
+        return all(_update_fingerprint(fingerprint, s) for s in source)
+    elif isinstance(source, pd.Index):
+        _update("index")
+        _update_array(np.asarray(source, dtype=object))
+    elif isinstance(source, pd.DataFrame):
+        _update("frame")
+        for labels in (source.index, source.columns):
+            _update_fingerprint(fingerprint, labels)
+        _update_array(utils.frame_to_sparse_matrix(source) if utils.is_sparse_frame(source) else source.values)
+    elif isinstance(source, utils.InferelatorData):
+        _update("data")
+        for labels in (source.sample_names, source.gene_names):
+            _update_fingerprint(fingerprint, labels)
+        _update_array(source.values)
+    elif isinstance(source, (numbers.Number, str)):
+        _update(type(source).__name__, source)
+    else:
+        return False
+
+    return True
+
+
+class SharedMemoryController(AbstractController):
+    _controller_name = "shared-memory"
+    _controller_shared_memory = True
+    client = None
+    is_master = True
+
+    # Control variables
+    chunk = 25
+
+    # Num processes
+    processes = 4
+
+    # Arrays which are kept in shared memory between map calls, as key: (source, source fingerprint, SharedArrays)
+    _cache = {}
+
+    @classmethod
+    def connect(cls, *args, **kwargs):
+        cls.client = concurrent.futures.ProcessPoolExecutor(max_workers=cls.processes, **kwargs)
+        return True
+
+    @classmethod
+    def cache_arrays(cls, key, source, arrays):
+        """
+        Keep arrays in shared memory under a key until they're replaced, so that data which doesn't change between
+        map calls (like the full response data for every bootstrap) is only copied once. The arrays are replaced when
+        the source changes. A source is unchanged if it is the same object (the cache keeps it referenced, so it can't
+        be replaced by a different object with the same id), or if it has the same contents (see _source_fingerprint),
+        so copies of the same data (like each cross-validation run's copy of the workflow) reuse the cached arrays.
+
+        :param key: str
+            Cache key
+        :param source: object
+            The object (or tuple of objects and parameters) that the arrays were made from
+        :param arrays: dict, callable
+            Dict of array name: np.ndarray, or a function which returns it (and is only called if the cache is stale)
+        :return: bool
+            True if the arrays were copied into shared memory, False if they were already cached
+        """
+
+        if key in cls._cache:
+            cached_source, fingerprint, shared = cls._cache[key]
+
+            if _same_source(cached_source, source):
+                return False
+
+            # Keep the new source so that it's found by identity after this
+            if fingerprint is not None and fingerprint == _source_fingerprint(source):
+                cls._cache[key] = (source, fingerprint, shared)
+                return False
+
+        cls.clear_cache(key)
+        arrays = arrays() if callable(arrays) else arrays
+        assert check.argument_type(arrays, dict)
+
+        cls._cache[key] = (source, _source_fingerprint(source), SharedArrays(arrays))
+        utils.Debug.vprint("Cached {n} arrays as {k} ({b} bytes)".format(n=len(arrays), k=key,
+                                                                        b=sum(a.nbytes for a in arrays.values())),
+                           level=2)
+        return True
+
+    @classmethod
+    def clear_cache(cls, key=None):
+        """
+        Free cached arrays
+        :param key: str
+            Cache key to free. If None, free everything
+        """
+
+        for k in list(cls._cache.keys()) if key is None else [key]:
+            if k in cls._cache:
+                cls._cache.pop(k)[2].unlink()
+
+    @classmethod
+    def sync_processes(cls, *args, **kwargs):
+        return True
+
+    @classmethod
+    def set_processes(cls, process_count):
+        """
+        Set the number of worker processes to use
+        :param process_count: int
+        :return:
+        """
+        check.argument_integer(process_count, low=1)
+
+        cls.processes = process_count
+
+    @classmethod
+    def map(cls, func, *args, **kwargs):
+        """
+        Map a function across iterable(s) and return a list of results.
+        The function is serialized into shared memory once, and each task only carries its chunk of arguments.
+
+        :param func: function
+            Mappable function
+        :param args: iterable
+            Iterator(s)
+        :param chunksize: int
+            Number of tasks to send to a worker at once. Defaults to the class chunk setting
+        """
+        assert check.argument_callable(func)
+        assert check.argument_list_type(args, collections.Iterable)
+
+        arg_list = list(zip(*args))
+        results = [None] * len(arg_list)
+
+        for i, result in cls._imap_chunks(func, arg_list, kwargs.pop("chunksize", None)):
+            results[i] = result
+
+        return results
+
+    @classmethod
+    def imap(cls, func, *args, **kwargs):
+        """
+        Map a function across iterable(s) and return an iterator of (index, result) tuples in the order that chunks
+        finish. Tasks are submitted when the iterator is first consumed.
+
+        :param func: function
+            Mappable function
+        :param args: iterable
+            Iterator(s)
+        :param chunksize: int
+            Number of tasks to send to a worker at once. Defaults to the class chunk setting
+        """
+        assert check.argument_callable(func)
+        assert check.argument_list_type(args, collections.Iterable)
+
+        return cls._imap_chunks(func, list(zip(*args)), kwargs.pop("chunksize", None))
+
+    @classmethod
+    def _imap_chunks(cls, func, arg_list, chunksize=None):
+        """
+        Serialize the function into shared memory, submit one task for each chunk of arguments, and yield
+        (index, result) tuples as the chunks finish
+        """
+
+        chunksize = cls.chunk if chunksize is None else chunksize
+        func_bytes = dill.dumps(func)
+
+        block = shared_memory.SharedMemory(create=True, size=max(len(func_bytes), 1))
+        futures = {}
+
+        try:
+            block.buf[:len(func_bytes)] = func_bytes
+            function_descriptor = (block.name, len(func_bytes))
+
+            futures = {cls.client.submit(_run_function_chunk, function_descriptor, arg_list[i:i + chunksize]): i
+                       for i in range(0, len(arg_list), chunksize)}
+
+            for future in concurrent.futures.as_completed(futures):
+                for i, result in enumerate(future.result(), start=futures[future]):
+                    yield i, result
+
+        finally:
+            # Don't free the shared memory until every task is done with it
+            for future in futures:
+                future.cancel()
+
+            concurrent.futures.wait(futures)
+            block.close()
+            block.unlink()
+
+    @classmethod
+    def map_shared(cls, func, iterable, arrays, *args, cached=None):
+        """
+        Map a function across an iterable and return a list of results. Arrays which are needed by every task are
+        copied into shared memory once, and each task only carries its item from the iterable.
+
+        :param func: function
+            Mappable module-level function. This is called as func(item, arrays, *args), where arrays is a dict of
+            read-only array views into shared memory. Results must not reference these views.
+        :param iterable: iterable
+            Items (like blocks of gene indices) to map func over
+        :param arrays: dict
+            Dict of array name: np.ndarray to put into shared memory
+        :param args:
+            Any additional (small) arguments are sent to func with every task
+        :param cached: list(str)
+            Keys of arrays from cache_arrays() to add to arrays. Workers stay attached to these between tasks.
+        """
+        assert check.argument_callable(func)
+        assert check.argument_type(arrays, dict)
+
+        cached = [cls._cache[key][2] for key in cached] if cached is not None else []
+
+        with SharedArrays(arrays) as shared:
+            utils.Debug.vprint("Shared {n} arrays ({b} bytes)".format(n=len(arrays),
+                                                                      b=sum(a.nbytes for a in arrays.values())),
+                               level=2)
+
+            futures = [cls.client.submit(_run_shared_task, func, shared, item, args, cached) for item in iterable]
+            concurrent.futures.wait(futures)
+            return [future.result() for future in futures]
+
+    @classmethod
+    def num_workers(cls):
+        return cls.processes
+
+    @classmethod
+    def shutdown(cls):
+        cls.client.shutdown(wait=True)
+        cls.client = None
+        cls.clear_cache()
+        return True
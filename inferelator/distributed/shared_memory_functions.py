@@ -0,0 +1,212 @@
+from inferelator.distributed.inferelator_mp import MPControl
+from inferelator.regression import base_regression
+from inferelator import utils
+
+import numpy as np
+import scipy.sparse as sps
+
+"""
+This package contains the shared-memory-specific multiprocessing functions (these are used in place of map calls so
+that the design and response data are put into shared memory once for each bootstrap, and tasks only carry blocks of
+gene indices). Functions which run on the workers must be module-level so that they can be pickled by reference.
+
+If the full response data that a bootstrap was sampled from is known, it's kept in shared memory between bootstraps
+(see SharedMemoryController.cache_arrays) and each bootstrap only shares its row index.
+"""
+
+# Cache keys for data which is shared between bootstraps
+RESPONSE_CACHE_KEY = "response"
+BBSR_WEIGHTS_CACHE_KEY = "bbsr_weights"
+
+
+def bbsr_regress_shared_memory(X, Y, pp_mat, weights_mat, G, genes, nS, gene_blocks=None, result_container=None,
+                               ordinary_least_squares=False, incremental_bic=False, response_source=None,
+                               bootstrap_index=None, weights_source=None):
+    """
+    Execute regression (BBSR)
+
+    :param gene_blocks: list(range)
+        Blocks of gene indices to regress as single tasks. Defaults to one task per gene
+    :param result_container: RegressionResults
+        Container class to pack each block of results into. Defaults to returning result dicts
+    :param response_source: InferelatorData
+        The full response data that Y was bootstrapped from. If None, Y is shared for this bootstrap
+    :param bootstrap_index: np.ndarray
+        The row index that Y was bootstrapped with
+    :param weights_source: tuple
+        The objects and parameters that the weights matrix was made from. If None, the weights are shared for this
+        bootstrap
+
+    :return: list
+        Returns a list of regression results that the pileup_data can process
+    """
+    assert MPControl.is_shared_memory()
+
+    x = _dense_array(X.values)
+
+    arrays, cached = _share_response(Y, genes, response_source, bootstrap_index)
+    arrays.update({"x": x, "xtx": np.dot(x.T, x), "pp": np.asarray(pp_mat.values, dtype=bool)})
+
+    if weights_source is None:
+        arrays["weights"] = np.asarray(weights_mat.values, dtype=float)
+    else:
+        MPControl.client.cache_arrays(BBSR_WEIGHTS_CACHE_KEY, weights_source,
+                                      lambda: {"weights": np.asarray(weights_mat.values, dtype=float)})
+        cached.append(BBSR_WEIGHTS_CACHE_KEY)
+
+    return _map_gene_blocks(_bbsr_block, gene_blocks, G, arrays, result_container, nS, ordinary_least_squares,
+                            incremental_bic, cached=cached)
+
+
+def elasticnet_regress_shared_memory(X, Y, params, G, genes, gene_blocks=None, result_container=None,
+                                     response_source=None, bootstrap_index=None):
+    """
+    Execute regression (ElasticNet)
+
+    :param gene_blocks: list(range)
+        Blocks of gene indices to regress as single tasks. Defaults to one task per gene
+    :param result_container: RegressionResults
+        Container class to pack each block of results into. Defaults to returning result dicts
+    :param response_source: InferelatorData
+        The full response data that Y was bootstrapped from. If None, Y is shared for this bootstrap
+    :param bootstrap_index: np.ndarray
+        The row index that Y was bootstrapped with
+
+    :return: list
+        Returns a list of regression results that the pileup_data can process
+    """
+    assert MPControl.is_shared_memory()
+
+    arrays, cached = _share_response(Y, genes, response_source, bootstrap_index)
+    arrays["x"] = _dense_array(X.values)
+
+    return _map_gene_blocks(_elasticnet_block, gene_blocks, G, arrays, result_container, params, cached=cached)
+
+
+def _share_response(Y, genes, response_source=None, bootstrap_index=None):
+    """
+    Get the response arrays for a bootstrap. If the full response data is known, it's cached between bootstraps and
+    only the bootstrap row index is shared for this bootstrap
+
+    :return: A dict of arrays to share for this bootstrap and a list of cache keys
+    :rtype: dict, list
+    """
+
+    if response_source is None or bootstrap_index is None:
+        arrays = _response_arrays(Y)
+        arrays["genes"] = np.asarray(genes, dtype=str)
+        return arrays, []
+
+    def response_arrays():
+        arrays = _response_arrays(response_source)
+        arrays["genes"] = np.asarray(response_source.gene_names, dtype=str)
+        return arrays
+
+    MPControl.client.cache_arrays(RESPONSE_CACHE_KEY, response_source, response_arrays)
+    return {"y_rows": np.asarray(bootstrap_index, dtype=int)}, [RESPONSE_CACHE_KEY]
+
+
+def _map_gene_blocks(block_function, gene_blocks, G, arrays, result_container, *args, cached=None):
+    """
+    Put the arrays into shared memory and map a block function over blocks of gene indices
+
+    :param block_function: func
+        Module-level function which is called as block_function(block, arrays, G, result_container, *args)
+    :param gene_blocks: list(range)
+        Blocks of gene indices. If None, each gene is put in its own block
+    :param G: int
+        Number of genes
+    :param arrays: dict
+        Dict of array name: np.ndarray which are put into shared memory
+    :param result_container: RegressionResults
+        Container class to pack each block of results into. If None, each block returns a list of results
+    :param cached: list(str)
+        Keys of cached arrays to add to arrays
+    :return: list
+        A list of results ordered by gene, or a list of result containers (one for each block)
+    """
+
+    gene_blocks = [range(i, i + 1) for i in range(G)] if gene_blocks is None else gene_blocks
+    block_list = MPControl.client.map_shared(block_function, gene_blocks, arrays, G, result_container, *args,
+                                             cached=cached)
+
+    return [result_data for block in block_list for result_data in block] if result_container is None else block_list
+
+
+def _bbsr_block(block, arrays, G, result_container, nS, ordinary_least_squares, incremental_bic):
+
+    from inferelator.regression import bayes_stats
+
+    def regression_maker(j):
+        _print_progress(arrays["genes"], j, G)
+        data = bayes_stats.bbsr(arrays["x"], utils.scale_vector(_response_data(arrays, j)),
+                                arrays["pp"][j, :].copy(), arrays["weights"][j, :].copy(), nS,
+                                ordinary_least_squares=ordinary_least_squares, xtx=arrays["xtx"],
+                                incremental_bic=incremental_bic)
+        data['ind'] = j
+        return data
+
+    return _pack_block(regression_maker, block, result_container)
+
+
+def _elasticnet_block(block, arrays, G, result_container, params):
+
+    from inferelator.regression import elasticnet_python
+
+    def regression_maker(j):
+        _print_progress(arrays["genes"], j, G)
+        data = elasticnet_python.elastic_net(arrays["x"], utils.scale_vector(_response_data(arrays, j)),
+                                             params=params)
+        data['ind'] = j
+        return data
+
+    return _pack_block(regression_maker, block, result_container)
+
+
+def _pack_block(regression_maker, block, result_container):
+    if result_container is None:
+        return [regression_maker(j) for j in block]
+    else:
+        return result_container.from_results(regression_maker(j) for j in block)
+
+
+def _print_progress(genes, j, G):
+    level = 0 if j % 100 == 0 else 2
+    utils.Debug.allprint(base_regression.PROGRESS_STR.format(gn=genes[j], i=j, total=G), level=level)
+
+
+def _dense_array(x):
+    return x.A if sps.isspmatrix(x) else x
+
+
+def _response_arrays(Y):
+    """
+    Get the response data as a dict of arrays to put into shared memory. Sparse data is shared as the arrays of a CSC
+    matrix (so it doesn't have to be made dense), and dense data is shared as a [N x G] array
+
+    :param Y: InferelatorData
+    :return: dict
+    """
+
+    if Y.is_sparse:
+        y = sps.csc_matrix(Y.values)
+        return {"y_data": y.data, "y_indices": y.indices, "y_indptr": y.indptr, "y_shape": np.array(y.shape)}
+    else:
+        return {"y": Y.values}
+
+
+def _response_data(arrays, j):
+    """
+    Get the response data for gene j from arrays in shared memory. If there is a bootstrap row index (y_rows), the
+    response data is the full data and the bootstrap rows are selected from it
+    :return: np.ndarray [N, ]
+    """
+
+    if "y" in arrays:
+        y = arrays["y"][:, j]
+    else:
+        y = np.zeros(arrays["y_shape"][0], dtype=arrays["y_data"].dtype)
+        start, stop = arrays["y_indptr"][j], arrays["y_indptr"][j + 1]
+        y[arrays["y_indices"][start:stop]] = arrays["y_data"][start:stop]
+
+    return y[arrays["y_rows"]] if "y_rows" in arrays else y.copy()
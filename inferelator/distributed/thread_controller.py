@@ -0,0 +1,149 @@
+"""
+ThreadController runs everything through a concurrent.futures thread pool
+Most of the regression work is numpy / LAPACK, which releases the GIL, so threads avoid process startup, pickling,
+and a copy of the data in every process. The BLAS thread count is limited while mapping (with threadpoolctl) so that
+the worker threads don't oversubscribe the CPUs
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import os
+
+from inferelator.distributed import AbstractController
+from inferelator import utils
+from inferelator.utils import Validator as check
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+
+class ThreadController(AbstractController):
+    _controller_name = "threads"
+    client = None
+    is_master = True
+
+    # Control variables
+    chunk = None
+
+    # Num threads
+    processes = 4
+
+    # Num BLAS threads for each worker thread. If None, split the CPUs between the worker threads
+    blas_threads = None
+
+    @classmethod
+    def connect(cls, *args, **kwargs):
+        """
+        Start the thread pool
+
+        :param blas_threads: int
+            Limit BLAS to this many threads while mapping. If None, split the CPUs between the worker threads
+        """
+
+        blas_threads = kwargs.pop("blas_threads", cls.blas_threads)
+        assert check.argument_integer(blas_threads, low=1, allow_none=True)
+        cls.blas_threads = blas_threads
+
+        if threadpool_limits is None:
+            utils.Debug.vprint("threadpoolctl is not installed; BLAS threads will not be limited", level=0)
+
+        cls.client = concurrent.futures.ThreadPoolExecutor(max_workers=cls.processes,
+                                                           thread_name_prefix="inferelator-worker", **kwargs)
+        return True
+
+    @classmethod
+    def sync_processes(cls, *args, **kwargs):
+        return True
+
+    @classmethod
+    def set_processes(cls, process_count):
+        """
+        Set the number of worker threads to use
+        :param process_count: int
+        :return:
+        """
+        check.argument_integer(process_count, low=1)
+
+        cls.processes = process_count
+
+    @classmethod
+    def map(cls, func, *args, **kwargs):
+        """
+        Map a function across iterable(s) and return a list of results
+
+        :param func: function
+            Mappable function
+        :param args: iterable
+            Iterator(s)
+        """
+        assert check.argument_callable(func)
+        assert check.argument_list_type(args, collections.Iterable)
+
+        with cls._limit_blas():
+            return list(cls.client.map(func, *args))
+
+    @classmethod
+    def imap(cls, func, *args, **kwargs):
+        """
+        Map a function across iterable(s) and return an iterator of (index, result) tuples in the order that tasks
+        finish. Tasks are submitted when the iterator is first consumed.
+
+        The BLAS limit is process-wide, so it's only set while the iterator is submitting tasks or waiting for them
+        to finish, and it's restored before each result is yielded. The caller's code between results isn't limited
+        (and neither are the worker threads while it runs), and an abandoned iterator doesn't leave BLAS limited.
+
+        :param func: function
+            Mappable function
+        :param args: iterable
+            Iterator(s)
+        """
+        assert check.argument_callable(func)
+        assert check.argument_list_type(args, collections.Iterable)
+
+        with cls._limit_blas():
+            futures = {cls.client.submit(func, *arg): i for i, arg in enumerate(zip(*args))}
+
+        pending = set(futures)
+
+        try:
+            while len(pending) > 0:
+                with cls._limit_blas():
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in done:
+                    yield futures[future], future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    @classmethod
+    def blas_thread_count(cls):
+        """
+        Get the number of BLAS threads each worker thread can use
+        :return: int
+        """
+
+        if cls.blas_threads is not None:
+            return cls.blas_threads
+
+        return max(1, (os.cpu_count() or 1) // cls.processes)
+
+    @classmethod
+    def _limit_blas(cls):
+        if threadpool_limits is None:
+            return contextlib.suppress()
+
+        return threadpool_limits(limits=cls.blas_thread_count(), user_api="blas")
+
+    @classmethod
+    def num_workers(cls):
+        return cls.processes
+
+    @classmethod
+    def shutdown(cls):
+        cls.client.shutdown(wait=True)
+        cls.client = None
+        return True
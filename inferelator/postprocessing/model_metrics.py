@@ -5,7 +5,7 @@ import os
 from inferelator import utils
 from inferelator.utils import Validator as check
 from inferelator.postprocessing.model_performance import RankSummingMetric
-from inferelator.postprocessing import TARGET_COLUMN, REGULATOR_COLUMN, PRECISION_COLUMN, RECALL_COLUMN
+from inferelator.postprocessing import PRECISION_COLUMN, RECALL_COLUMN
 from inferelator.postprocessing import CONFIDENCE_COLUMN, GOLD_STANDARD_COLUMN
 
 import matplotlib
@@ -24,21 +24,29 @@ class RankSummaryPR(RankSummingMetric):
 
     # PR
     aupr = None
+    precision = None
+    recall = None
 
     def __init__(self, rankable_data, gold_standard, filter_method='keep_all_gold_standard'):
 
         super(RankSummaryPR, self).__init__(rankable_data, gold_standard, filter_method=filter_method)
 
-        # Calculate the precision and recall and store them with confidence data
-        self.filtered_data = self.calculate_precision_recall(self.filtered_data.copy())
+        # Calculate the precision and recall on the filtered (sorted) arrays
+        self.precision, self.recall = self.precision_recall_arrays(self.sorted_confidences[self.filter_index],
+                                                                   self.sorted_gold_standard[self.filter_index])
 
         # Calculate the AUC
-        self.aupr = self.calculate_aupr(self.filtered_data)
+        self.aupr = self.aupr_from_curve(*self.modify_pr_arrays(self.precision, self.recall))
 
-        # Join the filtered precision/recall onto the full confidences
-        join_data = self.filtered_data.loc[:, [TARGET_COLUMN, REGULATOR_COLUMN, PRECISION_COLUMN, RECALL_COLUMN]]
-        join_data = join_data.set_index([TARGET_COLUMN, REGULATOR_COLUMN])
-        self.confidence_data = self.confidence_data.join(join_data, on=[TARGET_COLUMN, REGULATOR_COLUMN])
+    def extra_confidence_columns(self):
+
+        # Precision and recall for the filtered edges and NaN for everything else
+        precision = np.full(len(self.sorted_confidences), np.nan)
+        recall = np.full(len(self.sorted_confidences), np.nan)
+        precision[self.filter_index] = self.precision
+        recall[self.filter_index] = self.recall
+
+        return [(PRECISION_COLUMN, precision), (RECALL_COLUMN, recall)]
 
     def score(self):
 
@@ -50,14 +58,15 @@ class RankSummaryPR(RankSummingMetric):
 
     def curve_dataframe(self):
 
-        return self.filtered_data.loc[:, [PRECISION_COLUMN, RECALL_COLUMN]]
+        return pd.DataFrame({PRECISION_COLUMN: self.precision, RECALL_COLUMN: self.recall},
+                            index=np.flatnonzero(self.filter_index))
 
     def output_curve_pdf(self, output_dir, file_name=None):
 
         file_name = self.curve_file_name if file_name is None else file_name
 
         # Extract the recall and precision data
-        recall, precision = self.modify_pr(self.curve_dataframe())
+        recall, precision = self.modify_pr_arrays(self.precision, self.recall)
 
         # Plot the precision-recall curve
         self.plot_pr_curve(recall, precision, self.aupr, output_dir, file_name)
@@ -87,7 +96,7 @@ class RankSummaryPR(RankSummingMetric):
         return np.sum(self.confidence_data[CONFIDENCE_COLUMN] >= self.find_threshold(PRECISION_COLUMN, threshold))
 
     def num_over_conf_threshold(self, threshold):
-        return np.sum(self.confidence_data[CONFIDENCE_COLUMN] >= threshold)
+        return np.sum(self.sorted_confidences >= threshold)
 
     def find_threshold(self, column_name, threshold):
 
@@ -117,30 +126,49 @@ class RankSummaryPR(RankSummingMetric):
             data.reset_index(inplace=True)
             utils.Debug.vprint("Resorting confidences for PR", level=0)
 
+        precision, recall = RankSummaryPR.precision_recall_arrays(data[CONFIDENCE_COLUMN].values.astype(float),
+                                                                  data[GOLD_STANDARD_COLUMN].values.astype(float))
+        data[PRECISION_COLUMN] = precision
+        data[RECALL_COLUMN] = recall
+
+        return data
+
+    @staticmethod
+    def precision_recall_arrays(confidences, gold_standard):
+        """
+        Calculate the precision & recall based on arrays of confidence scores and gold standard
+        :param confidences: np.ndarray [N]
+            Confidence scores, sorted in descending order
+        :param gold_standard: np.ndarray [N]
+            Gold standard values aligned to the confidences (NaN if the edge is not in the gold standard)
+        :return precision, recall: np.ndarray [N]
+            Precision and recall (NaN if the edge is not in the gold standard)
+        """
+
         # Get indices for stuff
-        zero_confidence = data[CONFIDENCE_COLUMN] == 0
-        valid_gs_idx = ~pd.isnull(data[GOLD_STANDARD_COLUMN])
-        zero_confidence_precision_idx = zero_confidence & valid_gs_idx
+        valid_gs_idx = ~np.isnan(gold_standard)
+        zero_confidence_precision_idx = (confidences == 0) & valid_gs_idx
 
         # Find the edges that are in the gold standard
-        valid_gs = (data.loc[valid_gs_idx, GOLD_STANDARD_COLUMN] != 0).astype(int)
+        valid_gs = (gold_standard[valid_gs_idx] != 0).astype(int)
+        true_positive = np.cumsum(valid_gs).astype(float)
 
         # the following mimics the R function ChristophsPR
-        # Add nan columns
-        data[PRECISION_COLUMN] = np.nan
-        data[RECALL_COLUMN] = np.nan
+        precision = np.full(len(confidences), np.nan)
+        recall = np.full(len(confidences), np.nan)
 
-        # Calculate precision [TP / (TP + FP)]
-        data.loc[valid_gs_idx, PRECISION_COLUMN] = np.cumsum(valid_gs).astype(float) / np.cumsum([1] * len(valid_gs))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Calculate precision [TP / (TP + FP)]
+            precision[valid_gs_idx] = true_positive / np.arange(1, len(valid_gs) + 1)
 
-        # Overwrite the precision of no-confidence with the mean value
-        zero_confidence_precision_val = data.loc[zero_confidence_precision_idx, PRECISION_COLUMN].mean()
-        data.loc[zero_confidence_precision_idx, PRECISION_COLUMN] = zero_confidence_precision_val
+            # Overwrite the precision of no-confidence with the mean value
+            if np.any(zero_confidence_precision_idx):
+                precision[zero_confidence_precision_idx] = np.mean(precision[zero_confidence_precision_idx])
 
-        # Calculate recall [TP / (TP + FN)]
-        data.loc[valid_gs_idx, RECALL_COLUMN] = np.cumsum(valid_gs).astype(float) / sum(valid_gs)
+            # Calculate recall [TP / (TP + FN)]
+            recall[valid_gs_idx] = true_positive / np.sum(valid_gs)
 
-        return data
+        return precision, recall
 
     @staticmethod
     def modify_pr(data):
@@ -154,15 +182,35 @@ class RankSummaryPR(RankSummingMetric):
             Recall values
         """
 
-        data = data.loc[~pd.isnull(data[PRECISION_COLUMN]), :]
-        precision = np.insert(data[PRECISION_COLUMN].values, 0, data[PRECISION_COLUMN].iloc[0])
-        recall = np.insert(data[RECALL_COLUMN].values, 0, 0)
+        return RankSummaryPR.modify_pr_arrays(data[PRECISION_COLUMN].values, data[RECALL_COLUMN].values)
+
+    @staticmethod
+    def modify_pr_arrays(precision, recall):
+        """
+        Inserts values into the precision and recall arrays to allow for plotting & calculations of area
+        :param precision: np.ndarray
+            Precision values, sorted by descending confidence
+        :param recall: np.ndarray
+            Recall values, sorted by descending confidence
+        :return precision: np.ndarray
+            Precision values
+        :return recall: np.ndarray
+            Recall values
+        """
+
+        keep = ~np.isnan(precision)
+        precision, recall = precision[keep], recall[keep]
+        precision = np.insert(precision, 0, precision[0])
+        recall = np.insert(recall, 0, 0)
         return recall, precision
 
     @staticmethod
     def calculate_aupr(data):
-        recall, precision = RankSummaryPR.modify_pr(data)
+        return RankSummaryPR.aupr_from_curve(*RankSummaryPR.modify_pr(data))
+
+    @staticmethod
+    def aupr_from_curve(recall, precision):
         # using midpoint integration to calculate the area under the curve
         d_recall = np.diff(recall)
         m_precision = precision[:-1] + np.diff(precision) / 2
-        return sum(d_recall * m_precision)
+        return np.sum(d_recall * m_precision)
@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 from inferelator import utils
 from inferelator.utils import Validator as check
+from inferelator.utils import bootstrap_aggregator
 from inferelator.postprocessing import GOLD_STANDARD_COLUMN, CONFIDENCE_COLUMN, TARGET_COLUMN, REGULATOR_COLUMN
 
 
@@ -15,17 +16,23 @@ class RankSummingMetric(object):
     name = "Confidences"
 
     # Filter methods to align gold standard and confidences
-    filter_method = None
-    filter_method_lookup = {'overlap': 'filter_to_overlap', 'keep_all_gold_standard': 'filter_to_left_size'}
+    filter_mask_lookup = {'overlap': 'overlap_mask', 'keep_all_gold_standard': 'left_size_mask'}
 
     # Data (wide)
     rankable_data = None
     gold_standard = None
     all_confidences = None
 
-    # Processed data (long)
-    confidence_data = None
-    filtered_data = None
+    # Aligned data (flat, sorted by descending confidence)
+    aligned_index = None
+    aligned_columns = None
+    sorted_positions = None
+    sorted_confidences = None
+    sorted_gold_standard = None
+    filter_index = None
+
+    # Processed data (long); built from the aligned data only when it's needed
+    _confidence_data = None
 
     # File name
     curve_file_name = None
@@ -43,8 +50,8 @@ class RankSummingMetric(object):
         """
 
         # Get the filtering method
-        assert check.argument_enum(filter_method, self.filter_method_lookup.keys())
-        self.filter_method = getattr(self, self.filter_method_lookup[filter_method])
+        assert check.argument_enum(filter_method, self.filter_mask_lookup.keys())
+        filter_mask = getattr(self, self.filter_mask_lookup[filter_method])
 
         # Explicitly cast the gold standard data to a boolean array [0,1]
         gold_standard = (gold_standard != 0).astype(int)
@@ -53,24 +60,33 @@ class RankSummingMetric(object):
         # Calculate confidences based on the ranked data
         self.all_confidences = self.compute_combined_confidences(rankable_data)
 
-        # Convert the confidence data to long format
-        confidence_data = utils.melt_and_reindex_dataframe(self.all_confidences, CONFIDENCE_COLUMN,
-                                                           idx_name=TARGET_COLUMN, col_name=REGULATOR_COLUMN)
-
-        # Attach the gold standard
-        confidence_data = self.attach_gs_to_confidences(confidence_data, gold_standard)
+        # Align the gold standard to the confidences once and flatten both into arrays
+        self.aligned_index, self.aligned_columns, confidences, gs, present = self.align_gold_standard(
+            self.all_confidences, gold_standard)
 
-        # Sort by confidence (descending) and reset the index
-        self.confidence_data = confidence_data.sort_values(by=CONFIDENCE_COLUMN, ascending=False, na_position='last')
-        self.confidence_data.reset_index(inplace=True)
+        # Sort by confidence (descending, with NaN last)
+        present = np.flatnonzero(present)
+        self.sorted_positions = present[np.argsort(-confidences[present], kind='mergesort')]
+        self.sorted_confidences = confidences[self.sorted_positions]
+        self.sorted_gold_standard = gs[self.sorted_positions]
 
         # Filter the gold standard and confidences down to a format that can be directly compared
         utils.Debug.vprint("GS: {gs} edges, Confidences: {conf} edges".format(gs=gold_standard.shape[0],
-                                                                              conf=self.confidence_data.shape[0]),
+                                                                              conf=len(self.sorted_positions)),
                            level=0)
 
-        self.filtered_data = self.filter_method(GOLD_STANDARD_COLUMN, CONFIDENCE_COLUMN, self.confidence_data)
-        utils.Debug.vprint("Filtered data to {e} edges".format(e=self.filtered_data.shape[0], level=0))
+        self.filter_index = filter_mask(self.sorted_gold_standard, self.sorted_confidences)
+        utils.Debug.vprint("Filtered data to {e} edges".format(e=np.sum(self.filter_index)), level=0)
+
+    @property
+    def confidence_data(self):
+        if self._confidence_data is None:
+            self._confidence_data = self.make_confidence_dataframe()
+        return self._confidence_data
+
+    @property
+    def filtered_data(self):
+        return self.confidence_data.loc[self.filter_index, :]
 
     def score(self):
         raise NotImplementedError
@@ -81,6 +97,98 @@ class RankSummingMetric(object):
     def confidence_dataframe(self):
         return self.confidence_data
 
+    def make_confidence_dataframe(self):
+        """
+        Build the long-format [(G*K) x n] dataframe of edges from the aligned arrays, sorted by confidence
+        :return: pd.DataFrame
+            Edge dataframe with target, regulator, confidence, and gold standard columns (and any columns from
+            `extra_confidence_columns`)
+        """
+
+        confidence_columns = self.confidence_columns()
+        return pd.DataFrame(dict(confidence_columns), columns=[col_name for col_name, _ in confidence_columns])
+
+    def sorted_codes(self, edge_idx=None):
+        """
+        Get the row and column codes into `aligned_index` and `aligned_columns` for the sorted edges
+        :param edge_idx: np.ndarray
+            Positions of the edges in the sorted arrays to get codes for. If None, get codes for all edges.
+        :return rows, cols: np.ndarray
+            Row and column codes
+        """
+
+        positions = self.sorted_positions if edge_idx is None else self.sorted_positions[edge_idx]
+        return np.unravel_index(positions, (len(self.aligned_index), len(self.aligned_columns)), order='F')
+
+    def confidence_columns(self, edge_idx=None):
+        """
+        Get the long-format edge data as arrays
+        :param edge_idx: np.ndarray
+            Positions of the edges in the sorted arrays to get data for. If None, get data for all edges.
+        :return: list(tuple(str, np.ndarray))
+            Column names and arrays for the target, regulator, confidence, and gold standard columns (and any columns
+            from `extra_confidence_columns`)
+        """
+
+        def _take(data):
+            return data if edge_idx is None else data[edge_idx]
+
+        rows, cols = self.sorted_codes(edge_idx)
+
+        # Keep the gold standard as integers unless some edges aren't in the gold standard (like an outer join)
+        gold_standard = _take(self.sorted_gold_standard)
+        if not np.any(np.isnan(gold_standard)):
+            gold_standard = gold_standard.astype(self.gold_standard.values.dtype)
+
+        return [(TARGET_COLUMN, self.aligned_index[rows]),
+                (REGULATOR_COLUMN, self.aligned_columns[cols]),
+                (CONFIDENCE_COLUMN, _take(self.sorted_confidences)),
+                (GOLD_STANDARD_COLUMN, gold_standard)] + \
+               [(col_name, _take(col_data)) for col_name, col_data in self.extra_confidence_columns()]
+
+    def extra_confidence_columns(self):
+        """
+        Additional data to add to the long-format confidence dataframe
+        :return: list(tuple(str, np.ndarray))
+            Column names and arrays which align with `sorted_confidences`
+        """
+        return []
+
+    @staticmethod
+    def align_gold_standard(confidences, gold_standard):
+        """
+        Reindex the confidences and the gold standard onto the same labels and flatten them (column-major, the same
+        order as melting them). Labels which are only in the gold standard are added after the confidence labels.
+
+        :param confidences: pd.DataFrame [G x K]
+        :param gold_standard: pd.DataFrame [G' x K']
+        :return index, columns: pd.Index
+            Labels for the aligned [G'' x K''] data
+        :return confidences, gold_standard: np.ndarray [G''*K'']
+            Flattened data (NaN where there was no value)
+        :return present: np.ndarray [G''*K''] bool
+            Flattened mask of positions which are in either the confidences or the gold standard
+        """
+
+        def _union(left, right):
+            return left if left.equals(right) else left.append(right.difference(left))
+
+        index = _union(confidences.index, gold_standard.index)
+        columns = _union(confidences.columns, gold_standard.columns)
+
+        def _flatten(data):
+            in_data = np.outer(index.isin(data.index), columns.isin(data.columns)).ravel(order='F')
+            if data.index.equals(index) and data.columns.equals(columns):
+                data = data.values
+            else:
+                data = data.reindex(index=index, columns=columns).values
+            return data.astype(float).ravel(order='F'), in_data
+
+        confidences, conf_present = _flatten(confidences)
+        gold_standard, gs_present = _flatten(gold_standard)
+
+        return index, columns, confidences, gold_standard, conf_present | gs_present
+
     def curve_dataframe(self):
         raise NotImplementedError
 
@@ -106,24 +214,49 @@ class RankSummingMetric(object):
     def compute_combined_confidences(rankable_data):
         """
         Calculate confidences based on ranking value in all of the data frames and summing the ranks
-        :param rankable_data: list(pd.DataFrame [M x N])
+        :param rankable_data: list(pd.DataFrame [M x N]) / BootstrapAggregator
+            A list of dataframes, or a BootstrapAggregator which has summed the ranks as each bootstrap finished
         :return combine_conf: pd.DataFrame [M x N]
         """
-        # Create an 0s dataframe shaped to the data to be ranked
-        combine_conf = pd.DataFrame(np.zeros(rankable_data[0].shape),
-                                    index=rankable_data[0].index,
-                                    columns=rankable_data[0].columns)
+
+        if isinstance(rankable_data, bootstrap_aggregator.BootstrapAggregator):
+            return rankable_data.combined_confidences()
+
+        # Create an 0s array shaped to the data to be ranked
+        combine_conf = np.zeros(rankable_data[0].shape, dtype=float)
 
         for replicate in rankable_data:
-            # Flatten and rank based on the beta error reductions
-            ranked_replicate = np.reshape(pd.DataFrame(replicate.values.flatten()).rank().values, replicate.shape)
             # Sum the rankings for each bootstrap
-            combine_conf += ranked_replicate
+            combine_conf += RankSummingMetric.rank_replicate(replicate)
+
+        combine_conf = pd.DataFrame(combine_conf, index=rankable_data[0].index, columns=rankable_data[0].columns)
+        return RankSummingMetric.rank_sum_to_confidences(combine_conf, len(rankable_data))
+
+    @staticmethod
+    def rank_replicate(replicate):
+        """
+        Rank all of the values in a dataframe together. Ties get their average rank and NaNs are not ranked.
+        Only the nonzero values are sorted; the tied block of zeros is given its average rank directly.
+        :param replicate: pd.DataFrame [M x N]
+            Dense or sparse-backed dataframe
+        :return: np.ndarray [M x N]
+            Ranks (float32 if they are exact in float32, float64 otherwise)
+        """
+
+        return bootstrap_aggregator.rank_replicate(replicate)
+
+    @staticmethod
+    def rank_sum_to_confidences(combine_conf, num_replicates):
+        """
+        Convert summed rankings to confidence values
+        :param combine_conf: pd.DataFrame [M x N]
+            Rankings summed over all replicates
+        :param num_replicates: int
+            The number of replicates which were summed
+        :return combine_conf: pd.DataFrame [M x N]
+        """
 
-        # Convert rankings to confidence values
-        min_element = min(combine_conf.values.flatten())
-        combine_conf = (combine_conf - min_element) / (len(rankable_data) * combine_conf.size - min_element)
-        return combine_conf
+        return bootstrap_aggregator.rank_sum_to_confidences(combine_conf, num_replicates)
 
     @staticmethod
     def filter_to_left_size(left_column, right_column, data):
@@ -135,6 +268,16 @@ class RankSummingMetric(object):
         # Return data where both columns are not NA
         return data.dropna(subset=[left_column, right_column])
 
+    @staticmethod
+    def left_size_mask(left, right):
+        # Return a mask where one array (left) is not NA
+        return ~np.isnan(left)
+
+    @staticmethod
+    def overlap_mask(left, right):
+        # Return a mask where both arrays are not NA
+        return ~np.isnan(left) & ~np.isnan(right)
+
 
 class MetricHandler(object):
 
@@ -0,0 +1,246 @@
+"""
+Writers for the result files. Long-format tables (the network and the PR curve) and [G x K] matrices (the combined
+confidences and the thresholded betas) can each be written with a different writer.
+"""
+
+import gzip
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sps
+
+from inferelator import utils
+from inferelator.utils import Validator as check
+
+DEFAULT_TSV_CHUNKSIZE = 100000
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_HDF5_KEY = "data"
+
+
+class OutputWriter(object):
+    """
+    Base class for writing a dataframe into a file in an output directory
+    """
+
+    # Writer name
+    name = None
+
+    # File extension which replaces the extension of the output file name. If None, don't change the file name.
+    file_extension = None
+
+    def write(self, data_frame, output_dir, output_file_name):
+        """
+        Save a DataFrame to a file
+        :param data_frame: pd.DataFrame
+            Data to write
+        :param output_dir: str
+            The path to the output file. If None, don't save anything
+        :param output_file_name: str
+            The output file name. If None, don't save anything
+        :return: str
+            The path to the file which was written (None if nothing was written)
+        """
+
+        assert check.argument_type(data_frame, pd.DataFrame, allow_none=True)
+        assert check.argument_path(output_dir, allow_none=True)
+        assert check.argument_type(output_file_name, str, allow_none=True)
+
+        if output_dir is None or output_file_name is None or data_frame is None:
+            return None
+
+        file_path = os.path.join(output_dir, self.output_file_name(output_file_name))
+        self._write(data_frame, file_path)
+
+        utils.Debug.vprint("{w} wrote {f}".format(w=self.name, f=file_path), level=2)
+        return file_path
+
+    def output_file_name(self, output_file_name):
+        """
+        Get the name of the file that will actually be written
+        :param output_file_name: str
+        :return: str
+        """
+
+        if self.file_extension is None:
+            return output_file_name
+        else:
+            return os.path.splitext(output_file_name)[0] + self.file_extension
+
+    def _write(self, data_frame, file_path):
+        raise NotImplementedError
+
+
+class TSVWriter(OutputWriter):
+    """
+    Write a TSV file (with a header and without the index), in chunks of rows, optionally compressed with gzip
+    """
+
+    name = "TSV"
+
+    chunksize = None
+    compression = None
+    compression_level = DEFAULT_COMPRESSION_LEVEL
+
+    def __init__(self, chunksize=None, compression=None, compression_level=DEFAULT_COMPRESSION_LEVEL):
+        """
+        :param chunksize: int
+            The number of rows to convert to text at a time. If None, write the whole dataframe at once
+        :param compression: str
+            "gzip" to compress the file (and add .gz to the file name). If None, write plain text
+        :param compression_level: int
+            The gzip compression level
+        """
+
+        assert check.argument_integer(chunksize, low=1, allow_none=True)
+        assert check.argument_enum(compression, ("gzip",), allow_none=True)
+        assert check.argument_integer(compression_level, low=0, high=9)
+
+        self.chunksize = chunksize
+        self.compression = compression
+        self.compression_level = compression_level
+
+    def output_file_name(self, output_file_name):
+        return output_file_name + ".gz" if self.compression == "gzip" else output_file_name
+
+    def _write(self, data_frame, file_path):
+
+        if self.chunksize is None and self.compression is None:
+            data_frame.to_csv(file_path, sep="\t", index=False, header=True)
+            return
+
+        if self.compression == "gzip":
+            file_handle = gzip.open(file_path, mode="wt", compresslevel=self.compression_level, newline="")
+        else:
+            file_handle = open(file_path, mode="w", newline="")
+
+        chunksize = data_frame.shape[0] if self.chunksize is None else self.chunksize
+
+        # Convert the dataframe to text one block of rows at a time
+        with file_handle:
+            for i in range(0, max(data_frame.shape[0], 1), max(chunksize, 1)):
+                data_frame.iloc[i:i + chunksize, :].to_csv(file_handle, sep="\t", index=False, header=i == 0)
+
+
+class ParquetWriter(OutputWriter):
+    """
+    Write a parquet file (without the index). Requires pyarrow or fastparquet.
+    """
+
+    name = "Parquet"
+    file_extension = ".parquet"
+
+    def _write(self, data_frame, file_path):
+        data_frame.to_parquet(file_path, index=False)
+
+
+class FeatherWriter(OutputWriter):
+    """
+    Write a feather file (without the index). Requires pyarrow.
+    """
+
+    name = "Feather"
+    file_extension = ".feather"
+
+    def _write(self, data_frame, file_path):
+        data_frame.reset_index(drop=True).to_feather(file_path)
+
+
+class SparseNPZWriter(OutputWriter):
+    """
+    Write a [G x K] matrix as a sparse CSR .npz file with the row and column labels. The file can be loaded with
+    scipy.sparse.load_npz, and the labels are in the `index` and `columns` arrays.
+    """
+
+    name = "NPZ"
+    file_extension = ".npz"
+
+    compressed = True
+
+    def __init__(self, compressed=True):
+        """
+        :param compressed: bool
+            Compress the arrays in the .npz file
+        """
+        self.compressed = compressed
+
+    def _write(self, data_frame, file_path):
+
+        # Get a CSR matrix without making sparse-backed data dense
+        if utils.is_sparse_frame(data_frame):
+            matrix = utils.frame_to_sparse_matrix(data_frame).tocsr()
+        else:
+            matrix = sps.csr_matrix(data_frame.values)
+
+        save_func = np.savez_compressed if self.compressed else np.savez
+        save_func(file_path, format=matrix.format.encode('ascii'), shape=matrix.shape, data=matrix.data,
+                  indices=matrix.indices, indptr=matrix.indptr, index=np.asarray(data_frame.index, dtype=str),
+                  columns=np.asarray(data_frame.columns, dtype=str))
+
+
+class HDF5Writer(OutputWriter):
+    """
+    Write a [G x K] matrix (with the row and column labels) into a compressed HDF5 store. Requires pytables.
+    """
+
+    name = "HDF5"
+    file_extension = ".h5"
+
+    key = DEFAULT_HDF5_KEY
+    compression_level = DEFAULT_COMPRESSION_LEVEL
+
+    def __init__(self, key=DEFAULT_HDF5_KEY, compression_level=DEFAULT_COMPRESSION_LEVEL):
+        """
+        :param key: str
+            The store key to write the matrix into
+        :param compression_level: int
+            The compression level
+        """
+
+        assert check.argument_type(key, str)
+        assert check.argument_integer(compression_level, low=0, high=9)
+
+        self.key = key
+        self.compression_level = compression_level
+
+    def _write(self, data_frame, file_path):
+
+        if utils.is_sparse_frame(data_frame):
+            data_frame = data_frame.sparse.to_dense()
+
+        data_frame.to_hdf(file_path, key=self.key, mode="w", complevel=self.compression_level, complib="zlib")
+
+
+class WriterHandler(object):
+
+    writer_lookup = {"tsv": (TSVWriter, {}),
+                     "tsv.gz": (TSVWriter, {"compression": "gzip", "chunksize": DEFAULT_TSV_CHUNKSIZE}),
+                     "gzip": (TSVWriter, {"compression": "gzip", "chunksize": DEFAULT_TSV_CHUNKSIZE}),
+                     "parquet": (ParquetWriter, {}),
+                     "feather": (FeatherWriter, {}),
+                     "npz": (SparseNPZWriter, {}),
+                     "hdf5": (HDF5Writer, {}),
+                     "h5": (HDF5Writer, {})}
+
+    @classmethod
+    def get_writer(cls, writer_ref):
+        """
+        This wrappers a writer reference so that strings can be used instead of python imports
+        Will either return an OutputWriter instance or will raise an error
+        :param writer_ref: str / OutputWriter
+            String or instance (or subclass) of OutputWriter
+        :return: OutputWriter
+            The writer that corresponds to the string, or the OutputWriter will be passed through
+        """
+
+        if utils.is_string(writer_ref):
+            if writer_ref.lower() in cls.writer_lookup:
+                writer_class, writer_kwargs = cls.writer_lookup[writer_ref.lower()]
+                return writer_class(**writer_kwargs)
+            else:
+                raise ValueError("Writer {writer_str} unknown".format(writer_str=writer_ref))
+        elif isinstance(writer_ref, OutputWriter):
+            return writer_ref
+        elif isinstance(writer_ref, type) and issubclass(writer_ref, OutputWriter):
+            return writer_ref()
+        else:
+            raise ValueError("Writer must be a string or an OutputWriter")
@@ -1,12 +1,14 @@
 import numpy as np
 import pandas as pd
+import scipy.sparse as sps
 import os
 
 from inferelator import utils
 from inferelator.utils import Validator as check
+from inferelator.utils import BootstrapAggregator
 from inferelator.postprocessing.model_performance import RankSummingMetric, MetricHandler
-from inferelator.postprocessing import BETA_SIGN_COLUMN, MEDIAN_EXPLAIN_VAR_COLUMN, CONFIDENCE_COLUMN
-from inferelator.postprocessing import BETA_THRESHOLD_COLUMN, TARGET_COLUMN, REGULATOR_COLUMN, PRIOR_COLUMN
+from inferelator.postprocessing.output_writers import TSVWriter, WriterHandler
+from inferelator.postprocessing import BETA_SIGN_COLUMN, MEDIAN_EXPLAIN_VAR_COLUMN, PRIOR_COLUMN
 
 FILTER_METHODS = ("overlap", "keep_all_gold_standard")
 DEFAULT_BOOTSTRAP_THRESHOLD = 0.5
@@ -31,6 +33,10 @@ class InferelatorResults(object):
     curve_file_name = "pr_curve.pdf"
     curve_data_file_name = None
 
+    # File writers for the long-format tables (network & curve data) and for the [G x K] matrices
+    network_writer = TSVWriter()
+    matrix_writer = TSVWriter()
+
     # Performance metrics
     metric = None
     curve = None
@@ -56,16 +62,17 @@ class InferelatorResults(object):
         # Validate that the output path exists (create it if necessary)
         check.argument_path(output_dir, allow_none=True, create_if_needed=True)
 
-        # Write TSV files
-        self.write_to_tsv(self.network, output_dir, self.network_file_name)
-        self.write_to_tsv(self.combined_confidences, output_dir, self.confidence_file_name)
-        self.write_to_tsv(self.betas_stack, output_dir, self.threshold_file_name)
-        self.write_to_tsv(self.curve, output_dir, self.curve_data_file_name)
+        # Write data files (in the background if the output queue is set to do so)
+        utils.OutputQueue.submit(self.network_writer.write, self.network, output_dir, self.network_file_name)
+        utils.OutputQueue.submit(self.matrix_writer.write, self.combined_confidences, output_dir,
+                                 self.confidence_file_name)
+        utils.OutputQueue.submit(self.matrix_writer.write, self.betas_stack, output_dir, self.threshold_file_name)
+        utils.OutputQueue.submit(self.network_writer.write, self.curve, output_dir, self.curve_data_file_name)
 
         if self.curve_file_name is None:
             pass
         else:
-            self.metric.output_curve_pdf(output_dir, self.curve_file_name)
+            utils.OutputQueue.submit(self.metric.output_curve_pdf, output_dir, self.curve_file_name)
 
     def clear_output_file_names(self):
         """
@@ -78,6 +85,21 @@ class InferelatorResults(object):
         self.curve_file_name = None
         self.curve_data_file_name = None
 
+    def set_output_writers(self, network_writer=None, matrix_writer=None):
+        """
+        Set the writers used to output files. Anything which is None will not be changed.
+        :param network_writer: str / OutputWriter
+            Writer for the network & curve data tables ("tsv", "tsv.gz", "parquet", "feather", or an OutputWriter)
+        :param matrix_writer: str / OutputWriter
+            Writer for the combined confidences & beta threshold matrices ("tsv", "tsv.gz", "npz", "hdf5", or an
+            OutputWriter)
+        """
+
+        if network_writer is not None:
+            self.network_writer = WriterHandler.get_writer(network_writer)
+
+        if matrix_writer is not None:
+            self.matrix_writer = WriterHandler.get_writer(matrix_writer)
 
     @staticmethod
     def write_to_tsv(data_frame, output_dir, output_file_name):
@@ -124,15 +146,21 @@ class ResultsProcessor(object):
     # Model result object
     result_object = InferelatorResults
 
+    # Writers for the result object output (None uses the result object defaults)
+    network_writer = None
+    matrix_writer = None
+
     # Model metric
     metric = None
 
     def __init__(self, betas, rescaled_betas, threshold=None, filter_method=None, metric=None):
         """
-        :param betas: list(pd.DataFrame[G x K]) [B]
-            A list of model weights per bootstrap
+        :param betas: list(pd.DataFrame[G x K]) [B] / BootstrapAggregator
+            A list of model weights per bootstrap. These can be dense or sparse-backed (see utils.make_sparse_frame)
+            This can also be a BootstrapAggregator which has summarized each bootstrap as it finished
         :param rescaled_betas: list(pd.DataFrame[G x K]) [B]
-            A list of the variance explained by each parameter per bootstrap
+            A list of the variance explained by each parameter per bootstrap. These can be dense or sparse-backed
+            If betas is a BootstrapAggregator, this should be None (or the same BootstrapAggregator)
         :param threshold: float
             The proportion of bootstraps which an model weight must be non-zero for inclusion in the network output
         :param filter_method: str
@@ -144,7 +172,7 @@ class ResultsProcessor(object):
         self.validate_init_args(betas, rescaled_betas, threshold=threshold, filter_method=filter_method, metric=metric)
 
         self.betas = betas
-        self.rescaled_betas = rescaled_betas
+        self.rescaled_betas = betas if isinstance(betas, BootstrapAggregator) else rescaled_betas
         self.filter_method = self.filter_method if filter_method is None else filter_method
         self.threshold = self.threshold if threshold is None else threshold
 
@@ -153,6 +181,14 @@ class ResultsProcessor(object):
 
     @staticmethod
     def validate_init_args(betas, rescaled_betas, threshold=None, filter_method=None, metric=None):
+        assert check.argument_enum(filter_method, FILTER_METHODS, allow_none=True)
+        assert check.argument_numeric(threshold, 0, 1, allow_none=True)
+
+        # A BootstrapAggregator holds both the betas and the rescaled betas
+        if isinstance(betas, BootstrapAggregator):
+            assert rescaled_betas is None or rescaled_betas is betas
+            return
+
         assert check.argument_type(betas, list)
         assert check.argument_type(betas[0], pd.DataFrame)
         assert check.dataframes_align(betas)
@@ -192,6 +228,7 @@ class ResultsProcessor(object):
 
         # Create a InferelatorResult object and have it write output files
         result = self.result_object(network_data, beta_threshold, rs_calc.all_confidences, rs_calc)
+        result.set_output_writers(network_writer=self.network_writer, matrix_writer=self.matrix_writer)
 
         if self.write_results and output_dir is not None:
             result.write_result_files(output_dir)
@@ -209,7 +246,7 @@ class ResultsProcessor(object):
         :param confidence_threshold: numeric
             The minimum confidence score needed to write a network edge
         :param beta_threshold: pd.DataFrame [G x K]
-            The thresholded betas to include in the network. If None, include everything.
+            The thresholded betas. These are not used to filter the network edges
         :param extra_columns: dict(col_name: pd.DataFrame [G x K])
             Any additional data to include, keyed by column name and indexable with row and column names
         :return network_data: pd.DataFrame [(G*K) x 7+]
@@ -222,39 +259,34 @@ class ResultsProcessor(object):
         assert check.argument_type(beta_threshold, pd.DataFrame, allow_none=True)
         assert check.argument_numeric(confidence_threshold, 0, 1)
 
-        # Get the combined confidences and subset for confidence threshold
-        network_data = metric.confidence_dataframe()
-        network_data = network_data.loc[network_data[CONFIDENCE_COLUMN] > confidence_threshold, :]
+        # Get the edges (sorted by confidence) which pass the confidence threshold
+        with np.errstate(invalid='ignore'):
+            keep_edges = metric.sorted_confidences > confidence_threshold
 
-        # If beta_threshold has been provided, melt and join it to the network data
-        # Then discard anything which isn't meeting the threshold
-        if beta_threshold is not None and False:
-            beta_data = utils.melt_and_reindex_dataframe(beta_threshold, BETA_THRESHOLD_COLUMN)
-            network_data = network_data.join(beta_data, on=[TARGET_COLUMN, REGULATOR_COLUMN])
-            network_data = network_data.loc[network_data[BETA_THRESHOLD_COLUMN] == 1, :]
-            del network_data[BETA_THRESHOLD_COLUMN]
+        # Get the row and column codes for the edges so that other [G x K] data can be gathered by position
+        edge_idx = np.flatnonzero(keep_edges)
+        rows, cols = metric.sorted_codes(edge_idx)
+
+        network_columns = metric.confidence_columns(edge_idx)
 
         if priors is not None:
-            prior_data = utils.melt_and_reindex_dataframe(priors, PRIOR_COLUMN)
-            network_data = network_data.join(prior_data, on=[TARGET_COLUMN, REGULATOR_COLUMN])
+            network_columns.append((PRIOR_COLUMN, _gather_edges(priors, metric.aligned_index,
+                                                                metric.aligned_columns, rows, cols)))
 
         # Add any extra columns as needed
         if extra_columns is not None:
             for k in sorted(extra_columns.keys()):
-                extra_data = utils.melt_and_reindex_dataframe(extra_columns[k], k)
-                network_data = network_data.join(extra_data, on=[TARGET_COLUMN, REGULATOR_COLUMN])
-
-        # Make sure all missing values are NaN
-        network_data[pd.isnull(network_data)] = np.nan
+                network_columns.append((k, _gather_edges(extra_columns[k], metric.aligned_index,
+                                                         metric.aligned_columns, rows, cols)))
 
-        return network_data
+        return pd.DataFrame(dict(network_columns), index=edge_idx, columns=[k for k, _ in network_columns])
 
     @staticmethod
     def threshold_and_summarize(betas, threshold):
         """
         Summarize a stack of betas
         Returns dataframes
-        :param betas: list(pd.DataFrame)
+        :param betas: list(pd.DataFrame) / BootstrapAggregator
             A list of dataframes that are aligned on both axes
         :param threshold: numeric
             The proportion of bootstraps an interaction must occur in to be valid
@@ -271,7 +303,7 @@ class ResultsProcessor(object):
         """
         Compute summary information about betas
 
-        :param betas: list(pd.DataFrame) B x [M x N]
+        :param betas: list(pd.DataFrame) B x [M x N] / BootstrapAggregator
             A list of dataframes that are aligned on both axes
         :return betas_sign: pd.DataFrame [M x N]
             A dataframe with the summation of np.sign() for each bootstrap
@@ -279,8 +311,22 @@ class ResultsProcessor(object):
             A dataframe with a count of the number of non-zero betas for an interaction
         """
 
+        if isinstance(betas, BootstrapAggregator):
+            return betas.summarize()
+
         assert check.dataframes_align(betas)
 
+        # Sum sparse betas without making dense copies of each bootstrap
+        if any(utils.is_sparse_frame(beta) for beta in betas):
+            betas_sign, betas_non_zero = sps.csr_matrix(betas[0].shape), sps.csr_matrix(betas[0].shape, dtype=int)
+            for beta in betas:
+                beta = utils.frame_to_sparse_matrix(beta)
+                betas_sign = betas_sign + beta.sign()
+                betas_non_zero = betas_non_zero + (beta != 0).astype(int)
+
+            return (pd.DataFrame(betas_sign.A, index=betas[0].index, columns=betas[0].columns),
+                    pd.DataFrame(betas_non_zero.A.astype(float), index=betas[0].index, columns=betas[0].columns))
+
         betas_sign = pd.DataFrame(np.zeros(betas[0].shape), index=betas[0].index, columns=betas[0].columns)
         betas_non_zero = pd.DataFrame(np.zeros(betas[0].shape), index=betas[0].index, columns=betas[0].columns)
         for beta in betas:
@@ -317,7 +363,7 @@ class ResultsProcessor(object):
         """
         Calculate the mean and median values of a list of dataframes
         Returns dataframes with the same dimensions as any one of the input stack
-        :param stack: list(pd.DataFrame)
+        :param stack: list(pd.DataFrame) / BootstrapAggregator
             List of dataframes which have the same size and dimensions
         :return mean_data: pd.DataFrame
             Mean values
@@ -325,9 +371,98 @@ class ResultsProcessor(object):
             Median values
         """
 
+        if isinstance(stack, BootstrapAggregator):
+            return stack.mean_and_median()
+
         assert check.dataframes_align(stack)
 
+        if any(utils.is_sparse_frame(x) for x in stack):
+            return ResultsProcessor._sparse_mean_and_median(stack)
+
         matrix_stack = [x.values for x in stack]
         mean_data = pd.DataFrame(np.mean(matrix_stack, axis=0), index=stack[0].index, columns=stack[0].columns)
         median_data = pd.DataFrame(np.median(matrix_stack, axis=0), index=stack[0].index, columns=stack[0].columns)
         return mean_data, median_data
+
+    @staticmethod
+    def _sparse_mean_and_median(stack):
+        """
+        Calculate the mean and median values of a list of sparse-backed dataframes. Only the entries which are nonzero
+        in any dataframe are stacked, so memory scales with the nonzero entries instead of with the dataframe size
+        :param stack: list(pd.DataFrame)
+            List of dataframes which have the same size and dimensions
+        :return mean_data: pd.DataFrame
+            Mean values
+        :return median_data:
+            Median values
+        """
+
+        mean_data, median_data = _sparse_stack_mean_and_median([utils.frame_to_sparse_matrix(x) for x in stack],
+                                                               stack[0].shape)
+
+        return (pd.DataFrame(mean_data, index=stack[0].index, columns=stack[0].columns),
+                pd.DataFrame(median_data, index=stack[0].index, columns=stack[0].columns))
+
+
+def _sparse_stack_mean_and_median(matrix_stack, shape):
+    """
+    Calculate the mean and median values of a list of sparse matrices. Only the entries which are nonzero in any
+    matrix are stacked, so memory scales with the nonzero entries instead of with the matrix size
+
+    :param matrix_stack: list(sp.spmatrix [M x N])
+    :param shape: tuple
+        The shape of the matrices (M, N)
+    :return mean_data, median_data: np.ndarray [M x N], np.ndarray [M x N]
+    """
+
+    # Find every entry that is nonzero in at least one of the stack
+    nonzero = sps.csr_matrix(shape, dtype=int)
+    for x in matrix_stack:
+        nonzero = nonzero + (x != 0).astype(int)
+    row_idx, col_idx = nonzero.nonzero()
+
+    # Pull those entries from each matrix into a dense [B x nnz] array
+    if len(row_idx) > 0:
+        values = np.vstack([np.asarray(x.tocsr()[row_idx, col_idx]).ravel() for x in matrix_stack])
+    else:
+        values = np.zeros((len(matrix_stack), 0))
+
+    mean_data, median_data = np.zeros(shape), np.zeros(shape)
+    mean_data[row_idx, col_idx] = np.mean(values, axis=0)
+    median_data[row_idx, col_idx] = np.median(values, axis=0)
+
+    return mean_data, median_data
+
+
+def _gather_edges(data_frame, index, columns, rows, cols):
+    """
+    Gather values for edges out of a [G x K] dataframe by position
+    :param data_frame: pd.DataFrame [G x K]
+        Data to gather values from
+    :param index: pd.Index
+        Labels which the row codes refer to
+    :param columns: pd.Index
+        Labels which the column codes refer to
+    :param rows: np.ndarray [N]
+        Row codes for each edge
+    :param cols: np.ndarray [N]
+        Column codes for each edge
+    :return: np.ndarray [N]
+        Values for each edge (NaN if the edge isn't in the dataframe)
+    """
+
+    if data_frame.index.equals(index) and data_frame.columns.equals(columns):
+        return data_frame.values[rows, cols]
+
+    # Translate the codes into positions in this dataframe if the labels aren't the same
+    rows = data_frame.index.get_indexer(index)[rows]
+    cols = data_frame.columns.get_indexer(columns)[cols]
+    missing = (rows < 0) | (cols < 0)
+
+    values = data_frame.values[rows, cols]
+
+    if np.any(missing):
+        values = values.astype(float)
+        values[missing] = np.nan
+
+    return values
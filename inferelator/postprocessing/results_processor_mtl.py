@@ -22,7 +22,7 @@ class ResultsProcessorMultiTask(results_processor.ResultsProcessor):
 
     def __init__(self, betas, rescaled_betas, threshold=None, filter_method=None, metric=None):
         """
-        :param betas: list(list(pd.DataFrame[G x K]) [B]) [T]
+        :param betas: list(list(pd.DataFrame[G x K]) [B]) [T] / list(BootstrapAggregator) [T]
             A list of the task inferelator outputs per bootstrap per task
         :param rescaled_betas: list(list(pd.DataFrame[G x K]) [B]) [T]
             A list of the variance explained by each parameter per bootstrap per task
@@ -36,12 +36,22 @@ class ResultsProcessorMultiTask(results_processor.ResultsProcessor):
 
         super(ResultsProcessorMultiTask, self).__init__(betas, rescaled_betas, threshold, filter_method, metric)
 
+        if all(isinstance(b, utils.BootstrapAggregator) for b in betas):
+            self.rescaled_betas = betas
+
         # Make up some default names
         # The workflow will have to replace these with real names if necessary
         self.tasks_names = list(map(str, range(len(self.betas))))
 
     @staticmethod
     def validate_init_args(betas, rescaled_betas, threshold=None, filter_method=None, metric=None):
+        assert check.argument_enum(filter_method, results_processor.FILTER_METHODS, allow_none=True)
+        assert check.argument_numeric(threshold, 0, 1, allow_none=True)
+
+        # Each task can have a BootstrapAggregator which holds both the betas and the rescaled betas
+        if all(isinstance(b, utils.BootstrapAggregator) for b in betas):
+            return
+
         assert check.argument_type(betas, list)
         assert check.argument_list_type(betas, list)
         assert check.argument_list_type(betas[0], pd.DataFrame)
@@ -75,12 +85,15 @@ class ResultsProcessorMultiTask(results_processor.ResultsProcessor):
         overall_resc_betas = []
 
         # Get intersection of indices
-        gene_set = list(set([i for df in self.betas for i in df[0].index.tolist()]))
-        tf_set = list(set([i for df in self.betas for i in df[0].columns.tolist()]))
+        # Get the labels from the first bootstrap (or from the aggregator) of each task
+        task_labels = [b if isinstance(b, utils.BootstrapAggregator) else b[0] for b in self.betas]
+
+        gene_set = list(set([i for df in task_labels for i in df.index.tolist()]))
+        tf_set = list(set([i for df in task_labels for i in df.columns.tolist()]))
 
         # Use the existing indices if there's no difference from the intersection
-        gene_set = gene_set if len(self.betas[0][0].index.symmetric_difference(gene_set)) != 0 else self.betas[0][0].index
-        tf_set = tf_set if len(self.betas[0][0].columns.symmetric_difference(tf_set)) != 0 else self.betas[0][0].columns
+        gene_set = gene_set if len(task_labels[0].index.symmetric_difference(gene_set)) != 0 else task_labels[0].index
+        tf_set = tf_set if len(task_labels[0].columns.symmetric_difference(tf_set)) != 0 else task_labels[0].columns
 
         # Create empty dataframes for task-specific results
         overall_sign = pd.DataFrame(np.zeros((len(gene_set), len(tf_set))),
@@ -119,6 +132,7 @@ class ResultsProcessorMultiTask(results_processor.ResultsProcessor):
 
             task_result = self.result_object(task_network_data, task_threshold, task_rs_calc.all_confidences,
                                              task_rs_calc)
+            task_result.set_output_writers(network_writer=self.network_writer, matrix_writer=self.matrix_writer)
 
             if self.write_task_files is True and output_dir is not None:
                 task_result.write_result_files(os.path.join(output_dir, task_name))
@@ -140,6 +154,7 @@ class ResultsProcessorMultiTask(results_processor.ResultsProcessor):
         overall_result = self.result_object(network_data, overall_threshold,
                                             _df_resizer(overall_rs_calc.all_confidences, gene_set, tf_set),
                                             overall_rs_calc)
+        overall_result.set_output_writers(network_writer=self.network_writer, matrix_writer=self.matrix_writer)
         overall_result.write_result_files(output_dir)
 
         return overall_result
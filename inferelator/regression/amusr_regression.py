@@ -194,6 +194,9 @@ class AMuSR_regression(base_regression.BaseRegression):
     prior_weight = 1.0  # float
     remove_autoregulation = True  # bool
 
+    # AMuSR results are per-task DataFrames which are piled up by AMuSR_regression.pileup_data
+    result_container = None
+
     def __init__(self, X, Y, tfs=None, genes=None, priors=None, prior_weight=1, remove_autoregulation=True):
         """
         Set up a regression object for multitask regression
@@ -260,7 +263,8 @@ class AMuSR_regression(base_regression.BaseRegression):
         if MPControl.is_dask():
             from inferelator.distributed.dask_functions import amusr_regress_dask
             return amusr_regress_dask(self.X, self.Y, self.priors, self.prior_weight, self.n_tasks, self.genes,
-                                      self.tfs, self.G, remove_autoregulation=self.remove_autoregulation)
+                                      self.tfs, self.G, remove_autoregulation=self.remove_autoregulation,
+                                      gene_blocks=self.gene_blocks())
 
         def regression_maker(j):
             level = 0 if j % 100 == 0 else 2
@@ -284,7 +288,7 @@ class AMuSR_regression(base_regression.BaseRegression):
             prior = format_prior(self.priors, gene, tasks, self.prior_weight)
             return run_regression_EBIC(x, y, tfs, tasks, gene, prior)
 
-        return MPControl.map(regression_maker, range(self.G))
+        return self.map_genes(regression_maker)
 
     def pileup_data(self, run_data):
 
@@ -476,8 +480,7 @@ class _MultitaskRegressionWorkflow(base_regression.RegressionWorkflow):
 
     def run_regression(self):
 
-        betas = [[] for _ in range(self._n_tasks)]
-        rescaled_betas = [[] for _ in range(self._n_tasks)]
+        betas, rescaled_betas = map(list, zip(*[self._bootstrap_stash() for _ in range(self._n_tasks)]))
 
         for idx in range(self.num_bootstraps):
             utils.Debug.vprint('Bootstrap {} of {}'.format((idx + 1), self.num_bootstraps), level=0)
@@ -485,8 +488,7 @@ class _MultitaskRegressionWorkflow(base_regression.RegressionWorkflow):
 
             if self.is_master():
                 for k in range(self._n_tasks):
-                    betas[k].append(current_betas[k])
-                    rescaled_betas[k].append(current_rescaled_betas[k])
+                    self._stash_bootstrap(betas[k], rescaled_betas[k], current_betas[k], current_rescaled_betas[k])
 
         return betas, rescaled_betas
 
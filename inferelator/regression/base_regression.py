@@ -2,26 +2,190 @@ import numpy as np
 import pandas as pd
 import scipy.stats
 import copy
+import math
 
-from inferelator.utils import Debug, InferelatorData
+from inferelator.utils import Debug, InferelatorData, BootstrapAggregator, make_sparse_frame
 from inferelator.distributed.inferelator_mp import MPControl
 from inferelator.utils import Validator as check
+from inferelator.utils.bootstrap_aggregator import DEFAULT_MEDIAN_SKETCH_SIZE
 
 DEFAULT_CHUNK = 25
 PROGRESS_STR = "Regression on {gn} [{i} / {total}]"
 
+# Number of entries to preallocate in a RegressionResults container
+DEFAULT_RESULTS_CAPACITY = 256
+
+# Number of gene blocks to make for each worker when the gene block size is "auto"
+DEFAULT_GENE_BLOCKS_PER_WORKER = 4
+
+# Largest condition number of xTx for calculating leave-one-out error reduction from its inverse
+LEAVE_ONE_OUT_CONDITION_LIMIT = 1e8
+
+
+class RegressionResults(object):
+    """
+    Compact container for the results of regression on one or more genes.
+    Only the nonzero (target, regulator, beta, beta_resc) entries are kept, in preallocated arrays which grow as needed
+    """
+
+    target = None  # np.ndarray [int]
+    regulator = None  # np.ndarray [int]
+    betas = None  # np.ndarray [float]
+    betas_resc = None  # np.ndarray [float]
+
+    # Number of entries which have been filled
+    n = 0
+
+    def __init__(self, capacity=DEFAULT_RESULTS_CAPACITY):
+        """
+        :param capacity: Number of entries to preallocate
+        :type capacity: int
+        """
+
+        self.target = np.zeros(capacity, dtype=np.int32)
+        self.regulator = np.zeros(capacity, dtype=np.int32)
+        self.betas = np.zeros(capacity, dtype=float)
+        self.betas_resc = np.zeros(capacity, dtype=float)
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def add(self, ind, pp, betas, betas_resc):
+        """
+        Add the regression results for one gene
+
+        :param ind: Target gene index
+        :type ind: int
+        :param pp: Boolean array indicating which regulators are in the model [K, ]
+        :type pp: np.ndarray, list
+        :param betas: Betas for the regulators in the model [sum(pp), ]
+        :type betas: np.ndarray
+        :param betas_resc: Error reductions for the regulators in the model [sum(pp), ]
+        :type betas_resc: np.ndarray
+        """
+
+        regulator = np.flatnonzero(pp)
+        betas, betas_resc = np.ravel(betas), np.ravel(betas_resc)
+
+        keep = (betas != 0) | (betas_resc != 0)
+        n_keep = np.sum(keep)
+
+        self._reserve(self.n + n_keep)
+        self.target[self.n:self.n + n_keep] = ind
+        self.regulator[self.n:self.n + n_keep] = regulator[keep]
+        self.betas[self.n:self.n + n_keep] = betas[keep]
+        self.betas_resc[self.n:self.n + n_keep] = betas_resc[keep]
+        self.n += n_keep
+
+    def add_result(self, data):
+        """
+        Add a regression result dict or another RegressionResults container
+
+        :param data: Regression result dict with `ind`, `pp`, `betas` and `betas_resc` keys, or RegressionResults
+        :type data: dict, RegressionResults
+        """
+
+        # If data is None assume a null model
+        if data is None:
+            raise RuntimeError("No model produced by regression method")
+
+        if isinstance(data, RegressionResults):
+            self._reserve(self.n + data.n)
+            for attr in ("target", "regulator", "betas", "betas_resc"):
+                getattr(self, attr)[self.n:self.n + data.n] = getattr(data, attr)[:data.n]
+            self.n += data.n
+        else:
+            self.add(data['ind'], data['pp'], data['betas'], data['betas_resc'])
+
+    def trim(self):
+        """
+        Drop the unfilled part of the preallocated arrays (so that nothing extra is pickled)
+
+        :return: self
+        :rtype: RegressionResults
+        """
+
+        self.target, self.regulator = self.target[:self.n].copy(), self.regulator[:self.n].copy()
+        self.betas, self.betas_resc = self.betas[:self.n].copy(), self.betas_resc[:self.n].copy()
+        return self
+
+    def pileup(self, G, K):
+        """
+        Put the regression results into dense arrays
+
+        :param G: Number of target genes
+        :type G: int
+        :param K: Number of regulators
+        :type K: int
+        :return betas, betas_rescale: Dense arrays of betas and error reductions [G x K]
+        :rtype: np.ndarray, np.ndarray
+        """
+
+        betas = np.zeros((G, K), dtype=np.dtype(float))
+        betas_rescale = np.zeros((G, K), dtype=np.dtype(float))
+
+        betas[self.target[:self.n], self.regulator[:self.n]] = self.betas[:self.n]
+        betas_rescale[self.target[:self.n], self.regulator[:self.n]] = self.betas_resc[:self.n]
+
+        return betas, betas_rescale
+
+    def _reserve(self, size):
+        """
+        Grow the preallocated arrays (by at least doubling them) so that they can hold size entries
+        """
+
+        capacity = self.target.shape[0]
+        if size <= capacity:
+            return
+
+        capacity = max(size, 2 * capacity)
+        for attr in ("target", "regulator", "betas", "betas_resc"):
+            old = getattr(self, attr)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, attr, new)
+
+    @classmethod
+    def from_results(cls, results):
+        """
+        Pack regression result dicts or RegressionResults containers into a single trimmed container
+
+        :param results: Iterable of regression result dicts or RegressionResults
+        :type results: iterable
+        :return: RegressionResults
+        """
+
+        container = cls()
+        for data in results:
+            container.add_result(data)
+        return container.trim()
+
 
 class BaseRegression(object):
     # These are all the things that have to be set in a new regression class
 
     chunk = DEFAULT_CHUNK  # int
 
+    # Regress contiguous blocks of genes as single tasks
+    # None is one task per gene, "auto" picks a block size from G and the number of workers
+    gene_block_size = "auto"  # int, str, None
+
+    # Workers pack regression result dicts into this container before returning them
+    # None returns the result dicts from the regression function unchanged
+    result_container = RegressionResults  # RegressionResults, None
+
     # Raw Data
     X = None  # [K x N] float
     Y = None  # [G x N] float
     G = None  # int G
     K = None  # int K
 
+    # The full response data and the row index that Y was bootstrapped from (if they're known)
+    # Engines with long-lived workers can keep the full response data and only send them the bootstrap index
+    response_source = None  # InferelatorData
+    bootstrap_index = None  # np.ndarray [N, ]
+
     def __init__(self, X, Y):
         """
         Create a regression object and do basic data transforms
@@ -65,38 +229,145 @@ class BaseRegression(object):
         MPControl.sync_processes("post_pileup")
         return pileup_data
 
+    def set_bootstrap_source(self, response, bootstrap_index):
+        """
+        Set the full response data that Y was bootstrapped from (with response.get_bootstrap(bootstrap_index))
+
+        :param response: Full response expression data [N x G]
+        :type response: InferelatorData
+        :param bootstrap_index: Bootstrap row index
+        :type bootstrap_index: np.ndarray, list
+        :return: self
+        """
+
+        if not response.gene_names.equals(pd.Index(self.genes)):
+            raise ValueError("Response data does not have the same genes as the bootstrapped response data")
+
+        self.response_source = response
+        self.bootstrap_index = np.asarray(bootstrap_index)
+        return self
+
     def regress(self):
         """
-        Execute regression and return a list which can be provided to pileup_data
+        Execute regression and return a list (or an iterator) which can be provided to pileup_data
         :return: list
         """
         raise NotImplementedError
 
-    def pileup_data(self, run_data):
+    def gene_blocks(self):
         """
-        Take the completed run data and pack it up into a DataFrame of betas
+        Split the response genes into contiguous blocks which are each regressed as a single task
 
-        :param run_data: list
-            A list of regression result dicts ordered by gene. Each regression result should have `ind`, `pp`, `betas`
-            and `betas_resc` keys with the appropriate data.
-        :return betas, betas_rescale: (pd.DataFrame [G x K], pd.DataFrame [G x K])
+        :return: A list of gene index ranges
+        :rtype: list(range)
+        """
+
+        if self.gene_block_size is None:
+            block_size = 1
+        elif self.gene_block_size == "auto":
+            block_size = gene_block_size_auto(self.G, MPControl.num_workers())
+        else:
+            assert check.argument_integer(self.gene_block_size, low=1)
+            block_size = self.gene_block_size
+
+        return [range(i, min(i + block_size, self.G)) for i in range(0, self.G, block_size)]
+
+    def map_genes(self, regression_maker, **kwargs):
+        """
+        Map a regression function across all genes with MPControl, sending one task for each block of genes
+
+        :param regression_maker: A function which takes a gene index and returns a regression result
+        :type regression_maker: callable
+        :param kwargs: Any additional keyword arguments are passed to MPControl.map
+        :return: A list of regression results ordered by gene, or a list of result containers (one for each block)
+            if result_container is set
+        :rtype: list
+        """
+
+        blocks = self.gene_blocks()
+        container = self.result_container
+
+        if len(blocks) == self.G and container is None:
+            return MPControl.map(regression_maker, range(self.G), **kwargs)
+        elif len(blocks) < self.G:
+            Debug.vprint("Regressing {g} genes in {n} blocks".format(g=self.G, n=len(blocks)), level=1)
+            kwargs["chunksize"] = 1
+
+        block_data = MPControl.map(self._block_maker(regression_maker), blocks, **kwargs)
+
+        # Children of a KVS map don't get the results back
+        if block_data is None or container is not None:
+            return block_data
+
+        return [data for block in block_data for data in block]
+
+    def imap_genes(self, regression_maker, **kwargs):
+        """
+        Map a regression function across all genes with MPControl.imap, sending one task for each block of genes.
+        Results are returned as blocks finish, so that they can be piled up while other blocks are still running
+
+        :param regression_maker: A function which takes a gene index and returns a regression result
+        :type regression_maker: callable
+        :param kwargs: Any additional keyword arguments are passed to MPControl.imap
+        :return: An iterator of regression results, or of result containers (one for each block) if result_container
+            is set, in the order that blocks finish
+        :rtype: iterator
+        """
+
+        blocks = self.gene_blocks()
+
+        if len(blocks) < self.G:
+            Debug.vprint("Regressing {g} genes in {n} blocks".format(g=self.G, n=len(blocks)), level=1)
+            kwargs["chunksize"] = 1
+
+        block_data = MPControl.imap(self._block_maker(regression_maker), blocks, **kwargs)
+        return self._finished_blocks(block_data, blocks)
+
+    def _block_maker(self, regression_maker):
+        """
+        Wrap a regression function so that it regresses a block of genes and packs them into the result container
         """
 
-        # Create G x K arrays of 0s to populate with the regression data
-        betas = np.zeros((self.G, self.K), dtype=np.dtype(float))
-        betas_rescale = np.zeros((self.G, self.K), dtype=np.dtype(float))
+        container = self.result_container
+
+        def block_maker(block):
+            if container is None:
+                return [regression_maker(j) for j in block]
+            else:
+                return container.from_results(regression_maker(j) for j in block)
+
+        return block_maker
+
+    def _finished_blocks(self, block_data, blocks):
+        """
+        Yield the results from (index, block result) tuples and report progress as blocks finish
+        """
 
-        # Populate the zero arrays with the BBSR betas
-        for data in run_data:
+        n_done = 0
 
-            # If data is None assume a null model
-            if data is None:
-                raise RuntimeError("No model produced by regression method")
+        for b, data in block_data:
+            n_done += len(blocks[b])
+            Debug.vprint("Regression complete on {n} / {total} genes".format(n=n_done, total=self.G), level=2)
 
-            xidx = data['ind']  # Int
-            yidx = data['pp']  # Boolean array of size K
-            betas[xidx, yidx] = data['betas']
-            betas_rescale[xidx, yidx] = data['betas_resc']
+            if self.result_container is None:
+                for result in data:
+                    yield result
+            else:
+                yield data
+
+    def pileup_data(self, run_data):
+        """
+        Take the completed run data and pack it up into a DataFrame of betas
+
+        :param run_data: iterable
+            An iterable of RegressionResults containers or regression result dicts (in any order).
+            Each regression result dict should have `ind`, `pp`, `betas` and `betas_resc` keys with the appropriate
+            data.
+        :return betas, betas_rescale: (pd.DataFrame [G x K], pd.DataFrame [G x K])
+        """
+
+        # Populate G x K arrays of 0s with the regression data
+        betas, betas_rescale = RegressionResults.from_results(run_data).pileup(self.G, self.K)
 
         d_len, b_avg, null_m = self._summary_stats(betas)
         Debug.vprint("Regression complete:", end=" ", level=0)
@@ -118,12 +389,39 @@ class BaseRegression(object):
         return d_len, b_avg, null_m
 
 
+def gene_block_size_auto(n_genes, n_workers, blocks_per_worker=DEFAULT_GENE_BLOCKS_PER_WORKER):
+    """
+    Choose a gene block size that gives each worker a few blocks (so the load is balanced as blocks finish)
+
+    :param n_genes: Number of genes to regress
+    :type n_genes: int
+    :param n_workers: Number of workers
+    :type n_workers: int
+    :param blocks_per_worker: Number of blocks to make for each worker
+    :type blocks_per_worker: int
+    :return: Number of genes in each block
+    :rtype: int
+    """
+
+    return max(int(math.ceil(n_genes / max(n_workers * blocks_per_worker, 1))), 1)
+
+
 class RegressionWorkflow(object):
     """
     RegressionWorkflow implements run_regression and run_bootstrap
     Each regression method needs to extend this to implement run_bootstrap (and also run_regression if necessary)
     """
 
+    # Keep the betas from each bootstrap as sparse-backed dataframes
+    use_sparse_betas = False
+
+    # Fold the betas from each bootstrap into a BootstrapAggregator instead of keeping them all
+    online_bootstrap_aggregation = False
+
+    # Number of nonzero rescaled betas to keep for each edge for the online median, or keep all of them if exact_median
+    median_sketch_size = DEFAULT_MEDIAN_SKETCH_SIZE
+    exact_median = False
+
     def set_regression_parameters(self, **kwargs):
         """
         Set any parameters which are specific to one or another regression method
@@ -131,8 +429,7 @@ class RegressionWorkflow(object):
         pass
 
     def run_regression(self):
-        betas = []
-        rescaled_betas = []
+        betas, rescaled_betas = self._bootstrap_stash()
 
         MPControl.sync_processes("pre_regression")
 
@@ -141,8 +438,7 @@ class RegressionWorkflow(object):
             np.random.seed(self.random_seed + idx)
             current_betas, current_rescaled_betas = self.run_bootstrap(bootstrap)
             if self.is_master():
-                betas.append(current_betas)
-                rescaled_betas.append(current_rescaled_betas)
+                self._stash_bootstrap(betas, rescaled_betas, current_betas, current_rescaled_betas)
 
             MPControl.sync_processes("post_bootstrap")
 
@@ -151,8 +447,36 @@ class RegressionWorkflow(object):
     def run_bootstrap(self, bootstrap):
         raise NotImplementedError
 
+    def _bootstrap_stash(self):
+        """
+        Create somewhere to put the results from each bootstrap
+        :return: Either a BootstrapAggregator (twice) if online_bootstrap_aggregation is set or two empty lists
+        """
+        if self.online_bootstrap_aggregation:
+            sketch_size = None if self.exact_median else self.median_sketch_size
+            aggregator = BootstrapAggregator(median_sketch_size=sketch_size, random_seed=self.random_seed)
+            return aggregator, aggregator
+        else:
+            return [], []
 
-def recalculate_betas_from_selected(x, y, idx=None):
+    def _stash_bootstrap(self, betas, rescaled_betas, current_betas, current_rescaled_betas):
+        """
+        Add the results from one bootstrap to the BootstrapAggregator or to the lists from _bootstrap_stash
+        """
+        if isinstance(betas, BootstrapAggregator):
+            betas.add(current_betas, current_rescaled_betas)
+        else:
+            betas.append(self._bootstrap_betas(current_betas))
+            rescaled_betas.append(self._bootstrap_betas(current_rescaled_betas))
+
+    def _bootstrap_betas(self, betas):
+        """
+        Convert the betas from a bootstrap to sparse-backed dataframes if use_sparse_betas is set
+        """
+        return make_sparse_frame(betas) if self.use_sparse_betas else betas
+
+
+def recalculate_betas_from_selected(x, y, idx=None, xtx=None, xty=None):
     """
     Estimate betas from a selected subset of predictors
     :param x: np.ndarray [N x k]
@@ -162,6 +486,10 @@ def recalculate_betas_from_selected(x, y, idx=None):
     :param idx: np.ndarray [k x 1]
         Predictors to use (unused predictors will return a beta of 0)
         If None, use all predictors
+    :param xtx: np.ndarray [k x k]
+        Precalculated xTx for all predictors. Calculated from x if None.
+    :param xty: np.ndarray [k x 1]
+        Precalculated xTy for all predictors. Calculated from x and y if None.
     :return: np.ndarray [k,]
         Estimated beta-hats
     """
@@ -176,13 +504,13 @@ def recalculate_betas_from_selected(x, y, idx=None):
     # Convert boolean array to an array of indexes
     idx = bool_to_index(idx)
 
-    # Subset the predictors with the index array
-    x = x[:, idx]
+    # Subset the predictors (or the precalculated products) with the index array
+    xtx = np.dot(x[:, idx].T, x[:, idx]) if xtx is None else xtx[np.ix_(idx, idx)]
 
     # Solve for beta-hat with LAPACK or return a null model if xTx is singular
-    xtx = np.dot(x.T, x)
     if np.linalg.matrix_rank(xtx) == xtx.shape[1]:
-        beta_hat = np.linalg.solve(np.dot(x.T, x), np.dot(x.T, y))
+        xty = np.dot(x[:, idx].T, y) if xty is None else xty[idx]
+        beta_hat = np.linalg.solve(xtx, xty)
     else:
         beta_hat = np.zeros(len(idx), dtype=np.dtype(float))
 
@@ -194,12 +522,21 @@ def recalculate_betas_from_selected(x, y, idx=None):
     return best_betas
 
 
-def predict_error_reduction(x, y, betas):
+def predict_error_reduction(x, y, betas, xtx=None, xty=None):
     """
     Predict the error reduction from each predictor
+
+    The variance of the residuals for the OLS model without each predictor is calculated in closed form from a single
+    inverse of xTx (see _leave_one_out_sigma_squared). If xTx is ill-conditioned (or y is not [n x 1]), each
+    leave-one-out model is refit instead.
+
     :param x: np.ndarray [n x k]
     :param y: np.ndarray [n x 1]
     :param betas: np.ndarray [k x 1]
+    :param xtx: np.ndarray [k x k]
+        Precalculated xTx. Calculated from x if None.
+    :param xty: np.ndarray [k x 1]
+        Precalculated xTy. Calculated from x and y if None.
     :return: np.ndarray [k,]
     """
     assert check.argument_type(betas, np.ndarray)
@@ -211,36 +548,99 @@ def predict_error_reduction(x, y, betas):
     ss_all = sigma_squared(x, y, betas)
     error_reduction = np.zeros(k, dtype=np.dtype(float))
 
-    if len(pp_idx) == 1:
+    if len(pp_idx) == 0:
+        return error_reduction
+    elif len(pp_idx) == 1:
         error_reduction[pp_idx] = 1 - (ss_all / np.var(y, ddof=1))
         return error_reduction
 
+    xtx = np.dot(x.T, x) if xtx is None else xtx
+    xty = np.dot(x.T, y) if xty is None else xty
+
+    xtx_pp = xtx[np.ix_(pp_idx, pp_idx)]
+
+    if y.ndim == 2 and y.shape[1] == 1 and np.linalg.cond(xtx_pp) < LEAVE_ONE_OUT_CONDITION_LIMIT:
+        ss_leaveout = _leave_one_out_sigma_squared(x[:, pp_idx], y, xtx_pp, xty[pp_idx])
+    else:
+        ss_leaveout = _leave_one_out_sigma_squared_refit(x, y, pp_idx, xtx, xty)
+
+    for lost, ss_lost in zip(pp_idx, ss_leaveout):
+        # Check to make sure that the ss_all and ss_leaveout differences aren't just precision-related
+        if np.abs(ss_all - ss_lost) < np.finfo(float).eps * len(pp_idx):
+            error_reduction[lost] = 0.
+        else:
+            error_reduction[lost] = 1 - (ss_all / ss_lost)
+
+    return error_reduction
+
+
+def _leave_one_out_sigma_squared(x, y, xtx, xty):
+    """
+    Calculate the variance of the residuals of the OLS model without each predictor from one inverse of xTx.
+    Dropping predictor j from the full OLS model increases the SSR by beta_j^2 / (xTx)^-1_jj and changes the remaining
+    betas by -beta_j / (xTx)^-1_jj * (xTx)^-1_j
+
+    :param x: np.ndarray [n x k]
+    :param y: np.ndarray [n x 1]
+    :param xtx: np.ndarray [k x k]
+    :param xty: np.ndarray [k x 1]
+    :return: np.ndarray [k,]
+        The variance of the residuals (ddof=1) for each model with one predictor left out
+    """
+
+    n = x.shape[0]
+    y = y.reshape(-1)
+
+    xtx_inv = np.linalg.inv(xtx)
+    xtx_inv_diag = np.diagonal(xtx_inv)
+    beta_hat = np.dot(xtx_inv, xty.reshape(-1))
+
+    # SSR of the full OLS model and of each leave-one-out model
+    ssr_full = np.sum(np.square(y - np.dot(x, beta_hat)))
+    ssr_leaveout = ssr_full + np.square(beta_hat) / xtx_inv_diag
+
+    # Betas for each leave-one-out model [k x k] (row j is the model without predictor j)
+    beta_leaveout = beta_hat[None, :] - (beta_hat / xtx_inv_diag)[:, None] * xtx_inv
+    np.fill_diagonal(beta_leaveout, 0.)
+
+    # Convert SSR to variance by removing the residual mean
+    resid_mean = np.mean(y) - np.dot(beta_leaveout, np.mean(x, axis=0))
+    return (ssr_leaveout - n * np.square(resid_mean)) / (n - 1)
+
+
+def _leave_one_out_sigma_squared_refit(x, y, pp_idx, xtx, xty):
+    """
+    Calculate the variance of the residuals of the OLS model without each predictor by refitting each model
+
+    :param x: np.ndarray [n x k]
+    :param y: np.ndarray [n x 1]
+    :param pp_idx: list
+        Predictors in the full model
+    :param xtx: np.ndarray [k x k]
+    :param xty: np.ndarray [k x 1]
+    :return: np.ndarray [len(pp_idx),]
+        The variance of the residuals (ddof=1) for each model with one predictor left out
+    """
+
+    ss_leaveout = np.zeros(len(pp_idx), dtype=np.dtype(float))
+
     for pp_i in range(len(pp_idx)):
         # Copy the index of predictors
         leave_out = copy.copy(pp_idx)
         # Pull off one of the predictors
-        lost = leave_out.pop(pp_i)
+        leave_out.pop(pp_i)
 
         # Reestimate betas for all the predictors except the one that we removed
         x_leaveout = x[:, leave_out]
         try:
-            xt = x_leaveout.T
-            xtx = np.dot(xt, x_leaveout)
-            xty = np.dot(xt, y)
-            beta_hat = scipy.linalg.solve(xtx, xty, assume_a='sym')
+            beta_hat = scipy.linalg.solve(xtx[np.ix_(leave_out, leave_out)], xty[leave_out], assume_a='sym')
         except np.linalg.LinAlgError:
             beta_hat = np.zeros(len(leave_out), dtype=np.dtype(float))
 
         # Calculate the variance of the residuals for the new estimated betas
-        ss_leaveout = sigma_squared(x_leaveout, y, beta_hat)
+        ss_leaveout[pp_i] = sigma_squared(x_leaveout, y, beta_hat)
 
-        # Check to make sure that the ss_all and ss_leaveout differences aren't just precision-related
-        if np.abs(ss_all - ss_leaveout) < np.finfo(float).eps * len(pp_idx):
-            error_reduction[lost] = 0.
-        else:
-            error_reduction[lost] = 1 - (ss_all / ss_leaveout)
-
-    return error_reduction
+    return ss_leaveout
 
 
 def sigma_squared(x, y, betas):
@@ -1,6 +1,7 @@
 from __future__ import division
 
 import numpy as np
+import functools
 import itertools
 import math
 import warnings
@@ -10,8 +11,12 @@ import scipy.linalg
 from inferelator import utils
 from inferelator.regression import base_regression
 
+# Relative tolerance for a new predictor to be linearly dependent on the predictors already in a model
+# when calculating BIC with incremental cholesky factors
+INCREMENTAL_SINGULAR_TOL = 1e-10
 
-def bbsr(X, y, pp, weights, max_k, ordinary_least_squares=False):
+
+def bbsr(X, y, pp, weights, max_k, ordinary_least_squares=False, xtx=None, incremental_bic=False):
     """
     Run BBSR to regress a response variable y in n conditions against predictors X in n conditions. Use the prior
     predictors matrix to filter the number of predictors from something massive to max_k.
@@ -25,6 +30,11 @@ def bbsr(X, y, pp, weights, max_k, ordinary_least_squares=False):
         Weight matrix
     :param max_k: int
         Max number of predictors
+    :param xtx: np.ndarray [K x K]
+        The precalculated gram matrix X^T X. This is shared by every response variable, so it should be calculated
+        once and passed in. Calculated from X if None.
+    :param incremental_bic: bool
+        Calculate best subset BICs with incremental cholesky factors (see calc_all_expected_BIC_incremental)
     :return: dict
         pp: Boolean array indicating which predictors are included in the model                 [K,]
         betas: Float array indicating the beta for each predictor included in the model         [K,]
@@ -49,8 +59,13 @@ def bbsr(X, y, pp, weights, max_k, ordinary_least_squares=False):
     utils.make_array_2d(y)
     utils.make_array_2d(gprior)
 
+    # Precalculate xTx and xTy for all predictors; everything downstream slices them instead of using X
+    xtx = np.dot(X.T, X) if xtx is None else xtx
+    xty = np.dot(X.T, y)
+
     # Reduce predictors to max_k
-    pp[pp_idx] = reduce_predictors(x, y, gprior, max_k, ordinary_least_squares=ordinary_least_squares)
+    pp[pp_idx] = reduce_predictors(x, y, gprior, max_k, ordinary_least_squares=ordinary_least_squares,
+                                   xtx=xtx[np.ix_(pp_idx, pp_idx)], xty=xty[pp_idx])
     pp_idx = base_regression.bool_to_index(pp)
 
     utils.Debug.vprint("Reduced to {pp_len} predictors".format(pp_len=len(pp_idx)), level=2)
@@ -66,15 +81,18 @@ def bbsr(X, y, pp, weights, max_k, ordinary_least_squares=False):
     gprior = weights[pp_idx].astype(np.dtype(float))
     utils.make_array_2d(gprior)
 
-    betas = best_subset_regression(x, y, gprior, ordinary_least_squares=ordinary_least_squares)
-    betas_resc = base_regression.predict_error_reduction(x, y, betas)
+    xtx, xty = xtx[np.ix_(pp_idx, pp_idx)], xty[pp_idx]
+
+    betas = best_subset_regression(x, y, gprior, ordinary_least_squares=ordinary_least_squares, xtx=xtx, xty=xty,
+                                   incremental_bic=incremental_bic)
+    betas_resc = base_regression.predict_error_reduction(x, y, betas, xtx=xtx, xty=xty)
 
     return dict(pp=pp,
                 betas=betas,
                 betas_resc=betas_resc)
 
 
-def best_subset_regression(x, y, gprior, ordinary_least_squares=False):
+def best_subset_regression(x, y, gprior, ordinary_least_squares=False, xtx=None, xty=None, incremental_bic=False):
     """
 
     :param x: np.ndarray
@@ -83,33 +101,48 @@ def best_subset_regression(x, y, gprior, ordinary_least_squares=False):
         Dependent (response) variable [n x 1]
     :param gprior: np.ndarray
         Weighted priors [k x 1]
+    :param xtx: np.ndarray
+        Precalculated xTx [k x k]. Calculated from x if None.
+    :param xty: np.ndarray
+        Precalculated xTy [k x 1]. Calculated from x and y if None.
+    :param incremental_bic: bool
+        Calculate BICs with calc_all_expected_BIC_incremental instead of calc_all_expected_BIC
     :return:
     """
     (n, k) = x.shape
     combos = combo_index(k)
 
-    bic_combos = calc_all_expected_BIC(x, y, gprior, combos, check_rank=False,
-                                       ordinary_least_squares=ordinary_least_squares)
+    xtx = np.dot(x.T, x) if xtx is None else xtx
+    xty = np.dot(x.T, y) if xty is None else xty
+
+    if incremental_bic:
+        bic_combos = calc_all_expected_BIC_incremental(x, y, gprior, ordinary_least_squares=ordinary_least_squares,
+                                                       xtx=xtx, xty=xty)
+    else:
+        bic_combos = calc_all_expected_BIC(x, y, gprior, combos, check_rank=False,
+                                           ordinary_least_squares=ordinary_least_squares, xtx=xtx, xty=xty)
 
     best_betas = np.zeros(k, dtype=np.dtype(float))
     try:
-        best_combo = combos[:, _best_combo_idx(x, bic_combos, combos)]
+        best_combo = combos[:, _best_combo_idx(x, bic_combos, combos, xtx=xtx)]
     except np.linalg.LinAlgError:
         return best_betas
 
     if best_combo.sum() > 0:
-        best_betas = base_regression.recalculate_betas_from_selected(x, y, best_combo)
+        best_betas = base_regression.recalculate_betas_from_selected(x, y, best_combo, xtx=xtx, xty=xty)
 
     return best_betas
 
 
-def reduce_predictors(x, y, gprior, max_k, ordinary_least_squares=False):
+def reduce_predictors(x, y, gprior, max_k, ordinary_least_squares=False, xtx=None, xty=None):
     """
     Determine which predictors are the most valuable by calculating BICs for single and pairwise predictor models
     :param x: np.ndarray [n x k]
     :param y: np.ndarray [n x 1]
     :param gprior: [k x 1]
     :param max_k: int
+    :param xtx: Precalculated xTx [k x k] (or None)
+    :param xty: Precalculated xTy [k x 1] (or None)
     :return: np.ndarray [k,]
     """
     (_, k) = x.shape
@@ -119,7 +152,8 @@ def reduce_predictors(x, y, gprior, max_k, ordinary_least_squares=False):
     else:
         # Get BIC for every combination of single or double predictors
         combos = np.hstack((np.diag(np.repeat(True, k)), select_index(k)))
-        bic = calc_all_expected_BIC(x, y, gprior, combos, ordinary_least_squares=ordinary_least_squares)
+        bic = calc_all_expected_BIC(x, y, gprior, combos, ordinary_least_squares=ordinary_least_squares,
+                                    xtx=xtx, xty=xty)
 
         reset = np.seterr(divide='ignore', invalid='ignore')
         bic = np.multiply(combos.T, bic.reshape(-1, 1)).sum(axis=0)
@@ -132,7 +166,7 @@ def reduce_predictors(x, y, gprior, max_k, ordinary_least_squares=False):
         return predictors
 
 
-def calc_all_expected_BIC(x, y, g, combinations, check_rank=True, ordinary_least_squares=False):
+def calc_all_expected_BIC(x, y, g, combinations, check_rank=True, ordinary_least_squares=False, xtx=None, xty=None):
     """
     Calculate BICs for every combination of predictors given in combinations
     :param x: np.ndarray [n x k]
@@ -147,6 +181,10 @@ def calc_all_expected_BIC(x, y, g, combinations, check_rank=True, ordinary_least
     :param check_rank: bool
         Explicitly check to see that xTx is nonsingular for every combination. If false, will only catch singular xTx
         that causes np.linalg.solve to throw an exception
+    :param xtx: np.ndarray [k x k]
+        Precalculated xTx. Calculated from x if None.
+    :param xty: np.ndarray [k x 1]
+        Precalculated xTy. Calculated from x and y if None.
     :return: np.ndarray [c,]
         Array of BICs corresponding to each combination
     """
@@ -158,56 +196,190 @@ def calc_all_expected_BIC(x, y, g, combinations, check_rank=True, ordinary_least
     assert n == y.shape[0]
     assert k == combinations.shape[0]
 
-    # Precalculate xTx and xTy
+    # Precalculate xTx, xTy, and yTy (if not passed in)
     digamma_shape = scipy.special.digamma(n / 2.0)
-    xtx = np.dot(x.T, x)  # [k x k]
-    xty = np.dot(x.T, y)  # [k x 1]
+    xtx = np.dot(x.T, x) if xtx is None else xtx  # [k x k]
+    xty = np.dot(x.T, y) if xty is None else xty  # [k x 1]
+    yty = np.dot(y.T, y)  # [1 x 1]
 
     # Calculate the g-prior
     gprior = np.repeat(np.sqrt(1.0 / (g + 1.0)), k, axis=1)
     gprior = np.multiply(gprior, gprior.T)
-    bic = np.zeros(c, dtype=np.dtype(float))
+    bic = np.full(c, np.inf, dtype=np.dtype(float))
+
+    # Group the combinations by the number of predictors they include
+    sizes = combinations.sum(axis=0)
 
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        for i in range(c):
-            # Convert the boolean slice into an index
-            c_idx = base_regression.bool_to_index(combinations[:, i])
-            k_included = len(c_idx)
 
-            # Check for a null model
-            if k_included == 0:
-                bic[i] = n * np.log(np.var(y, ddof=1))
-                continue
+        # Check for null models
+        bic[sizes == 0] = n * np.log(np.var(y, ddof=1))
 
-            # Calculate the rate parameter from this specific combination of predictors
-            try:
-                xtx_slice = xtx[:, c_idx][c_idx, :]
-
-                model_beta = _solve_model(xtx_slice, xty[c_idx], check_rank=check_rank)
-                model_ssr = ssr(x[:, c_idx], y, model_beta)
-                if ordinary_least_squares:
-                    bic[i] = _calc_BIC_RSS(n, k_included, model_ssr)
-                else:
-                    scale_param = _calc_ig_scale(model_beta, model_ssr, xtx_slice, gprior[:, c_idx][c_idx, :])
-                    if np.isfinite(scale_param) and scale_param > 0:
-                        bic[i] = _calc_BIC_inverse_gamma(n, k_included, digamma_shape, scale_param)
-                    else:
-                        raise np.linalg.LinAlgError
-            except np.linalg.LinAlgError:
-                bic[i] = np.inf
+        for k_included in np.unique(sizes[sizes > 0]):
+            c_idx = np.where(sizes == k_included)[0]
+
+            # Convert the boolean combinations into an index array [c_k x k_included]
+            p_idx = np.nonzero(combinations[:, c_idx].T)[1].reshape(-1, k_included)
+
+            # Stack the xTx [c_k x k_included x k_included] and xTy [c_k x k_included x 1] for every combination
+            xtx_stack = xtx[p_idx[:, :, None], p_idx[:, None, :]]
+            xty_stack = xty.reshape(-1, 1)[p_idx]
+
+            # Calculate the rate parameter from each combination of predictors
+            model_beta, solved = _solve_model_batch(xtx_stack, xty_stack, check_rank=check_rank)
+            model_ssr = _ssr_from_products_batch(yty, xty_stack, xtx_stack, model_beta)
+
+            if ordinary_least_squares:
+                bic_k = _calc_BIC_RSS(n, k_included, model_ssr)
+            else:
+                scale_param = _calc_ig_scale_batch(model_beta, model_ssr, xtx_stack,
+                                                   gprior[p_idx[:, :, None], p_idx[:, None, :]])
+                solved &= np.isfinite(scale_param) & (scale_param > 0)
+                bic_k = _calc_BIC_inverse_gamma(n, k_included, digamma_shape, scale_param)
+
+            bic[c_idx] = np.where(solved, bic_k, np.inf)
 
     return bic
 
 
+def calc_all_expected_BIC_incremental(x, y, g, ordinary_least_squares=False, xtx=None, xty=None):
+    """
+    Calculate BICs for every combination of predictors (in the same order as combo_index) by building the cholesky
+    factor of xTx for each combination from the factor of a combination with one less predictor.
+
+    Every combination is its parent combination (without its last predictor) with one predictor appended, so its
+    cholesky factor is the parent factor with one new column. The SSR is yTy - zTz, where z solves RT z = xTy, and z
+    is also extended by one value. Combinations are processed in levels of the same size, so each level only needs
+    O(k^2) work per combination.
+
+    A combination is singular if it contains a predictor which is linearly dependent on the predictors before it
+    (within INCREMENTAL_SINGULAR_TOL), and every combination which contains a singular combination is also singular.
+    Singular combinations have a BIC of np.inf.
+
+    :param x: np.ndarray [n x k]
+        Array of predictor data
+    :param y: np.ndarray [n x 1]
+        Array of response data
+    :param g: np.ndarray [k x 1]
+        Weights for predictors
+    :param xtx: np.ndarray [k x k]
+        Precalculated xTx. Calculated from x if None.
+    :param xty: np.ndarray [k x 1]
+        Precalculated xTy. Calculated from x and y if None.
+    :return: np.ndarray [2^k,]
+        Array of BICs corresponding to each combination in combo_index(k)
+    """
+    (n, k) = x.shape
+
+    assert n == y.shape[0]
+
+    digamma_shape = scipy.special.digamma(n / 2.0)
+    xtx = np.dot(x.T, x) if xtx is None else xtx  # [k x k]
+    xty = (np.dot(x.T, y) if xty is None else xty).reshape(-1)  # [k,]
+    yty = np.sum(np.dot(y.T, y))
+    gprior = np.sqrt(1.0 / (np.asarray(g, dtype=np.dtype(float)).reshape(-1) + 1.0))  # [k,]
+
+    bic = np.full(2 ** k, np.inf, dtype=np.dtype(float))
+
+    # The null model is the 0th combination
+    bic[0] = n * np.log(np.var(y, ddof=1))
+
+    # Start from the null model; the combinations at each level are index arrays [c x level]
+    combo_idx = np.zeros((1, 0), dtype=np.dtype(int))
+    combo_col = np.zeros(1, dtype=np.dtype(int))
+    chol = np.zeros((1, 0, 0), dtype=np.dtype(float))
+    z = np.zeros((1, 0), dtype=np.dtype(float))
+    singular = np.zeros(1, dtype=np.dtype(bool))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+
+        for level in range(1, k + 1):
+            # Append every predictor which is after the last predictor in a combination
+            last = combo_idx[:, -1] if level > 1 else np.full(combo_idx.shape[0], -1)
+            parent, new_p = np.nonzero(np.arange(k)[None, :] > last[:, None])
+
+            combo_idx = np.hstack((combo_idx[parent], new_p[:, None]))
+            combo_col = combo_col[parent] + 2 ** (k - 1 - new_p)
+
+            chol, z, singular = _cholesky_append(chol[parent], z[parent], singular[parent],
+                                                 xtx[combo_idx[:, :-1], new_p[:, None]], xtx[new_p, new_p], xty[new_p])
+
+            model_ssr = np.maximum(yty - np.sum(z ** 2, axis=1), 0.)
+
+            if ordinary_least_squares:
+                bic_level = _calc_BIC_RSS(n, level, model_ssr)
+            else:
+                # With a g-prior the rate parameter is |R (g * beta)|^2
+                model_beta = _cholesky_back_solve(chol, z)
+                rate = np.einsum('cij,cj->ci', chol, gprior[combo_idx] * model_beta)
+                scale_param = (model_ssr + np.sum(rate ** 2, axis=1)) / 2
+                singular |= ~(np.isfinite(scale_param) & (scale_param > 0))
+                bic_level = _calc_BIC_inverse_gamma(n, level, digamma_shape, scale_param)
+
+            bic[combo_col] = np.where(singular, np.inf, bic_level)
+
+    return bic
+
+
+def _cholesky_append(chol, z, singular, xtx_cross, xtx_new, xty_new):
+    """
+    Append one predictor to a stack of upper triangular cholesky factors (RT R = xTx) and the solutions z to RT z = xTy
+    :param chol: np.ndarray [c x m x m]
+    :param z: np.ndarray [c x m]
+    :param singular: np.ndarray [c,]
+    :param xtx_cross: np.ndarray [c x m]
+        xTx between the new predictor and the predictors already in the factor
+    :param xtx_new: np.ndarray [c,]
+        xTx for the new predictor
+    :param xty_new: np.ndarray [c,]
+        xTy for the new predictor
+    :return chol, z, singular: np.ndarray [c x m+1 x m+1], np.ndarray [c x m+1], np.ndarray [c,]
+    """
+    c, m = z.shape
+
+    # Forward substitution for the new column r (RT r = xTx_cross)
+    r = np.zeros((c, m), dtype=np.dtype(float))
+    for j in range(m):
+        r[:, j] = (xtx_cross[:, j] - np.einsum('ci,ci->c', chol[:, :j, j], r[:, :j])) / chol[:, j, j]
+
+    rho = xtx_new - np.sum(r ** 2, axis=1)
+    singular = singular | (rho <= INCREMENTAL_SINGULAR_TOL * xtx_new)
+    rho = np.sqrt(np.where(singular, 1., rho))
+
+    new_chol = np.zeros((c, m + 1, m + 1), dtype=np.dtype(float))
+    new_chol[:, :m, :m] = chol
+    new_chol[:, :m, m] = r
+    new_chol[:, m, m] = rho
+
+    new_z = np.hstack((z, ((xty_new - np.einsum('ci,ci->c', r, z)) / rho)[:, None]))
+
+    return new_chol, new_z, singular
+
+
+def _cholesky_back_solve(chol, z):
+    """
+    Solve a stack of upper triangular systems R beta = z by back substitution
+    :param chol: np.ndarray [c x m x m]
+    :param z: np.ndarray [c x m]
+    :return: np.ndarray [c x m]
+    """
+    c, m = z.shape
+
+    beta = np.zeros((c, m), dtype=np.dtype(float))
+    for j in range(m - 1, -1, -1):
+        beta[:, j] = (z[:, j] - np.einsum('ci,ci->c', chol[:, j, j + 1:], beta[:, j + 1:])) / chol[:, j, j]
+
+    return beta
+
+
 def _calc_BIC_inverse_gamma(n, k, shape, scale):
     return n * (np.log(scale) - shape) + k * np.log(n)
 
 
 def _calc_BIC_RSS(n, k, model_ssr):
-    if model_ssr <= 0:
-        model_ssr = np.finfo(float).eps
-
+    model_ssr = np.where(model_ssr <= 0, np.finfo(float).eps, model_ssr)
     return n * (np.log(model_ssr / n)) + k * np.log(n)
 
 
@@ -222,6 +394,56 @@ def _calc_ig_scale(beta_hat, model_ssr, xtx, gprior):
     return (model_ssr + rate) / 2
 
 
+def _calc_ig_scale_batch(beta_hat, model_ssr, xtx, gprior):
+    """
+    Calculate the rate parameter with a g-prior for a stack of models. This is the same calculation as _calc_ig_scale.
+    :param beta_hat: np.ndarray [c x k x 1]
+    :param model_ssr: np.ndarray [c,]
+    :param xtx: np.ndarray [c x k x k]
+    :param gprior: np.ndarray [c x k x k]
+    :return: np.ndarray [c,]
+    """
+    beta_flip = (0 - beta_hat[:, :, 0])
+    rate = np.einsum('ci,cij,cj->c', beta_flip, xtx * gprior, beta_flip)
+
+    # Return the mean of the SSR and the rate parameter
+    return (model_ssr + rate) / 2
+
+
+def _solve_model_batch(xtx, xty, check_rank=True):
+    """
+    Solve a stack of xTx against xTy
+    :param xtx: np.ndarray [c x k x k]
+    :param xty: np.ndarray [c x k x 1]
+    :param check_rank: bool
+        Explicitly check to see that each xTx is nonsingular
+    :return beta_hat, solved: np.ndarray [c x k x 1], np.ndarray [c,]
+        The model betas, and a boolean array which is False for any xTx which is singular (which will have betas of 0)
+    """
+
+    solved = np.ones(xtx.shape[0], dtype=np.dtype(bool))
+    beta_hat = np.zeros(xty.shape, dtype=np.dtype(float))
+
+    # Check to see if each xTx is nonsingular (if necessary)
+    if check_rank:
+        solved &= np.linalg.matrix_rank(xtx, tol=1e-10) == xtx.shape[-1]
+
+    # Predictors which are all zeros make xTx singular
+    solved &= np.all(np.diagonal(xtx, axis1=1, axis2=2) != 0, axis=1)
+
+    try:
+        beta_hat[solved] = np.linalg.solve(xtx[solved], xty[solved])
+    except np.linalg.LinAlgError:
+        # At least one xTx is singular, so solve each separately to find it
+        for i in np.where(solved)[0]:
+            try:
+                beta_hat[i] = _solve_model(xtx[i], xty[i], check_rank=False)
+            except np.linalg.LinAlgError:
+                solved[i] = False
+
+    return beta_hat, solved
+
+
 def _solve_model(xtx, xty, check_rank=True):
     # Check to see if xTx is nonsingular (if necessary)
     if check_rank and not _matrix_full_rank(xtx):
@@ -231,15 +453,18 @@ def _solve_model(xtx, xty, check_rank=True):
     return scipy.linalg.solve(xtx, xty, assume_a='sym')
 
 
-def _best_combo_idx(x, bic, combo):
+def _best_combo_idx(x, bic, combo, xtx=None):
     """
     Find the lowest BIC combination that comes from a nonsingular xTx
     :param x: [n x k]
     :param bic: [c,] array of floats
     :param combo: [k x c]
+    :param xtx: Precalculated xTx [k x k]. Calculated from x if None.
     :return:
     """
 
+    xtx = np.dot(x.T, x) if xtx is None else xtx
+
     for i in range(combo.shape[1]):
         bic_idx = np.argmin(bic)  # In case of a tie, np.argmin returns the leftmost index
         c = combo[:, bic_idx]
@@ -247,8 +472,7 @@ def _best_combo_idx(x, bic, combo):
         if c.sum() == 0:
             return bic_idx
 
-        x_slice = x[:, c]
-        if _matrix_full_rank(np.dot(x_slice.T, x_slice)):
+        if _matrix_full_rank(xtx[np.ix_(c, c)]):
             return bic_idx
         else:
             bic[bic_idx] = np.inf
@@ -274,9 +498,47 @@ def ssr(x, y, beta):
     return (resid * resid).sum()
 
 
+def _ssr_from_products(yty, xty, xtx, beta):
+    """
+    Sum of squared residuals (y - XB)^T(y - XB) for one response variable, calculated as yTy - 2 BT xTy + BT xTx B so
+    that it doesn't need X
+    :param yty: np.ndarray [1 x 1]
+    :param xty: np.ndarray [M x 1]
+    :param xtx: np.ndarray [M x M]
+    :param beta: np.ndarray [M x 1]
+    :return: float
+    """
+
+    beta, xty = beta.reshape(-1), xty.reshape(-1)
+    model_ssr = np.sum(yty) - 2 * np.dot(beta, xty) + np.dot(beta, np.dot(xtx, beta))
+
+    # Cancellation can leave a perfect fit slightly negative
+    return max(model_ssr, 0.)
+
+
+def _ssr_from_products_batch(yty, xty, xtx, beta):
+    """
+    Sum of squared residuals for a stack of models of one response variable. This is the same calculation as
+    _ssr_from_products.
+    :param yty: np.ndarray [1 x 1]
+    :param xty: np.ndarray [c x M x 1]
+    :param xtx: np.ndarray [c x M x M]
+    :param beta: np.ndarray [c x M x 1]
+    :return: np.ndarray [c,]
+    """
+
+    beta, xty = beta[:, :, 0], xty[:, :, 0]
+    model_ssr = np.sum(yty) - 2 * np.einsum('ci,ci->c', beta, xty) + np.einsum('ci,cij,cj->c', beta, xtx, beta)
+
+    # Cancellation can leave a perfect fit slightly negative
+    return np.maximum(model_ssr, 0.)
+
+
 def combo_index(n):
     """
-    Generate a boolean array that can mask to generate every possible combination of n objects
+    Generate a boolean array that can mask to generate every possible combination of n objects.
+    Each combination is the binary representation of its column number (with object 0 as the most significant bit).
+    Arrays are memoized for each n and are read-only; they are built once per process and shared by every gene.
     :param n: int
         Number of objects
     :return: np.array
@@ -284,12 +546,23 @@ def combo_index(n):
     """
     assert n >= 0
 
-    return np.array(list(itertools.product([False, True], repeat=n))).T
+    return _combo_index(n)
+
+
+@functools.lru_cache(maxsize=None)
+def _combo_index(n):
+    bit_masks = np.arange(2 ** n, dtype=np.dtype(int))
+    shifts = np.arange(n - 1, -1, -1, dtype=np.dtype(int))
+
+    arr = ((bit_masks[None, :] >> shifts[:, None]) & 1).astype(bool)
+    arr.setflags(write=False)
+    return arr
 
 
 def select_index(n, r=2):
     """
-    Generate a boolean array that can mask to generate every selection of r objects from a total pool of n objects
+    Generate a boolean array that can mask to generate every selection of r objects from a total pool of n objects.
+    Arrays are memoized for each n and r and are read-only; they are built once per process and shared by every gene.
     :param n: int
         Number of objects
     :param r: int
@@ -299,11 +572,21 @@ def select_index(n, r=2):
     """
     assert n >= 0
 
+    return _select_index(n, r)
+
+
+@functools.lru_cache(maxsize=None)
+def _select_index(n, r):
     combos = int(math.factorial(n) / (math.factorial(r) * math.factorial(n - r)))
-    idx = np.array(list(itertools.combinations(range(n), r)))
-    idx = idx + np.array(range(idx.shape[0])).reshape(-1, 1) * n
 
-    arr = np.full(combos * n, False, dtype=np.dtype(bool))
-    arr[idx.reshape(1, -1)] = True
+    if r == 2:
+        idx = np.vstack(np.triu_indices(n, k=1)).T
+    else:
+        idx = np.array(list(itertools.combinations(range(n), r)), dtype=np.dtype(int)).reshape(combos, r)
+
+    arr = np.zeros((combos, n), dtype=np.dtype(bool))
+    arr[np.arange(combos)[:, None], idx] = True
 
-    return arr.reshape((combos, n)).T
+    arr = arr.T
+    arr.setflags(write=False)
+    return arr
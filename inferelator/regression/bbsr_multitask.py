@@ -31,12 +31,13 @@ class BBSRByTaskRegressionWorkflow(_MultitaskRegressionWorkflow, BBSRRegressionW
             MPControl.sync_processes(pref="bbsr_pre")
 
             Debug.vprint('Calculating MI, Background MI, and CLR Matrix', level=0)
-            clr_matrix, _ = self.mi_driver().run(Y, X, return_mi=False)
+            clr_matrix = self._calculate_clr(self._task_response[k], self._task_design[k], Y, X,
+                                             self._task_bootstraps[k][bootstrap_idx], cache_key=k)
 
             Debug.vprint('Calculating task {k} betas using BBSR'.format(k=k), level=0)
             t_beta, t_br = BBSR(X, Y, clr_matrix, priors_data,
                                 prior_weight=self.prior_weight, no_prior_weight=self.no_prior_weight,
-                                nS=self.bsr_feature_num).run()
+                                nS=self.bsr_feature_num, incremental_bic=self.incremental_bic).run()
             betas.append(t_beta)
             betas_resc.append(t_br)
 
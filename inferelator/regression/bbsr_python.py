@@ -40,8 +40,11 @@ class BBSR(base_regression.BaseRegression):
 
     ols_only = False
 
+    # Calculate best subset BICs with incremental cholesky factors
+    incremental_bic = False
+
     def __init__(self, X, Y, clr_mat, prior_mat, nS=DEFAULT_nS, prior_weight=DEFAULT_prior_weight,
-                 no_prior_weight=DEFAULT_no_prior_weight, ordinary_least_squares=False):
+                 no_prior_weight=DEFAULT_no_prior_weight, ordinary_least_squares=False, incremental_bic=False):
         """
         Create a Regression object for Bayes Best Subset Regression
 
@@ -60,12 +63,20 @@ class BBSR(base_regression.BaseRegression):
             Weight of a predictor which does have a prior
         :param no_prior_weight: int
             Weight of a predictor which doesn't have a prior
+        :param ordinary_least_squares: bool
+            Use OLS instead of a bayesian model
+        :param incremental_bic: bool
+            Calculate best subset BICs with incremental cholesky factors, which is faster for large nS
         """
 
         super(BBSR, self).__init__(X, Y)
 
+        # The weights are the same for every bootstrap which uses this prior object
+        self._weights_source = (prior_mat, prior_weight, no_prior_weight, self.genes, self.tfs)
+
         self.nS = nS
         self.ols_only = ordinary_least_squares
+        self.incremental_bic = incremental_bic
 
         # Calculate the weight matrix
         self.prior_weight = prior_weight
@@ -92,23 +103,40 @@ class BBSR(base_regression.BaseRegression):
 
         if MPControl.is_dask():
             from inferelator.distributed.dask_functions import bbsr_regress_dask
-            return bbsr_regress_dask(self.X, self.Y, self.pp, self.weights_mat, self.G, self.genes, self.nS)
+            return bbsr_regress_dask(self.X, self.Y, self.pp, self.weights_mat, self.G, self.genes, self.nS,
+                                     gene_blocks=self.gene_blocks(), result_container=self.result_container)
+
+        if MPControl.is_shared_memory():
+            from inferelator.distributed.shared_memory_functions import bbsr_regress_shared_memory
+            return bbsr_regress_shared_memory(self.X, self.Y, self.pp, self.weights_mat, self.G, self.genes, self.nS,
+                                              gene_blocks=self.gene_blocks(), result_container=self.result_container,
+                                              ordinary_least_squares=self.ols_only,
+                                              incremental_bic=self.incremental_bic,
+                                              response_source=self.response_source,
+                                              bootstrap_index=self.bootstrap_index,
+                                              weights_source=self._weights_source)
+
+        # The gram matrix of the predictors is shared by every gene
+        x = self.X.values
+        xtx = np.dot(x.T, x)
 
         def regression_maker(j):
             level = 0 if j % 100 == 0 else 2
             utils.Debug.allprint(base_regression.PROGRESS_STR.format(gn=self.genes[j], i=j, total=self.G),
                                  level=level)
 
-            data = bayes_stats.bbsr(self.X.values,
+            data = bayes_stats.bbsr(x,
                                     utils.scale_vector(self.Y.get_gene_data(j, force_dense=True).flatten()),
                                     self.pp.iloc[j, :].values.flatten(),
                                     self.weights_mat.iloc[j, :].values.flatten(),
                                     self.nS,
-                                    ordinary_least_squares=self.ols_only)
+                                    ordinary_least_squares=self.ols_only,
+                                    xtx=xtx,
+                                    incremental_bic=self.incremental_bic)
             data['ind'] = j
             return data
 
-        return MPControl.map(regression_maker, range(self.G), tell_children=False)
+        return self.imap_genes(regression_maker, tell_children=False)
 
     def _build_pp_matrix(self):
         """
@@ -130,18 +158,26 @@ class BBSR(base_regression.BaseRegression):
             pp = pp.values
 
         # Mark the nS predictors with the highest CLR true (Do not include anything with a CLR of 0)
-        mask = np.logical_or(self.clr_mat == 0, ~np.isfinite(self.clr_mat)).values
-        masked_clr = np.ma.array(self.clr_mat.values, mask=mask)
-        for i in range(self.G):
-            n_to_keep = min(self.nS, self.K, mask.shape[1] - np.sum(mask[i, :]))
-            if n_to_keep == 0:
-                continue
-            clrs = np.ma.argsort(masked_clr[i, :], endwith=False)[-1 * n_to_keep:]
-            pp[i, clrs] = True
-
-        # Rebuild into a DataFrame and set autoregulation to 0
+        # Masked CLRs are set to -inf so that a single partition over the whole matrix puts them last
+        clr = self.clr_mat.values
+        valid = np.logical_and(clr != 0, np.isfinite(clr))
+        n_to_keep = min(self.nS, self.K)
+
+        if 0 < n_to_keep < self.K:
+            top_clr = np.argpartition(np.where(valid, clr, -np.inf), self.K - n_to_keep, axis=1)[:, -n_to_keep:]
+            top_row = np.arange(self.G)[:, None]
+
+            # Rows with fewer than nS valid CLRs will have picked up masked entries; leave those untouched
+            pp[top_row, top_clr] |= valid[top_row, top_clr]
+        elif n_to_keep > 0:
+            pp |= valid
+
+        # Set autoregulation to 0 by mapping shared labels to their row and column positions
+        shared = pp_idx.intersection(pp_col)
+        pp[pp_idx.get_indexer(shared), pp_col.get_indexer(shared)] = False
+
+        # Rebuild into a DataFrame
         pp = pd.DataFrame(pp, index=pp_idx, columns=pp_col, dtype=np.dtype(bool))
-        pp = utils.df_set_diag(pp, False)
 
         return pp
 
@@ -170,20 +206,33 @@ class BBSRRegressionWorkflow(base_regression.RegressionWorkflow):
     mi_driver = mi.MIDriver
     mi_sync_path = None
 
+    # Discretize the design and response once and weight the cached bins by each bootstrap
+    # This sets MI bin edges from the full data instead of from each bootstrap (see mi.DiscretizationCache)
+    cache_mi_discretization = False
+
+    # Cached bins as cache key: (response, design, response bins, design bins)
+    _mi_cache = None
+
     prior_weight = DEFAULT_prior_weight
     no_prior_weight = DEFAULT_no_prior_weight
     bsr_feature_num = DEFAULT_nS
     clr_only = False
+    _clr_only_priors = None  # (priors data, mock prior)
     ols_only = False
+    incremental_bic = False
 
     def set_regression_parameters(self, prior_weight=None, no_prior_weight=None, bsr_feature_num=None, clr_only=False,
-                                  ordinary_least_squares_only=None):
+                                  ordinary_least_squares_only=None, cache_mi_discretization=None, incremental_bic=None):
         """
         Set regression parameters for BBSR
         :param prior_weight:
         :param no_prior_weight:
         :param bsr_feature_num:
         :param clr_only:
+        :param cache_mi_discretization: Discretize data for MI once and reuse the bins for every bootstrap.
+            Bin edges will be set from the full data instead of from each bootstrap.
+        :param incremental_bic: Calculate best subset BICs with incremental cholesky factors. This is much faster
+            for large values of bsr_feature_num.
         """
 
         self._set_with_warning("prior_weight", prior_weight)
@@ -191,21 +240,66 @@ class BBSRRegressionWorkflow(base_regression.RegressionWorkflow):
         self._set_with_warning("bsr_feature_num", bsr_feature_num)
         self._set_without_warning("clr_only", clr_only)
         self._set_without_warning("ols_only", ordinary_least_squares_only)
+        self._set_without_warning("cache_mi_discretization", cache_mi_discretization)
+        self._set_without_warning("incremental_bic", incremental_bic)
 
     def run_bootstrap(self, bootstrap):
         X = self.design.get_bootstrap(bootstrap)
         Y = self.response.get_bootstrap(bootstrap)
 
         utils.Debug.vprint('Calculating MI, Background MI, and CLR Matrix', level=0)
-        clr_matrix, _ = self.mi_driver().run(Y, X, return_mi=False)
+        clr_matrix = self._calculate_clr(self.response, self.design, Y, X, bootstrap)
         utils.Debug.vprint('Calculating betas using BBSR', level=0)
 
         # Create a mock prior with no information if clr_only is set
+        # Make it once for the priors data so that the same object is used (and cached) for every bootstrap
         if self.clr_only:
-            priors = pd.DataFrame(0, index=self.priors_data.index, columns=self.priors_data.columns)
+            if self._clr_only_priors is None or self._clr_only_priors[0] is not self.priors_data:
+                self._clr_only_priors = (self.priors_data, pd.DataFrame(0, index=self.priors_data.index,
+                                                                        columns=self.priors_data.columns))
+            priors = self._clr_only_priors[1]
         else:
             priors = self.priors_data
 
-        return BBSR(X, Y, clr_matrix, priors, prior_weight=self.prior_weight,
-                    no_prior_weight=self.no_prior_weight, nS=self.bsr_feature_num,
-                    ordinary_least_squares=self.ols_only).run()
+        regression = BBSR(X, Y, clr_matrix, priors, prior_weight=self.prior_weight,
+                          no_prior_weight=self.no_prior_weight, nS=self.bsr_feature_num,
+                          ordinary_least_squares=self.ols_only, incremental_bic=self.incremental_bic)
+
+        return regression.set_bootstrap_source(self.response, bootstrap).run()
+
+    def _calculate_clr(self, response, design, response_bootstrap, design_bootstrap, bootstrap, cache_key=None):
+        """
+        Calculate CLR for a bootstrap, either from the bootstrapped data or from the cached bins of the full data if
+        cache_mi_discretization is set
+
+        :param response: Full response data [N x G]
+        :type response: InferelatorData
+        :param design: Full design data [N x K]
+        :type design: InferelatorData
+        :param response_bootstrap: Bootstrapped response data [N x G]
+        :type response_bootstrap: InferelatorData
+        :param design_bootstrap: Bootstrapped design data [N x K]
+        :type design_bootstrap: InferelatorData
+        :param bootstrap: Bootstrap row index
+        :type bootstrap: list
+        :param cache_key: Key for the cached bins (for workflows with more than one data set)
+        :return clr_matrix: CLR [G x K]
+        :rtype: pd.DataFrame
+        """
+
+        if not self.cache_mi_discretization:
+            return self.mi_driver().run(response_bootstrap, design_bootstrap, return_mi=False)[0]
+
+        if self._mi_cache is None:
+            self._mi_cache = {}
+
+        # Rebuild the bins if the data has been replaced since they were cached (the cache keeps the data referenced,
+        # so it can't be replaced by a different object with the same id)
+        cached = self._mi_cache.get(cache_key)
+        if cached is None or cached[0] is not response or cached[1] is not design:
+            cached = (response, design, mi.DiscretizationCache(response), mi.DiscretizationCache(design))
+            self._mi_cache[cache_key] = cached
+
+        # Weight the rows of the cached bins by their bootstrap multiplicity instead of selecting them
+        weights = mi.bootstrap_weights(bootstrap, design.num_obs)
+        return self.mi_driver().run(cached[2], cached[3], return_mi=False, row_weights=weights)[0]
@@ -83,13 +83,22 @@ class ElasticNet(base_regression.BaseRegression):
         """
         Execute Elastic Net
 
-        :return: list
-            Returns a list of regression results that base_regression's pileup_data can process
+        :return: iterable
+            Returns regression results that base_regression's pileup_data can process
         """
 
         if MPControl.is_dask():
             from inferelator.distributed.dask_functions import elasticnet_regress_dask
-            return elasticnet_regress_dask(self.X, self.Y, self.params, self.G, self.genes)
+            return elasticnet_regress_dask(self.X, self.Y, self.params, self.G, self.genes,
+                                           gene_blocks=self.gene_blocks(), result_container=self.result_container)
+
+        if MPControl.is_shared_memory():
+            from inferelator.distributed.shared_memory_functions import elasticnet_regress_shared_memory
+            return elasticnet_regress_shared_memory(self.X, self.Y, self.params, self.G, self.genes,
+                                                    gene_blocks=self.gene_blocks(),
+                                                    result_container=self.result_container,
+                                                    response_source=self.response_source,
+                                                    bootstrap_index=self.bootstrap_index)
 
         def regression_maker(j):
             level = 0 if j % 100 == 0 else 2
@@ -101,7 +110,7 @@ class ElasticNet(base_regression.BaseRegression):
             data['ind'] = j
             return data
 
-        return MPControl.map(regression_maker, range(self.G), tell_children=False)
+        return self.imap_genes(regression_maker, tell_children=False)
 
 
 class ElasticNetWorkflow(base_regression.RegressionWorkflow):
@@ -124,4 +133,5 @@ class ElasticNetWorkflow(base_regression.RegressionWorkflow):
         Y = self.response.get_bootstrap(bootstrap)
         utils.Debug.vprint('Calculating betas using MEN', level=0)
         MPControl.sync_processes("pre-bootstrap")
-        return ElasticNet(X, Y, self.random_seed, parameters=self.elastic_net_parameters).run()
+        regression = ElasticNet(X, Y, self.random_seed, parameters=self.elastic_net_parameters)
+        return regression.set_bootstrap_source(self.response, bootstrap).run()
@@ -20,38 +20,186 @@ DEFAULT_LOG_TYPE = np.log
 # KVS keys for multiprocessing
 SYNC_CLR_KEY = 'post_clr'
 
+# MI engines. "map" calculates MI for one gene at a time; "batched" calculates contingency tables for blocks of genes
+MI_ENGINE_MAP = "map"
+MI_ENGINE_BATCHED = "batched"
+MI_ENGINES = (MI_ENGINE_MAP, MI_ENGINE_BATCHED)
+DEFAULT_MI_ENGINE = MI_ENGINE_BATCHED
+
+# Maximum number of contingency table cells to build at once in each block for the batched engine
+DEFAULT_MI_BLOCK_CELLS = 2 ** 22
+
+# Maximum number of CLR values to calculate at once in each block
+DEFAULT_CLR_BLOCK_CELLS = 2 ** 20
+
 
 class MIDriver:
+    """
+    Calculate CLR and MI with the engine set in the `engine` class attribute (or passed when instantiated).
+    The CLR array is returned as the `clr_dtype` class attribute (or passed when instantiated), which can be set to
+    np.float32 to halve the memory needed for CLR.
+    """
 
-    @staticmethod
-    def run(x, y, bins=DEFAULT_NUM_BINS, logtype=DEFAULT_LOG_TYPE, return_mi=True):
-        return context_likelihood_mi(x, y, bins=bins, logtype=logtype, return_mi=return_mi)
+    engine = DEFAULT_MI_ENGINE
+    clr_dtype = np.float64
 
+    def __init__(self, engine=None, clr_dtype=None):
+        assert check.argument_enum(engine, MI_ENGINES, allow_none=True)
+        self.engine = self.engine if engine is None else engine
+        self.clr_dtype = self.clr_dtype if clr_dtype is None else clr_dtype
+
+    def run(self, x, y, bins=DEFAULT_NUM_BINS, logtype=DEFAULT_LOG_TYPE, return_mi=True, row_index=None,
+            row_weights=None):
+        return context_likelihood_mi(x, y, bins=bins, logtype=logtype, return_mi=return_mi, engine=self.engine,
+                                     row_index=row_index, row_weights=row_weights, clr_dtype=self.clr_dtype)
+
+
+class DiscretizationCache(object):
+    """
+    Discretize a data matrix once and keep the bins, so that they can be reused for every MI calculation on that data
+    (the MI, the background MI, and every bootstrap). Bins are stored in the smallest integer type which holds them.
+    Sparse data stays sparse; only the stored values have bins, and the bin for the implicit zeros of each variable
+    is kept separately.
+
+    Bin edges are always set from the minimum and maximum of each variable in the full data, and bootstraps select rows
+    out of the cached bins (or weight each row by the number of times it is in the bootstrap; see bootstrap_weights).
+    This is identical to discretizing the bootstrap data unless a bootstrap does not include the row(s) holding the
+    minimum or maximum of a variable. Discretizing the bootstrap would spread the narrower range of that variable over
+    all of the bins, but the cached bins keep the full data range, so values are not moved between bins and the
+    outermost bin(s) are left empty.
+    """
 
-def context_likelihood_mi(x, y, bins=DEFAULT_NUM_BINS, logtype=DEFAULT_LOG_TYPE, return_mi=True):
+    bins = DEFAULT_NUM_BINS
+
+    gene_names = None
+    sample_names = None
+
+    # Discrete bins [N x M]. Either np.ndarray or sps.csc_matrix with bins for the stored values only
+    discrete = None
+
+    # The bin for implicit zeros for each variable [M, ] if sparse. None if dense
+    zero_bins = None
+
+    # Number of columns to discretize at once for dense data
+    _block_cells = 2 ** 24
+
+    @property
+    def shape(self):
+        return self.discrete.shape
+
+    def __init__(self, data, bins=DEFAULT_NUM_BINS):
+        """
+        :param data: Continuous data to discretize
+        :type data: InferelatorData, np.ndarray, sp.sparse.spmatrix [N x M]
+        :param bins: Number of bins for discretizing continuous variables
+        :type bins: int
+        """
+
+        assert check.argument_integer(bins, low=1)
+        self.bins = bins
+
+        if isinstance(data, InferelatorData):
+            self.gene_names = data.gene_names
+            self.sample_names = data.sample_names
+            data = data.expression_data
+
+        dtype = np.min_scalar_type(bins - 1)
+
+        if sps.isspmatrix(data):
+            discrete, self.zero_bins = _make_sparse_discrete(data, bins)
+            discrete.data = discrete.data.astype(dtype)
+            self.discrete = discrete
+        else:
+            n, m = data.shape
+            step = max(1, self._block_cells // max(n, 1))
+            self.discrete = np.empty((n, m), dtype=dtype)
+            for i in range(0, m, step):
+                self.discrete[:, i:i + step] = _make_array_discrete(data[:, i:i + step], bins, axis=0)
+
+    def onehot(self, start=None, stop=None, row_index=None, row_weights=None):
+        """
+        Build the indicator matrix (see _make_onehot) for a block of variables from the cached bins
+
+        :param start: First variable in the block. Defaults to the first variable.
+        :type start: int
+        :param stop: Variable to end the block at (exclusive). Defaults to the last variable.
+        :type stop: int
+        :param row_index: Rows to select (e.g. a bootstrap). Rows can be repeated. Defaults to all rows.
+        :type row_index: list, np.ndarray
+        :param row_weights: Weight for each row, which is used in place of 1 in the indicator matrix. Integer weights
+            give the same bin counts as a row_index which repeats each row that many times.
+        :type row_weights: np.ndarray [N, ]
+        :return onehot, zero_bins: sps.csr_matrix (n x (m * bins)), np.ndarray (m,)
+            Sparse indicator matrix and the implicit zero bin for each column (None if the data is dense)
+        """
+
+        if row_index is not None and row_weights is not None:
+            raise ValueError("Rows can be selected with row_index or weighted with row_weights, but not both")
+
+        discrete = self.discrete[:, start:stop]
+        zero_bins = None if self.zero_bins is None else self.zero_bins[start:stop]
+
+        if row_index is not None and sps.isspmatrix(discrete):
+            discrete = discrete.tocsr()[row_index, :]
+        elif row_index is not None:
+            discrete = discrete[row_index, :]
+
+        return _make_onehot(discrete, self.bins, row_weights=row_weights), zero_bins
+
+
+def bootstrap_weights(bootstrap, n):
+    """
+    Convert a bootstrap (a multiset of row indices) into the number of times each row is in the bootstrap
+
+    :param bootstrap: Row indices, which can be repeated
+    :type bootstrap: list, np.ndarray
+    :param n: Total number of rows
+    :type n: int
+    :return: Multiplicity of each row [n, ]
+    :rtype: np.ndarray
+    """
+
+    return np.bincount(np.asarray(bootstrap, dtype=np.dtype(int)), minlength=n)
+
+
+def context_likelihood_mi(x, y, bins=DEFAULT_NUM_BINS, logtype=DEFAULT_LOG_TYPE, return_mi=True,
+                          engine=DEFAULT_MI_ENGINE, row_index=None, row_weights=None, clr_dtype=np.float64):
     """
     Wrapper to calculate the Context Likelihood of Relatedness and Mutual Information for two data sets that have
     common condition rows. The y argument will be used to calculate background MI for the x & y MI.
-    As an implementation detail, y will be cast to a dense array if it is sparse.
-    X can be sparse with no internal copy.
+    With the batched engine, x and y can both be sparse and will never be cast to dense arrays, and y is only
+    discretized once for both the MI and the background MI.
+    With the map engine, y will be cast to a dense array if it is sparse and X can be sparse with no internal copy.
 
     This function handles unpacking and packing the InferelatorData.
 
-    :param x: An N x G InferelatorData object
-    :type x: InferelatorData [N x G]
-    :param y: An N x K InferelatorData object
-    :type y: InferelatorData [N x K]
+    :param x: An N x G InferelatorData object, or a DiscretizationCache built from one
+    :type x: InferelatorData, DiscretizationCache [N x G]
+    :param y: An N x K InferelatorData object, or a DiscretizationCache built from one
+    :type y: InferelatorData, DiscretizationCache [N x K]
     :param logtype: The logarithm function to use when calculating information. Defaults to natural log (np.log)
     :type logtype: np.log func
     :param bins: Number of bins for discretizing continuous variables
     :type bins: int
     :param return_mi: Boolean for returning a MI object. Defaults to True
     :type return_mi: bool
+    :param engine: The MI engine to use ("map" or "batched"). Both engines give identical results.
+        Defaults to "batched".
+    :type engine: str
+    :param row_index: Rows to select from x and y (e.g. a bootstrap). Selects rows from the cached bins; see
+        DiscretizationCache for how this differs from discretizing the selected rows. Requires the batched engine.
+    :type row_index: list, np.ndarray
+    :param row_weights: Weights for each row of x and y (e.g. the bootstrap_weights for a bootstrap). This calculates
+        MI for a bootstrap from the cached bins without selecting rows. Requires the batched engine.
+    :type row_weights: np.ndarray
+    :param clr_dtype: The dtype of the CLR array. Defaults to np.float64.
+    :type clr_dtype: np.dtype
     :return clr, mi: CLR and MI InferelatorData objects. Returns (CLR, None) if return_mi is False.
     :rtype InferelatorData, InferelatorData:
     """
 
     assert check.argument_integer(bins, allow_none=True)
+    assert check.argument_enum(engine, MI_ENGINES)
     assert min(x.shape) > 0
     assert min(y.shape) > 0
     assert check.indexes_align((x.sample_names, y.sample_names))
@@ -60,16 +208,32 @@ def context_likelihood_mi(x, y, bins=DEFAULT_NUM_BINS, logtype=DEFAULT_LOG_TYPE,
     mi_r = x.gene_names
     mi_c = y.gene_names
 
-    # Build a [G x K] mutual information array
-    mi = mutual_information(x.expression_data, y.expression_data, bins, logtype=logtype)
-    array_set_diag(mi, 0., mi_r, mi_c)
+    use_cache = isinstance(x, DiscretizationCache) or isinstance(y, DiscretizationCache)
+    use_cache = use_cache or row_index is not None or row_weights is not None
+
+    if use_cache and engine != MI_ENGINE_BATCHED:
+        raise ValueError("Cached discretization and row selection require the {e} MI engine".format(
+            e=MI_ENGINE_BATCHED))
 
-    # Build a [K x K] mutual information array
-    mi_bg = mutual_information(y.expression_data, y.expression_data, bins, logtype=logtype)
+    if use_cache or (engine == MI_ENGINE_BATCHED and not MPControl.is_dask()):
+        # Discretize each data set once and reuse y for the background MI
+        x = x if isinstance(x, DiscretizationCache) else DiscretizationCache(x, bins=bins)
+        y = y if isinstance(y, DiscretizationCache) else DiscretizationCache(y, bins=bins)
+
+        mi = build_mi_array_batched(x, y, bins, logtype=logtype, row_index=row_index, row_weights=row_weights)
+        mi_bg = build_mi_array_batched(y, y, bins, logtype=logtype, row_index=row_index, row_weights=row_weights)
+
+    else:
+        mi = mutual_information(x.expression_data, y.expression_data, bins, logtype=logtype, engine=engine)
+        mi_bg = mutual_information(y.expression_data, y.expression_data, bins, logtype=logtype, engine=engine)
+
+    # Set the diagonals of the [G x K] mutual information array and the [K x K] background array
+    array_set_diag(mi, 0., mi_r, mi_c)
     array_set_diag(mi_bg, 0., mi_c, mi_c)
 
-    # Calculate CLR
-    clr = calc_mixed_clr(mi, mi_bg)
+    # Calculate CLR (directly into the MI array if it isn't being returned)
+    clr_out = mi if not return_mi and np.dtype(clr_dtype) == mi.dtype else None
+    clr = calc_mixed_clr(mi, mi_bg, out=clr_out, dtype=clr_dtype)
 
     MPControl.sync_processes(pref=SYNC_CLR_KEY)
 
@@ -79,7 +243,7 @@ def context_likelihood_mi(x, y, bins=DEFAULT_NUM_BINS, logtype=DEFAULT_LOG_TYPE,
     return clr, mi if return_mi else None
 
 
-def mutual_information(x, y, bins, logtype=DEFAULT_LOG_TYPE):
+def mutual_information(x, y, bins, logtype=DEFAULT_LOG_TYPE, engine=DEFAULT_MI_ENGINE):
     """
     Calculate the mutual information matrix between two data matrices, where the columns are equivalent conditions
 
@@ -91,11 +255,17 @@ def mutual_information(x, y, bins, logtype=DEFAULT_LOG_TYPE):
         Number of bins to discretize continuous data into for the generation of a contingency table
     :param logtype: np.log func
         Which type of log function should be used (log2 results in MI bits, log results in MI nats, log10... is weird)
+    :param engine: str
+        Which MI engine to use ("map" or "batched"). The dask engines always use the dask-specific map.
 
     :return mi: pd.DataFrame (m1 x m2)
         The mutual information between variables m1 and m2
     """
 
+    # The batched engine discretizes both matrices itself (without densifying sparse data)
+    if engine == MI_ENGINE_BATCHED and not MPControl.is_dask():
+        return build_mi_array_batched(x, y, bins, logtype=logtype)
+
     # Discretize the input matrix y
     y = y.A if sps.isspmatrix(y) else y
     y = _make_array_discrete(y, bins, axis=0)
@@ -136,52 +306,242 @@ def build_mi_array(X, Y, bins, logtype=DEFAULT_LOG_TYPE, temp_dir=None):
         discrete_X = _make_discrete(X[:, i].A.flatten() if sps.isspmatrix(X) else X[:, i].flatten(), bins)
         return [_calc_mi(_make_table(discrete_X, Y[:, j], bins), logtype=logtype) for j in range(m2)]
 
+    # Send the MI build to the multiprocessing controller and fill the array as rows finish
+    mi = np.zeros((m1, m2), dtype=float)
+    filled = np.zeros(m1, dtype=bool)
+
+    for i, mi_row in MPControl.imap(mi_make, range(m1), tmp_file_path=temp_dir):
+        mi[i, :] = mi_row
+        filled[i] = True
+
+    assert filled.all(), "Array {n} / {m1} rows produced".format(n=np.sum(filled), m1=m1)
+
+    return mi
+
+
+def build_mi_array_batched(X, Y, bins, logtype=DEFAULT_LOG_TYPE, temp_dir=None, block_size=None, row_index=None,
+                           row_weights=None):
+    """
+    Calculate MI into an array by building the contingency tables for a block of variables in X against every variable
+    in Y at once. Each block is discretized and converted into an indicator (one-hot) matrix, which is multiplied
+    against the indicator matrix for Y to get every joint count table in a single sparse matrix product.
+
+    Sparse arrays are never made dense. Only the stored values are put into the indicator matrices, and the counts
+    for the implicit zeros (which all fall in one known bin for each variable) are added from the table margins.
+
+    :param X: np.ndarray, sp.sparse.spmatrix, DiscretizationCache (n x m1)
+        Continuous data array, or the cached bins for it
+    :param Y: np.ndarray, sp.sparse.spmatrix, DiscretizationCache (n x m2)
+        Continuous data array, or the cached bins for it
+    :param bins: int
+        Number of bins to discretize continuous data into for the generation of a contingency table
+    :param logtype: np.log func
+        Which log function to use (log2 gives bits, ln gives nats)
+    :param temp_dir: path
+        Path to write temp files for multiprocessing
+    :param block_size: int
+        Number of variables in X to calculate in each block. Set from DEFAULT_MI_BLOCK_CELLS if None.
+    :param row_index: list, np.ndarray
+        Rows to select from the discrete X and Y (e.g. a bootstrap). Defaults to all rows.
+    :param row_weights: np.ndarray (n, )
+        Weights for each row of the discrete X and Y (e.g. bootstrap_weights). Defaults to 1 for every row.
+    :return mi: np.ndarray (m1 x m2)
+        Returns the mutual information array
+    """
+
+    X = X if isinstance(X, DiscretizationCache) else DiscretizationCache(X, bins=bins)
+    Y = Y if isinstance(Y, DiscretizationCache) else DiscretizationCache(Y, bins=bins)
+
+    if X.bins != bins or Y.bins != bins:
+        raise ValueError("Cached data has {x} and {y} bins; {b} bins requested".format(x=X.bins, y=Y.bins, b=bins))
+
+    if row_weights is not None:
+        row_weights = np.asarray(row_weights)
+        assert row_weights.shape == (X.shape[0], ), "Weights {w} do not match {n} rows".format(w=row_weights.shape,
+                                                                                                n=X.shape[0])
+
+    m1, m2 = X.shape[1], Y.shape[1]
+
+    if block_size is None:
+        block_size = max(1, DEFAULT_MI_BLOCK_CELLS // (m2 * bins ** 2))
+
+    # The indicator matrix for Y is shared by every block
+    # Row weights are only applied to Y so that each joint count is weighted once
+    y_onehot, y_zero_bins = Y.onehot(row_index=row_index, row_weights=row_weights)
+
+    def mi_make_block(start):
+        stop = min(start + block_size, m1)
+        Debug.allprint("Mutual Information Calculation [{i} / {total}]".format(i=start, total=m1), level=2)
+
+        x_onehot, x_zero_bins = X.onehot(start, stop, row_index=row_index)
+        tables = _make_table_batched(x_onehot, y_onehot, bins, x_zero_bins=x_zero_bins, y_zero_bins=y_zero_bins,
+                                     row_weights=row_weights)
+        return _calc_mi_batched(tables, logtype=logtype)
+
     # Send the MI build to the multiprocessing controller
-    mi_list = MPControl.map(mi_make, range(m1), tmp_file_path=temp_dir)
+    # The dask controllers do not implement map, so the blocks are calculated locally
+    starts = range(0, m1, block_size)
+
+    if MPControl.is_dask():
+        mi_blocks = enumerate(map(mi_make_block, starts))
+    else:
+        mi_blocks = MPControl.imap(mi_make_block, starts, tmp_file_path=temp_dir)
 
-    # Convert the list of lists to an array
-    mi = np.array(mi_list)
-    assert (m1, m2) == mi.shape, "Array {sh} produced [({m1}, {m2}) expected]".format(sh=mi.shape, m1=m1, m2=m2)
+    # Fill the array as blocks finish
+    mi = np.zeros((m1, m2), dtype=float)
+    filled = np.zeros(m1, dtype=bool)
+
+    for b, mi_block in mi_blocks:
+        start = starts[b]
+        assert mi_block.shape == (min(block_size, m1 - start), m2), "Block {sh} produced".format(sh=mi_block.shape)
+
+        mi[start:start + mi_block.shape[0], :] = mi_block
+        filled[start:start + mi_block.shape[0]] = True
+
+    assert filled.all(), "Array {n} / {m1} rows produced".format(n=np.sum(filled), m1=m1)
 
     return mi
 
 
-def calc_mixed_clr(mi, mi_bg):
+def calc_mixed_clr(mi, mi_bg, out=None, dtype=np.float64, block_size=None):
     """
-    Calculate the context liklihood of relatedness from mutual information and the background mutual information
+    Calculate the context liklihood of relatedness from mutual information and the background mutual information.
+
+    The column and row means and standard deviations of the background MI are calculated first, and then CLR is
+    calculated for blocks of rows of the MI array and written into the output array, so only one block of
+    intermediate values is held in memory at a time.
 
     :param mi: Mutual information array [m1 x m2]
     :type mi: np.ndarray
     :param mi_bg: Background mutual information array [m2 x m2]
     :type mi_bg: np.ndarray
+    :param out: Array to write CLR into [m1 x m2]. This can be the mi array, which will be overwritten.
+        A new array is allocated if None.
+    :type out: np.ndarray
+    :param dtype: The dtype of the output array if a new array is allocated. Defaults to np.float64.
+    :type dtype: np.dtype
+    :param block_size: The number of rows to calculate in each block. Set from DEFAULT_CLR_BLOCK_CELLS if None.
+    :type block_size: int
     :return clr: Context liklihood of relateness array [m1 x m2]
     :rtype: np.ndarray
     """
 
+    out = np.empty(mi.shape, dtype=dtype) if out is None else out
+    assert out.shape == mi.shape, "Output array {o} does not match MI array {m}".format(o=out.shape, m=mi.shape)
+
+    if block_size is None:
+        block_size = max(1, DEFAULT_CLR_BLOCK_CELLS // max(mi.shape[1], 1))
+
+    with np.errstate(invalid='ignore'):
+        col_mean, col_std = np.mean(mi_bg, axis=0), np.std(mi_bg, axis=0, ddof=CLR_DDOF)
+        row_mean, row_std = np.mean(mi_bg, axis=1), np.std(mi_bg, axis=1, ddof=CLR_DDOF)
+
+    for i in range(0, mi.shape[0], block_size):
+        out[i:i + block_size, :] = _calc_mixed_clr_block(mi[i:i + block_size, :], col_mean, col_std, row_mean, row_std)
+
+    return out
+
+
+def _calc_mixed_clr_block(mi, col_mean, col_std, row_mean, row_std):
+    """
+    Calculate the context liklihood of relatedness for a block of rows from mutual information and the background
+    mutual information column and row means and standard deviations
+
+    :param mi: Mutual information array [b x m2]
+    :type mi: np.ndarray
+    :return clr: Context liklihood of relateness array [b x m2]
+    :rtype: np.ndarray
+    """
+
     with np.errstate(invalid='ignore'):
 
+        # Rounding so that float precision differences don't turn into huge CLR differences
+        mi = np.round(mi, 10)
+
         # Calculate the zscore for columns
-        z_col = np.round(mi, 10)  # Rounding so that float precision differences don't turn into huge CLR differences
-        z_col = np.subtract(z_col, np.mean(mi_bg, axis=0))
-        z_col = np.divide(z_col, np.std(mi_bg, axis=0, ddof=CLR_DDOF))
+        z_col = np.subtract(mi, col_mean)
+        z_col = np.divide(z_col, col_std, out=z_col)
 
         # Calculate the zscore for rows
-        z_row = np.round(mi, 10)  # Rounding so that float precision differences don't turn into huge CLR differences
-        z_row = np.subtract(z_row, np.mean(mi_bg, axis=1))
-        z_row = np.divide(z_row, np.std(mi_bg, axis=1, ddof=CLR_DDOF))
+        z_row = np.subtract(mi, row_mean, out=mi)
+        z_row = np.divide(z_row, row_std, out=z_row)
 
         z_col[z_col < 0] = 0
         z_row[z_row < 0] = 0
 
     # Calculate CLR
-    return np.sqrt(np.square(z_col) + np.square(z_row))
+    z_col = np.square(z_col, out=z_col)
+    z_col = np.add(z_col, np.square(z_row, out=z_row), out=z_col)
+    return np.sqrt(z_col, out=z_col)
 
 
 def _make_array_discrete(array, num_bins, axis=0):
     """
-    Applies _make_discrete to a 2d array
+    Applies _make_discrete to a 2d array (vectorized; the bins are identical to applying _make_discrete to each vector)
     """
-    return np.apply_along_axis(_make_discrete, arr=array, axis=axis, num_bins=num_bins)
+
+    if axis == 1:
+        return _make_array_discrete(array.T, num_bins, axis=0).T
+
+    assert check.argument_type(array, np.ndarray)
+
+    if array.ndim == 1 or array.shape[0] == 0:
+        return np.apply_along_axis(_make_discrete, arr=array, axis=axis, num_bins=num_bins)
+
+    arr_min = np.min(array, axis=0)
+    arr_range = np.max(array, axis=0) - arr_min
+    return _discretize(array, arr_min, arr_range, num_bins)
+
+
+def _make_sparse_discrete(array, num_bins):
+    """
+    Applies _make_discrete to each column of a sparse array without making it dense. The implicit zeros of a column
+    are all put into the same bin, which is returned separately.
+
+    :param array: sp.sparse.spmatrix (n x m)
+        2d sparse array of continuous data
+    :param num_bins: int
+        Number of bins for data
+    :return discrete, zero_bins: sp.sparse.csc_matrix (n x m), np.ndarray (m,)
+        Sparse array of discrete data for each stored value (bin 0 is kept as an explicit value), and the bin that the
+        implicit zeros fall into for each column
+    """
+
+    array = sps.csc_matrix(array)
+
+    # The min and max include the implicit zeros of any column which has them
+    arr_min = array.min(axis=0).A.flatten()
+    arr_range = array.max(axis=0).A.flatten() - arr_min
+
+    # Expand the column parameters to the stored values
+    stored_cols = np.repeat(np.arange(array.shape[1]), np.diff(array.indptr))
+    discrete = _discretize(array.data, arr_min[stored_cols], arr_range[stored_cols], num_bins)
+
+    # Columns with no implicit zeros will have no counts in the zero bin, so it just needs to be a valid bin
+    zero_bins = _discretize(np.zeros(array.shape[1], dtype=array.dtype), arr_min, arr_range, num_bins)
+    zero_bins = np.clip(zero_bins, 0, num_bins - 1)
+
+    return sps.csc_matrix((discrete, array.indices.copy(), array.indptr.copy()), shape=array.shape), zero_bins
+
+
+def _discretize(array, arr_min, arr_range, num_bins):
+    """
+    Convert continuous values to discrete bins using the minimum and range of the vector that they came from. This is
+    the same calculation as _make_discrete, but arr_min and arr_range can be arrays which broadcast against array.
+    """
+
+    try:
+        eps = np.finfo(array.dtype).eps
+    except ValueError:
+        eps = np.finfo(float).eps
+
+    eps_mod = np.maximum(eps, eps * arr_range)
+
+    discrete = np.floor((array - arr_min) / (arr_range + eps_mod) * num_bins).astype(np.dtype(int))
+
+    # Constant vectors are all put into the first bin
+    discrete[np.broadcast_to(arr_range == 0, discrete.shape)] = 0
+    return discrete
 
 
 def _make_discrete(arr_vec, num_bins):
@@ -242,6 +602,134 @@ def _make_table(x, y, num_bins):
     return np.bincount(reindex, minlength=num_bins ** 2).reshape(num_bins, num_bins).astype(np.dtype(float))
 
 
+def _make_onehot(array, num_bins, row_weights=None):
+    """
+    Takes a 2d array of discrete integer bins and constructs a sparse indicator matrix where each variable is expanded
+    into num_bins columns
+    :param array: np.ndarray, sp.sparse.spmatrix (n x m)
+        2d array of discrete data. If sparse, only the stored values (including explicit zeros) will have indicators.
+    :param num_bins: int
+        Number of bins for data
+    :param row_weights: np.ndarray (n, )
+        Value of the indicators in each row. Defaults to 1.
+    :return onehot: sps.csr_matrix (n x (m * num_bins))
+        Sparse indicator matrix with one nonzero per variable per row (or per stored value if sparse)
+    """
+
+    n, m = array.shape
+    row_weights = None if row_weights is None else np.asarray(row_weights, dtype=np.dtype(float))
+
+    if sps.isspmatrix(array):
+        array = array.tocoo()
+        onehot_cols = array.data + array.col.astype(np.dtype(int)) * num_bins
+        onehot_data = np.ones(array.nnz, dtype=np.dtype(float)) if row_weights is None else row_weights[array.row]
+        return sps.csr_matrix((onehot_data, (array.row, onehot_cols)), shape=(n, m * num_bins))
+
+    onehot_cols = (array + np.arange(m) * num_bins).ravel()
+    onehot_data = np.ones(n * m, dtype=np.dtype(float)) if row_weights is None else np.repeat(row_weights, m)
+    return sps.csr_matrix((onehot_data, onehot_cols, np.arange(0, n * m + 1, m)), shape=(n, m * num_bins))
+
+
+def _make_table_batched(x_onehot, y_onehot, num_bins, x_zero_bins=None, y_zero_bins=None, row_weights=None):
+    """
+    Takes two sparse indicator matrices from _make_onehot and constructs contingency tables for every pair of variables
+    :param x_onehot: sps.csr_matrix (n x (m1 * num_bins))
+        Indicator matrix of variables in x
+    :param y_onehot: sps.csr_matrix (n x (m2 * num_bins))
+        Indicator matrix of variables in y
+    :param num_bins: int
+        Number of bins for data
+    :param x_zero_bins: np.ndarray (m1,)
+        The bin for values which have no indicator in x_onehot (implicit zeros). None if every value has an indicator.
+    :param y_zero_bins: np.ndarray (m2,)
+        The bin for values which have no indicator in y_onehot (implicit zeros). None if every value has an indicator.
+    :param row_weights: np.ndarray (n, )
+        Row weights which have been applied to y_onehot (but not to x_onehot). None if the rows are not weighted.
+    :return ctables: np.ndarray (m1 x m2 x num_bins x num_bins)
+        Contingency tables of each variable in X against each variable in Y
+    """
+
+    n = x_onehot.shape[0] if row_weights is None else np.sum(row_weights)
+    m1, m2 = x_onehot.shape[1] // num_bins, y_onehot.shape[1] // num_bins
+
+    # Every joint count is the dot product of the indicator vectors for the two bins
+    ctables = x_onehot.T.dot(y_onehot).A.reshape(m1, num_bins, m2, num_bins)
+    ctables = np.ascontiguousarray(ctables.transpose((0, 2, 1, 3)))
+
+    if x_zero_bins is None and y_zero_bins is None:
+        return ctables
+
+    # Variables which have an indicator for every value can use any zero bin; it will get counts of 0
+    x_zero_bins = np.zeros(m1, dtype=np.dtype(int)) if x_zero_bins is None else x_zero_bins
+    y_zero_bins = np.zeros(m2, dtype=np.dtype(int)) if y_zero_bins is None else y_zero_bins
+
+    # Counts for the values which have indicators, by bin [m x num_bins] and total [m,]
+    if row_weights is None:
+        x_counts = np.asarray(x_onehot.sum(axis=0)).reshape(m1, num_bins)
+    else:
+        x_counts = x_onehot.T.dot(np.asarray(row_weights, dtype=np.dtype(float))).reshape(m1, num_bins)
+    y_counts = np.asarray(y_onehot.sum(axis=0)).reshape(m2, num_bins)
+
+    # Counts for the rows where both x and y have indicators
+    both_by_x = ctables.sum(axis=3)
+    both_by_y = ctables.sum(axis=2)
+    both = both_by_x.sum(axis=2)
+
+    ii, jj = np.arange(m1)[:, None], np.arange(m2)[None, :]
+
+    # Rows where x has an indicator and y is zero
+    ctables[ii, jj, :, y_zero_bins[jj]] += x_counts[:, None, :] - both_by_x
+
+    # Rows where y has an indicator and x is zero
+    ctables[ii, jj, x_zero_bins[ii], :] += y_counts[None, :, :] - both_by_y
+
+    # Rows where both are zero
+    ctables[ii, jj, x_zero_bins[ii], y_zero_bins[jj]] += n - x_counts.sum(axis=1)[:, None] - y_counts.sum(axis=1) + both
+
+    return ctables
+
+
+def _calc_mi_batched(tables, logtype=DEFAULT_LOG_TYPE):
+    """
+    Calculate Mutual Information from a stack of contingency tables. This is the same calculation as _calc_mi, applied
+    to whole arrays
+
+    :param tables: np.ndarray (... x num_bins x num_bins)
+        Contingency tables
+    :param logtype: np.log func
+        Log function to use
+    :return: np.ndarray (...)
+        Mutual information for each table
+    """
+
+    # Turn off runtime warnings (there is an explicit check for NaNs and INFs in-function)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m, n = tables.shape[-2:]
+        assert n == m
+
+        total = np.sum(tables, axis=(-2, -1), keepdims=True)
+
+        # (PxPy) [... x n x n]
+        mi_val = np.multiply(np.sum(tables, axis=-1, keepdims=True) / total,
+                             np.sum(tables, axis=-2, keepdims=True) / total)
+
+        # (Pxy) [... x n x n]
+        tables = np.divide(tables, total)
+
+        # (Pxy)/(PxPy) [... x n x n]
+        mi_val = np.divide(tables, mi_val)
+
+        # log[(Pxy)/(PxPy)] [... x n x n]
+        mi_val = logtype(mi_val)
+
+        # Pxy(log[(Pxy)/(PxPy)]) [... x n x n]
+        mi_val = np.multiply(tables, mi_val)
+        mi_val[np.isnan(mi_val)] = 0
+
+        # Summation
+        return np.sum(mi_val.reshape(mi_val.shape[:-2] + (m * n,)), axis=-1)
+
+
 def _calc_mi(table, logtype=DEFAULT_LOG_TYPE):
     """
     Calculate Mutual Information from a contingency table of two variables
@@ -1,5 +1,7 @@
 import unittest
 from inferelator.regression import base_regression
+from inferelator.distributed.inferelator_mp import MPControl
+from inferelator.utils import InferelatorData
 import pandas as pd
 import numpy as np
 import os
@@ -35,3 +37,147 @@ class TestBaseRegression(unittest.TestCase):
         error_reduction = base_regression.predict_error_reduction(x, y, betas)
         np.testing.assert_array_almost_equal(error_reduction, np.array([-133.333, -133.333, -133.333]), 2)
 
+    def test_predict_error_reduction_closed_form(self):
+        rng = np.random.RandomState(42)
+        x = rng.randn(30, 4) * [1, 2, 3, 4] + [0, 1, -1, 2]
+        y = (np.dot(x, [1, -1, 0.5, 0]) + rng.randn(30) + 3).reshape(-1, 1)
+        pp_idx = [0, 1, 2, 3]
+
+        xtx, xty = np.dot(x.T, x), np.dot(x.T, y)
+        ss_closed = base_regression._leave_one_out_sigma_squared(x, y, xtx, xty)
+        ss_refit = base_regression._leave_one_out_sigma_squared_refit(x, y, pp_idx, xtx, xty)
+        np.testing.assert_array_almost_equal(ss_closed, ss_refit)
+
+        betas = base_regression.recalculate_betas_from_selected(x, y)
+        ss_all = base_regression.sigma_squared(x, y, betas)
+        error_reduction = base_regression.predict_error_reduction(x, y, betas)
+        np.testing.assert_array_almost_equal(error_reduction, 1 - ss_all / ss_refit)
+
+    def test_predict_error_reduction_ill_conditioned(self):
+        x = np.array([[0, 0, 1], [1, 1, 0], [2, 2, 1], [3, 3, 0], [4, 4, 2]], dtype=float)
+        x[:, 1] += [0, 1e-9, 0, 0, 0]
+        y = np.array([[0, 1, 0, 1, 0]], dtype=float).T
+        betas = np.array([1., 1., 2.])
+
+        xtx, xty = np.dot(x.T, x), np.dot(x.T, y)
+        ss_refit = base_regression._leave_one_out_sigma_squared_refit(x, y, [0, 1, 2], xtx, xty)
+        ss_all = base_regression.sigma_squared(x, y, betas)
+        error_reduction = base_regression.predict_error_reduction(x, y, betas)
+        np.testing.assert_array_almost_equal(error_reduction, 1 - ss_all / ss_refit)
+
+
+
+class TestGeneBlocks(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        if not MPControl.is_initialized:
+            MPControl.set_multiprocess_engine("local")
+            MPControl.connect()
+
+    def setUp(self):
+        self.regress = base_regression.BaseRegression.__new__(base_regression.BaseRegression)
+        self.regress.G = 10
+
+    def test_block_size_auto(self):
+        self.assertEqual(base_regression.gene_block_size_auto(10, 1), 3)
+        self.assertEqual(base_regression.gene_block_size_auto(10, 4), 1)
+        self.assertEqual(base_regression.gene_block_size_auto(20000, 8), 625)
+        self.assertEqual(base_regression.gene_block_size_auto(20000, 8, blocks_per_worker=1), 2500)
+        self.assertEqual(base_regression.gene_block_size_auto(0, 8), 1)
+
+    def test_gene_blocks(self):
+        self.regress.gene_block_size = None
+        self.assertListEqual(self.regress.gene_blocks(), [range(i, i + 1) for i in range(10)])
+
+        self.regress.gene_block_size = 4
+        self.assertListEqual(self.regress.gene_blocks(), [range(0, 4), range(4, 8), range(8, 10)])
+
+        self.regress.gene_block_size = "auto"
+        self.assertListEqual(self.regress.gene_blocks(), [range(0, 3), range(3, 6), range(6, 9), range(9, 10)])
+
+        self.regress.gene_block_size = 0
+        with self.assertRaises(ValueError):
+            self.regress.gene_blocks()
+
+    def test_map_genes(self):
+        self.regress.result_container = None
+        for block_size in [None, 1, 3, "auto", 20]:
+            self.regress.gene_block_size = block_size
+            self.assertListEqual(self.regress.map_genes(lambda j: {'ind': j}), [{'ind': j} for j in range(10)])
+
+    def test_set_bootstrap_source(self):
+        response = InferelatorData(pd.DataFrame(np.arange(20).reshape(2, 10), columns=list("abcdefghij")))
+        self.regress.genes = response.gene_names
+
+        self.assertIs(self.regress.set_bootstrap_source(response, [1, 1]), self.regress)
+        self.assertIs(self.regress.response_source, response)
+        np.testing.assert_array_equal(self.regress.bootstrap_index, np.array([1, 1]))
+
+        self.regress.genes = pd.Index(list("jihgfedcba"))
+        with self.assertRaises(ValueError):
+            self.regress.set_bootstrap_source(response, [0, 1])
+
+    def test_imap_genes(self):
+        self.regress.result_container = None
+        for block_size in [None, 3, "auto"]:
+            self.regress.gene_block_size = block_size
+            run_data = sorted(self.regress.imap_genes(lambda j: {'ind': j}), key=lambda x: x['ind'])
+            self.assertListEqual(run_data, [{'ind': j} for j in range(10)])
+
+    def test_imap_genes_container(self):
+        def regression_maker(j):
+            return dict(ind=j, pp=[True, False], betas=np.array([j]), betas_resc=np.array([1.]))
+
+        self.regress.gene_block_size = 4
+        run_data = self.regress.imap_genes(regression_maker)
+        self.assertFalse(isinstance(run_data, list))
+
+        betas, betas_resc = base_regression.RegressionResults.from_results(run_data).pileup(10, 2)
+        np.testing.assert_array_equal(betas[:, 0], np.arange(10))
+        np.testing.assert_array_equal(betas_resc[:, 0], np.ones(10))
+
+    def test_map_genes_container(self):
+        def regression_maker(j):
+            return dict(ind=j, pp=[True, False, True], betas=np.array([j, 0.]), betas_resc=np.array([1., 0.]))
+
+        self.regress.K = 3
+        for block_size in [None, 3, "auto"]:
+            self.regress.gene_block_size = block_size
+            run_data = self.regress.map_genes(regression_maker)
+            self.assertTrue(all(isinstance(r, base_regression.RegressionResults) for r in run_data))
+            self.assertEqual(sum(len(r) for r in run_data), 10)
+
+            betas, betas_resc = base_regression.RegressionResults.from_results(run_data).pileup(10, 3)
+            np.testing.assert_array_equal(betas[:, 0], np.arange(10))
+            np.testing.assert_array_equal(betas_resc[:, 0], np.ones(10))
+            self.assertEqual(np.sum(betas[:, 1:] != 0), 0)
+            self.assertEqual(np.sum(betas_resc[:, 1:] != 0), 0)
+
+
+class TestRegressionResults(unittest.TestCase):
+
+    def test_add_and_pileup(self):
+        results = base_regression.RegressionResults(capacity=1)
+        results.add(0, np.array([True, True, False]), np.array([1., 0.]), np.array([0.5, 0.]))
+        results.add(2, [True, True, True], np.zeros(3), np.zeros(3))
+        results.add(1, np.array([False, True, True]), np.array([[2.], [3.]]), np.array([[0.2], [0.3]]))
+        self.assertEqual(len(results), 3)
+
+        betas, betas_resc = results.pileup(3, 3)
+        np.testing.assert_array_equal(betas, np.array([[1., 0., 0.], [0., 2., 3.], [0., 0., 0.]]))
+        np.testing.assert_array_equal(betas_resc, np.array([[0.5, 0., 0.], [0., 0.2, 0.3], [0., 0., 0.]]))
+
+    def test_from_results(self):
+        block = base_regression.RegressionResults.from_results([dict(ind=1, pp=[False, True], betas=[1.],
+                                                                     betas_resc=[0.1])])
+        self.assertEqual(block.target.shape[0], 1)
+
+        results = base_regression.RegressionResults.from_results([dict(ind=0, pp=[True, False], betas=[-1.],
+                                                                       betas_resc=[0.4]), block])
+        betas, betas_resc = results.pileup(2, 2)
+        np.testing.assert_array_equal(betas, np.array([[-1., 0.], [0., 1.]]))
+        np.testing.assert_array_equal(betas_resc, np.array([[0.4, 0.], [0., 0.1]]))
+
+        with self.assertRaises(RuntimeError):
+            base_regression.RegressionResults.from_results([block, None])
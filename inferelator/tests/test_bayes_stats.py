@@ -1,6 +1,7 @@
 import unittest
 from inferelator.regression import bayes_stats
 import numpy as np
+import scipy.special
 import scipy.stats
 
 
@@ -161,6 +162,69 @@ class TestBayesStats(unittest.TestCase):
         result = bayes_stats.calc_all_expected_BIC(x, y, g, combinations)
         np.testing.assert_array_almost_equal(result, np.array([12.9965, 8.1682, 11.387, 9.7776]), 4)
 
+    def test_calc_all_expected_BIC_by_combination(self):
+        rng = np.random.RandomState(42)
+        x = rng.randn(20, 5)
+        x[:, 4] = 0
+        y = (np.dot(x[:, [0, 2]], [1., -1.]) + rng.randn(20)).reshape(-1, 1)
+        g = rng.rand(5, 1)
+        combinations = bayes_stats.combo_index(5)
+        gprior = np.sqrt(1.0 / (g + 1.0))
+        gprior = np.dot(gprior, gprior.T)
+
+        for ols in [False, True]:
+            result = bayes_stats.calc_all_expected_BIC(x, y, g, combinations, ordinary_least_squares=ols)
+
+            for i in range(combinations.shape[1]):
+                c = combinations[:, i]
+                if c.sum() == 0:
+                    self.assertAlmostEqual(result[i], 20 * np.log(np.var(y, ddof=1)))
+                    continue
+                elif c[4]:
+                    self.assertEqual(result[i], np.inf)
+                    continue
+
+                xtx = np.dot(x[:, c].T, x[:, c])
+                beta = bayes_stats._solve_model(xtx, np.dot(x[:, c].T, y))
+                model_ssr = bayes_stats.ssr(x[:, c], y, beta)
+
+                if ols:
+                    expected = bayes_stats._calc_BIC_RSS(20, c.sum(), model_ssr)
+                else:
+                    scale = bayes_stats._calc_ig_scale(beta, model_ssr, xtx, gprior[np.ix_(c, c)])
+                    expected = bayes_stats._calc_BIC_inverse_gamma(20, c.sum(), scipy.special.digamma(10), scale)
+
+                self.assertAlmostEqual(result[i], np.asarray(expected).item())
+
+    def test_calc_all_expected_BIC_incremental(self):
+        rng = np.random.RandomState(42)
+        x = rng.randn(30, 7)
+        x[:, 3] = x[:, 1] * 2
+        x[:, 5] = 0
+        y = (np.dot(x[:, [0, 2]], [1., -1.]) + rng.randn(30)).reshape(-1, 1)
+        g = rng.rand(7, 1)
+
+        for ols in [False, True]:
+            expected = bayes_stats.calc_all_expected_BIC(x, y, g, bayes_stats.combo_index(7), check_rank=True,
+                                                         ordinary_least_squares=ols)
+            result = bayes_stats.calc_all_expected_BIC_incremental(x, y, g, ordinary_least_squares=ols)
+            np.testing.assert_array_equal(np.isinf(result), np.isinf(expected))
+            np.testing.assert_array_almost_equal(result[np.isfinite(result)], expected[np.isfinite(expected)])
+
+            betas = bayes_stats.best_subset_regression(x, y, g, ordinary_least_squares=ols)
+            betas_incremental = bayes_stats.best_subset_regression(x, y, g, ordinary_least_squares=ols,
+                                                                   incremental_bic=True)
+            np.testing.assert_array_almost_equal(betas, betas_incremental)
+
+    def test_solve_model_batch_singular(self):
+        xtx = np.array([[[2., 1.], [1., 2.]], [[1., 1.], [1., 1.]], [[0., 0.], [0., 1.]], [[4., 0.], [0., 1.]]])
+        xty = np.ones((4, 2, 1))
+
+        for check_rank in [True, False]:
+            beta, solved = bayes_stats._solve_model_batch(xtx, xty, check_rank=check_rank)
+            np.testing.assert_array_equal(solved, [True, False, False, True])
+            np.testing.assert_array_almost_equal(beta[:, :, 0], [[1 / 3, 1 / 3], [0, 0], [0, 0], [0.25, 1]])
+
     def test_calc_rate(self):
         x = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]])
         y = np.array([[1, 2, 3], [0, 1, 1], [1, 1, 1], [1, 0, 1]])
@@ -227,6 +291,26 @@ class TestBayesStats(unittest.TestCase):
         result = bayes_stats.ssr(x, y, beta)
         np.testing.assert_array_equal(result, 31)
 
+    def test_ssr_from_products(self):
+        x = np.array([[1, 0, 4, 3, 2], [1, 1, 2, 2, 3], [0, 1, -1, -2, 1]]).T
+        y = np.array([[1, 1, 1, 2, 5]]).T
+        beta = np.array([[1, -2, 0.5]]).T
+        result = bayes_stats._ssr_from_products(np.dot(y.T, y), np.dot(x.T, y), np.dot(x.T, x), beta)
+        self.assertAlmostEqual(result, bayes_stats.ssr(x, y, beta))
+
+    def test_bbsr_precalculated_xtx(self):
+        rng = np.random.RandomState(42)
+        x = scipy.stats.zscore(rng.randn(30, 12), ddof=1)
+        y = scipy.stats.zscore(np.dot(x[:, [1, 4, 7]], [1., -2., 0.5]) + rng.randn(30) * 0.5, ddof=1)
+        pp = np.ones(12, dtype=bool)
+        weights = np.ones(12)
+
+        result = bayes_stats.bbsr(x, y.copy(), pp.copy(), weights, 4)
+        result_xtx = bayes_stats.bbsr(x, y.copy(), pp.copy(), weights, 4, xtx=np.dot(x.T, x))
+
+        for component in ['pp', 'betas', 'betas_resc']:
+            np.testing.assert_array_almost_equal(result[component], result_xtx[component])
+
     def test_combo_index(self):
         n = 3
         result = bayes_stats.combo_index(n)
@@ -242,3 +326,19 @@ class TestBayesStats(unittest.TestCase):
        [False,  True, False,  True, False,  True],
        [False, False,  True, False,  True,  True]]))
 
+    def test_select_index_r(self):
+        result = bayes_stats.select_index(4, r=3)
+        np.testing.assert_array_equal(result, np.array([[True, True, True, False],
+                                                        [True, True, False, True],
+                                                        [True, False, True, True],
+                                                        [False, True, True, True]]))
+
+    def test_index_memoized(self):
+        self.assertIs(bayes_stats.combo_index(5), bayes_stats.combo_index(5))
+        self.assertIs(bayes_stats.select_index(5), bayes_stats.select_index(5))
+
+        with self.assertRaises(ValueError):
+            bayes_stats.combo_index(5)[0, 0] = True
+
+        with self.assertRaises(ValueError):
+            bayes_stats.select_index(5)[0, 0] = False
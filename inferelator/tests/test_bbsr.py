@@ -181,3 +181,25 @@ class TestBBSRrunnerPython(unittest.TestCase):
                                                    columns=['gene1', 'gene2']).astype(float))
         pdt.assert_frame_equal(resc, pd.DataFrame([[0, 1], [1, 0]], index=['gene1', 'gene2'],
                                                   columns=['gene1', 'gene2']).astype(float))
+
+    def test_build_pp_matrix(self):
+        genes = ['gene1', 'gene2', 'gene3']
+        tfs = ['tf1', 'gene2', 'tf2', 'gene3']
+        self.X = InferelatorData(pd.DataFrame(np.arange(8).reshape(2, 4), columns=tfs))
+        self.Y = InferelatorData(pd.DataFrame(np.arange(6).reshape(2, 3), columns=genes))
+        self.priors = pd.DataFrame([[0, 0, 0, 1], [0, 0, 0, 0], [0, 0, 0, 0]], index=genes, columns=tfs)
+        self.clr = pd.DataFrame([[.1, .4, .2, 0.],
+                                 [.3, .9, np.nan, 0.],
+                                 [0., .5, .6, .8]], index=genes, columns=tfs)
+
+        pp = bbsr_python.BBSR(self.X, self.Y, self.clr, self.priors, nS=2).pp
+        expected = pd.DataFrame([[False, True, True, True],
+                                 [True, False, False, False],
+                                 [False, False, True, False]], index=genes, columns=tfs)
+        pdt.assert_frame_equal(pp, expected)
+
+        pp = bbsr_python.BBSR(self.X, self.Y, self.clr, self.priors, nS=10).pp
+        expected = pd.DataFrame([[True, True, True, True],
+                                 [True, False, False, False],
+                                 [False, True, True, False]], index=genes, columns=tfs)
+        pdt.assert_frame_equal(pp, expected)
@@ -81,3 +81,205 @@ class Test2By3(unittest.TestCase):
         self.clr_matrix, self.mi_matrix = mi.context_likelihood_mi(self.x_dataframe, self.y_dataframe)
         expected = np.array([[0, 1], [1, 0]])
         np.testing.assert_almost_equal(self.clr_matrix.values, expected)
+
+
+class TestMIEngines(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(1234)
+        self.x = rng.randn(50, 20)
+        self.x[:, 3] = 1
+        self.y = rng.randn(50, 8)
+        self.x_dataframe = InferelatorData(expression_data=self.x)
+        self.y_dataframe = InferelatorData(expression_data=self.y)
+
+    def test_array_discrete(self):
+        for arr in [self.x, (self.x * 10).astype(int), self.x.astype(np.float32)]:
+            expected = np.apply_along_axis(mi._make_discrete, arr=arr, axis=0, num_bins=10)
+            np.testing.assert_array_equal(mi._make_array_discrete(arr, 10, axis=0), expected)
+            np.testing.assert_array_equal(mi._make_array_discrete(arr.T, 10, axis=1), expected.T)
+
+    def test_batched_matches_map(self):
+        mi_map = mi.mutual_information(self.x, self.y, 10, engine="map")
+        mi_batched = mi.mutual_information(self.x, self.y, 10, engine="batched")
+        np.testing.assert_array_equal(mi_map, mi_batched)
+
+    def test_batched_blocks(self):
+        mi_map = mi.mutual_information(self.x, self.y, 10, engine="map")
+        y = mi._make_array_discrete(self.y, 10)
+        for block_size in [1, 3, 20, 100]:
+            np.testing.assert_array_equal(mi.build_mi_array_batched(self.x, y, 10, block_size=block_size), mi_map)
+
+    def test_batched_sparse(self):
+        x, y = self.x.copy(), self.y.copy()
+        x[x < 0], y[y < 0.5] = 0, 0
+        x[:, 0], y[:, 0] = 0, 0
+        x[:, 1] = np.abs(x[:, 1]) + 1
+        y[:, 1] = -np.abs(y[:, 1]) - 1
+
+        mi_map = mi.mutual_information(x, y, 10, engine="map")
+        for x_sparse, y_sparse in [(sps.csc_matrix(x), y), (x, sps.csc_matrix(y)),
+                                   (sps.csc_matrix(x), sps.csc_matrix(y)), (sps.csr_matrix(x), sps.csr_matrix(y))]:
+            mi_sparse = mi.mutual_information(x_sparse, y_sparse, 10, engine="batched")
+            np.testing.assert_array_equal(mi_map, mi_sparse)
+
+    def test_sparse_discrete(self):
+        x = self.x.copy()
+        x[x < 0] = 0
+        x[:, 1] = np.abs(x[:, 1]) + 1
+        expected = mi._make_array_discrete(x, 10)
+
+        discrete, zero_bins = mi._make_sparse_discrete(sps.csc_matrix(x), 10)
+        np.testing.assert_array_equal(discrete.A[x != 0], expected[x != 0])
+
+        has_zeros = (x == 0).any(axis=0)
+        np.testing.assert_array_equal(zero_bins[has_zeros], expected.max(axis=0, initial=0, where=x == 0)[has_zeros])
+
+    def test_driver_engine(self):
+        clr_map, mi_map = mi.MIDriver(engine="map").run(self.x_dataframe, self.y_dataframe)
+        clr_batched, mi_batched = mi.MIDriver(engine="batched").run(self.x_dataframe, self.y_dataframe)
+        np.testing.assert_array_equal(mi_map.values, mi_batched.values)
+        np.testing.assert_array_equal(clr_map.values, clr_batched.values)
+
+    def test_driver_bad_engine(self):
+        with self.assertRaises(ValueError):
+            mi.MIDriver(engine="V8")
+
+
+class TestMIDiscretizationCache(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(1234)
+        self.x = rng.randn(50, 20)
+        self.y = rng.randn(50, 8)
+        self.x_dataframe = InferelatorData(expression_data=self.x)
+        self.y_dataframe = InferelatorData(expression_data=self.y)
+
+        self.x_sparse = self.x.copy()
+        self.x_sparse[self.x_sparse < 0] = 0
+        self.x_sparse[:, 1] = np.abs(self.x_sparse[:, 1]) + 1
+
+        # Every row is included, so the min and max of every column are in the bootstrap
+        self.bootstrap = np.concatenate((np.arange(50), np.random.RandomState(42).choice(50, size=20)))
+
+    def test_cache_dtype(self):
+        self.assertEqual(mi.DiscretizationCache(self.x).discrete.dtype, np.uint8)
+        self.assertEqual(mi.DiscretizationCache(sps.csc_matrix(self.x_sparse)).discrete.dtype, np.uint8)
+        self.assertEqual(mi.DiscretizationCache(self.x, bins=1000).discrete.dtype, np.uint16)
+
+    def test_cache_matches_map(self):
+        for x in [self.x, self.x_sparse, sps.csc_matrix(self.x_sparse), sps.csr_matrix(self.x_sparse)]:
+            x_dense = x.A if sps.isspmatrix(x) else x
+            mi_map = mi.mutual_information(x_dense, self.y, 10, engine="map")
+            mi_cache = mi.build_mi_array_batched(mi.DiscretizationCache(x), mi.DiscretizationCache(self.y), 10)
+            np.testing.assert_array_equal(mi_map, mi_cache)
+
+    def test_cache_bootstrap(self):
+        for x in [self.x, self.x_sparse, sps.csc_matrix(self.x_sparse)]:
+            x_dense = x.A if sps.isspmatrix(x) else x
+            mi_map = mi.mutual_information(x_dense[self.bootstrap, :], self.y[self.bootstrap, :], 10, engine="map")
+            mi_cache = mi.build_mi_array_batched(mi.DiscretizationCache(x), mi.DiscretizationCache(self.y), 10,
+                                                 row_index=self.bootstrap, block_size=7)
+            np.testing.assert_array_equal(mi_map, mi_cache)
+
+    def test_cache_bootstrap_range(self):
+        # Without row 0 the bootstrap range of column 0 is smaller, but the cached bins use the full range
+        x = np.arange(10, dtype=float).reshape(-1, 1)
+        x_cache = mi.DiscretizationCache(x, bins=3)
+        np.testing.assert_array_equal(x_cache.discrete.flatten(), [0, 0, 0, 0, 1, 1, 1, 2, 2, 2])
+        np.testing.assert_array_equal(x_cache.onehot(row_index=[1, 2, 9])[0].A, [[1, 0, 0], [1, 0, 0], [0, 0, 1]])
+
+    def test_cache_clr(self):
+        x_cache, y_cache = mi.DiscretizationCache(self.x_dataframe), mi.DiscretizationCache(self.y_dataframe)
+        clr, mi_data = mi.MIDriver().run(self.x_dataframe, self.y_dataframe)
+        clr_cache, mi_cache = mi.MIDriver().run(x_cache, y_cache)
+        pd.testing.assert_frame_equal(clr, clr_cache)
+        pd.testing.assert_frame_equal(mi_data, mi_cache)
+
+        x_boot = InferelatorData(expression_data=self.x[self.bootstrap, :])
+        y_boot = InferelatorData(expression_data=self.y[self.bootstrap, :])
+        clr, mi_data = mi.MIDriver().run(x_boot, y_boot)
+        clr_cache, mi_cache = mi.MIDriver().run(x_cache, y_cache, row_index=self.bootstrap)
+        pd.testing.assert_frame_equal(clr, clr_cache)
+        pd.testing.assert_frame_equal(mi_data, mi_cache)
+
+    def test_bootstrap_weights(self):
+        np.testing.assert_array_equal(mi.bootstrap_weights([0, 0, 3, 1, 3, 3], 5), [2, 1, 0, 3, 0])
+
+    def test_cache_weights(self):
+        bootstrap = np.random.RandomState(42).choice(50, size=50)
+        weights = mi.bootstrap_weights(bootstrap, 50)
+        y_cache = mi.DiscretizationCache(self.y)
+
+        for x in [self.x, sps.csc_matrix(self.x_sparse), sps.csr_matrix(self.x_sparse)]:
+            x_cache = mi.DiscretizationCache(x)
+            mi_index = mi.build_mi_array_batched(x_cache, y_cache, 10, row_index=bootstrap)
+            mi_weights = mi.build_mi_array_batched(x_cache, y_cache, 10, row_weights=weights, block_size=7)
+            np.testing.assert_array_equal(mi_index, mi_weights)
+
+            mi_sparse_y = mi.build_mi_array_batched(x_cache, mi.DiscretizationCache(sps.csc_matrix(self.x_sparse)), 10,
+                                                    row_weights=weights)
+            mi_sparse_y_index = mi.build_mi_array_batched(x_cache, mi.DiscretizationCache(self.x_sparse), 10,
+                                                          row_index=bootstrap)
+            np.testing.assert_array_equal(mi_sparse_y, mi_sparse_y_index)
+
+    def test_cache_weights_clr(self):
+        x_cache, y_cache = mi.DiscretizationCache(self.x_dataframe), mi.DiscretizationCache(self.y_dataframe)
+        weights = mi.bootstrap_weights(self.bootstrap, 50)
+
+        clr, mi_data = mi.MIDriver().run(x_cache, y_cache, row_index=self.bootstrap)
+        clr_weights, mi_weights = mi.MIDriver().run(x_cache, y_cache, row_weights=weights)
+        pd.testing.assert_frame_equal(clr, clr_weights)
+        pd.testing.assert_frame_equal(mi_data, mi_weights)
+
+        with self.assertRaises(ValueError):
+            mi.MIDriver().run(x_cache, y_cache, row_index=self.bootstrap, row_weights=weights)
+
+    def test_cache_needs_batched(self):
+        with self.assertRaises(ValueError):
+            mi.MIDriver(engine="map").run(mi.DiscretizationCache(self.x_dataframe), self.y_dataframe)
+
+        with self.assertRaises(ValueError):
+            mi.build_mi_array_batched(mi.DiscretizationCache(self.x, bins=5), self.y, 10)
+
+
+class TestCLR(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(1234)
+        self.mi = rng.rand(40, 12)
+        self.mi_bg = rng.rand(12, 12)
+        self.mi_bg[:, 2], self.mi_bg[2, :] = 0.5, 0.5
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z_col = np.round(self.mi, 10) - np.mean(self.mi_bg, axis=0)
+            z_col /= np.std(self.mi_bg, axis=0, ddof=mi.CLR_DDOF)
+            z_row = np.round(self.mi, 10) - np.mean(self.mi_bg, axis=1)
+            z_row /= np.std(self.mi_bg, axis=1, ddof=mi.CLR_DDOF)
+            z_col[z_col < 0], z_row[z_row < 0] = 0, 0
+
+        self.clr = np.sqrt(np.square(z_col) + np.square(z_row))
+
+    def test_clr_blocks(self):
+        for block_size in [None, 1, 7, 40, 100]:
+            np.testing.assert_array_equal(mi.calc_mixed_clr(self.mi, self.mi_bg, block_size=block_size), self.clr)
+
+    def test_clr_float32(self):
+        clr = mi.calc_mixed_clr(self.mi, self.mi_bg, dtype=np.float32, block_size=9)
+        self.assertEqual(clr.dtype, np.float32)
+        np.testing.assert_array_equal(clr, self.clr.astype(np.float32))
+
+    def test_clr_in_place(self):
+        mi_array = self.mi.copy()
+        clr = mi.calc_mixed_clr(mi_array, self.mi_bg, out=mi_array, block_size=9)
+        self.assertIs(clr, mi_array)
+        np.testing.assert_array_equal(clr, self.clr)
+
+    def test_driver_clr_dtype(self):
+        x = InferelatorData(expression_data=np.random.RandomState(10).randn(30, 12))
+        clr, mi_data = mi.MIDriver().run(x, x)
+        clr_32, _ = mi.MIDriver(clr_dtype=np.float32).run(x, x, return_mi=False)
+        clr_no_mi, _ = mi.MIDriver().run(x, x, return_mi=False)
+        self.assertEqual(clr_32.values.dtype, np.float32)
+        np.testing.assert_array_equal(clr_32.values, clr.values.astype(np.float32))
+        pd.testing.assert_frame_equal(clr, clr_no_mi)
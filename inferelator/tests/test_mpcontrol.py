@@ -1,8 +1,16 @@
 import unittest
+import unittest.mock as mock
+import contextlib
+import copy
 import tempfile
 import shutil
 import types
+import numpy as np
+import pandas as pd
 from inferelator.distributed.inferelator_mp import MPControl
+from inferelator.distributed.chunk_tuner import ChunkTuner
+from inferelator import utils
+from inferelator.utils import InferelatorData
 
 # Run tests only when the associated packages are installed
 try:
@@ -38,11 +46,62 @@ try:
 except ImportError:
     TEST_PATHOS = False
 
+try:
+    from multiprocessing import shared_memory
+    import dill
+    from inferelator.distributed import shared_memory_controller
+
+    TEST_SHARED_MEMORY = True
+except ImportError:
+    TEST_SHARED_MEMORY = False
+
 
 def math_function(x, y, z):
     return x + y ** 2 - z
 
 
+def shared_function(i, arrays, offset):
+    return float(arrays["x"][i, :].sum() + arrays["y"][i] + offset)
+
+
+class TestChunkTuner(unittest.TestCase):
+
+    def test_unmeasured(self):
+        tuner = ChunkTuner(n_tasks=1000, n_workers=4)
+        self.assertIsNone(tuner.task_time)
+        self.assertEqual(tuner.chunksize(), 1)
+
+    def test_target_time(self):
+        tuner = ChunkTuner(n_tasks=100000, n_workers=4, target_time=0.5)
+        tuner.add(0.01, n_tasks=10)
+        self.assertAlmostEqual(tuner.task_time, 0.001)
+        self.assertEqual(tuner.chunksize(), 500)
+
+    def test_load_balance(self):
+        tuner = ChunkTuner(n_tasks=100, n_workers=4, target_time=0.5, min_chunks_per_worker=4)
+        tuner.add(0.001, n_tasks=10)
+        self.assertEqual(tuner.chunksize(), 7)
+        self.assertEqual(tuner.chunksize(n_remaining=10), 1)
+        self.assertEqual(tuner.chunksize(n_remaining=0), 1)
+
+    def test_slow_tasks(self):
+        tuner = ChunkTuner(n_workers=4, target_time=0.5)
+        tuner.add(20, n_tasks=2)
+        self.assertEqual(tuner.chunksize(), 1)
+
+    def test_timed(self):
+        elapsed, result = ChunkTuner.timed(math_function)(1, 2, 3)
+        self.assertEqual(result, 2)
+        self.assertGreaterEqual(elapsed, 0)
+
+    def test_describe(self):
+        tuner = ChunkTuner(n_tasks=10)
+        self.assertIn("unmeasured", tuner.describe())
+        tuner.add(1.)
+        tuner.chunksize()
+        self.assertIn("Chunk size 1 for 10 tasks", tuner.describe())
+
+
 class TestMPControl(unittest.TestCase):
     name = "local"
     map_test_data = [[1] * 3, list(range(3)), [0, 2, 4]]
@@ -77,6 +136,10 @@ class TestNoController(TestMPControl):
         with self.assertRaises(RuntimeError):
             MPControl.map(math_function, *self.map_test_data)
 
+    def test_imap(self):
+        with self.assertRaises(RuntimeError):
+            MPControl.imap(math_function, *self.map_test_data)
+
     def test_sync(self):
         with self.assertRaises(RuntimeError):
             MPControl.sync_processes()
@@ -108,6 +171,10 @@ class TestLocalController(TestMPControl):
         test_result = MPControl.map(math_function, *self.map_test_data)
         self.assertListEqual(test_result, self.map_test_expect)
 
+    def test_local_imap(self):
+        test_result = sorted(MPControl.imap(math_function, *self.map_test_data))
+        self.assertListEqual(test_result, list(enumerate(self.map_test_expect)))
+
     def test_local_sync(self):
         self.assertTrue(MPControl.sync_processes())
 
@@ -185,10 +252,197 @@ class TestMultiprocessingMPController(TestMPControl):
         test_result = MPControl.map(math_function, *self.map_test_data)
         self.assertListEqual(test_result, self.map_test_expect)
 
+    def test_mp_imap(self):
+        test_result = sorted(MPControl.imap(math_function, *self.map_test_data))
+        self.assertListEqual(test_result, list(enumerate(self.map_test_expect)))
+
+    def test_mp_map_chunksize(self):
+        for chunksize in [1, 2, "auto"]:
+            test_result = MPControl.map(math_function, *self.map_test_data, chunksize=chunksize)
+            self.assertListEqual(test_result, self.map_test_expect)
+
+    def test_mp_map_auto_chunks(self):
+        test_result = MPControl.map(lambda x: x * 2, range(500))
+        self.assertListEqual(test_result, [x * 2 for x in range(500)])
+
+        test_result = sorted(MPControl.imap(lambda x: x * 2, range(500)))
+        self.assertListEqual(test_result, [(x, x * 2) for x in range(500)])
+
     def test_mp_sync(self):
         self.assertTrue(MPControl.sync_processes())
 
 
+@unittest.skipIf(not TEST_SHARED_MEMORY, "Shared memory not available")
+class TestSharedMemoryMPController(TestMPControl):
+    name = "shared-memory"
+
+    @classmethod
+    @unittest.skipIf(not TEST_SHARED_MEMORY, "Shared memory not available")
+    def setUpClass(cls):
+        MPControl.shutdown()
+        MPControl.set_multiprocess_engine(cls.name)
+        MPControl.set_processes(2)
+        MPControl.connect()
+
+    @classmethod
+    @unittest.skipIf(not TEST_SHARED_MEMORY, "Shared memory not available")
+    def tearDownClass(cls):
+        super(TestSharedMemoryMPController, cls).tearDownClass()
+
+    def test_shm_connect(self):
+        self.assertTrue(MPControl.is_initialized)
+        self.assertTrue(MPControl.is_shared_memory())
+        self.assertFalse(MPControl.is_dask())
+
+    def test_shm_name(self):
+        self.assertEqual(MPControl.name(), self.name)
+
+    def test_shm_map(self):
+        test_result = MPControl.map(math_function, *self.map_test_data)
+        self.assertListEqual(test_result, self.map_test_expect)
+
+    def test_shm_imap(self):
+        test_result = sorted(MPControl.imap(math_function, *self.map_test_data))
+        self.assertListEqual(test_result, list(enumerate(self.map_test_expect)))
+
+    def test_shm_map_closure(self):
+        offset = 10
+        test_result = MPControl.map(lambda x: x + offset, range(50), chunksize=7)
+        self.assertListEqual(test_result, list(range(10, 60)))
+
+    def test_shm_map_shared(self):
+        x, y = np.arange(12).reshape(4, 3).astype(float), np.array([1, 2, 3, 4], dtype=int)
+        test_result = MPControl.client.map_shared(shared_function, range(4), {"x": x, "y": y}, 0.5)
+        self.assertListEqual(test_result, [4.5, 14.5, 24.5, 34.5])
+
+    def test_shm_imap_chunks(self):
+        test_result = sorted(MPControl.imap(lambda x: x * 2, range(50), chunksize=7))
+        self.assertListEqual(test_result, [(i, i * 2) for i in range(50)])
+
+    def test_shm_cache_arrays(self):
+        controller = MPControl.client
+        source = object()
+        x = np.arange(12).reshape(4, 3).astype(float)
+
+        self.assertTrue(controller.cache_arrays("test", (source, 1), {"x": x}))
+        self.assertFalse(controller.cache_arrays("test", (source, 1), lambda: self.fail("Cache was rebuilt")))
+
+        test_result = controller.map_shared(shared_function, range(4), {"y": np.ones(4)}, 0, cached=["test"])
+        self.assertListEqual(test_result, [4., 13., 22., 31.])
+
+        # Changing the source replaces the cached arrays
+        self.assertTrue(controller.cache_arrays("test", (source, 2), {"x": x * 2}))
+        test_result = controller.map_shared(shared_function, range(4), {"y": np.ones(4)}, 0, cached=["test"])
+        self.assertListEqual(test_result, [7., 25., 43., 61.])
+
+        controller.clear_cache("test")
+        self.assertNotIn("test", controller._cache)
+
+    def test_shm_cache_copied_source(self):
+        controller = MPControl.client
+        source = pd.DataFrame(np.arange(12).reshape(4, 3), index=list("abcd"), columns=list("xyz"))
+
+        self.assertTrue(controller.cache_arrays("test", (source, 1), {"x": source.values}))
+
+        # A copy of the source has the same contents, so it reuses the cached arrays
+        self.assertFalse(controller.cache_arrays("test", (copy.deepcopy(source), 1),
+                                                 lambda: self.fail("Cache was rebuilt")))
+
+        changed = source.copy()
+        changed.iloc[0, 0] = 100
+        self.assertTrue(controller.cache_arrays("test", (changed, 1), {"x": changed.values}))
+
+        controller.clear_cache("test")
+
+    def test_shm_source_fingerprint(self):
+        fingerprint = shared_memory_controller._source_fingerprint
+        frame = pd.DataFrame(np.arange(6).reshape(3, 2), index=list("abc"), columns=list("xy"))
+        data = InferelatorData(frame.astype(float))
+
+        self.assertEqual(fingerprint((frame, 1, "a")), fingerprint((frame.copy(), 1, "a")))
+        self.assertEqual(fingerprint(data), fingerprint(data.copy()))
+        self.assertEqual(fingerprint(utils.make_sparse_frame(frame)),
+                         fingerprint(utils.make_sparse_frame(frame.copy())))
+        self.assertNotEqual(fingerprint(frame), fingerprint(frame.rename(index={"a": "d"})))
+        self.assertNotEqual(fingerprint(frame), fingerprint(frame * 2))
+        self.assertNotEqual(fingerprint((frame, 1)), fingerprint((frame, 1.)))
+        self.assertIsNone(fingerprint((frame, object())))
+
+    def test_shm_same_source(self):
+        same_source = shared_memory_controller._same_source
+        source = object()
+
+        self.assertTrue(same_source((source, 1, "a"), (source, 1, "a")))
+        self.assertTrue(same_source(pd.Index(["a", "b"]), pd.Index(["a", "b"])))
+        self.assertFalse(same_source((source, 1), (object(), 1)))
+        self.assertFalse(same_source((source, 1), (source, 1.5)))
+        self.assertFalse(same_source((source, 1), (source, 1, 2)))
+        self.assertFalse(same_source(np.ones(2), np.ones(2)))
+
+    def test_shm_map_error(self):
+        with self.assertRaises(ZeroDivisionError):
+            MPControl.map(lambda x: 1 / x, [1, 0, 2])
+
+    def test_shm_sync(self):
+        self.assertTrue(MPControl.sync_processes())
+
+
+class TestThreadMPController(TestMPControl):
+    name = "threads"
+
+    @classmethod
+    def setUpClass(cls):
+        MPControl.shutdown()
+        MPControl.set_multiprocess_engine(cls.name)
+        MPControl.set_processes(2)
+        MPControl.connect(blas_threads=1)
+
+    def test_thread_connect(self):
+        self.assertTrue(MPControl.is_initialized)
+        self.assertEqual(MPControl.num_workers(), 2)
+        self.assertEqual(MPControl.client.blas_thread_count(), 1)
+
+    def test_thread_name(self):
+        self.assertEqual(MPControl.name(), self.name)
+
+    def test_thread_map(self):
+        test_result = MPControl.map(math_function, *self.map_test_data)
+        self.assertListEqual(test_result, self.map_test_expect)
+
+    def test_thread_imap(self):
+        test_result = sorted(MPControl.imap(math_function, *self.map_test_data))
+        self.assertListEqual(test_result, list(enumerate(self.map_test_expect)))
+
+    def test_thread_imap_blas_limit(self):
+        limited = []
+
+        @contextlib.contextmanager
+        def limit_blas():
+            limited.append(True)
+            yield
+            limited.pop()
+
+        # The BLAS limit shouldn't be held while the caller has a result
+        with mock.patch.object(MPControl.client, "_limit_blas", limit_blas):
+            for _ in MPControl.imap(math_function, *self.map_test_data):
+                self.assertListEqual(limited, [])
+                break
+
+        self.assertListEqual(limited, [])
+
+    def test_thread_map_closure(self):
+        offset = 10
+        test_result = MPControl.map(lambda x: x + offset, range(50), chunksize=7)
+        self.assertListEqual(test_result, list(range(10, 60)))
+
+    def test_thread_map_error(self):
+        with self.assertRaises(ZeroDivisionError):
+            MPControl.map(lambda x: 1 / x, [1, 0, 2])
+
+    def test_thread_sync(self):
+        self.assertTrue(MPControl.sync_processes())
+
+
 @unittest.skipIf(not TEST_DASK_LOCAL, "Dask not installed")
 class TestDaskLocalMPController(TestMPControl):
     name = "dask-local"
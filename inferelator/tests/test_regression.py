@@ -1,6 +1,7 @@
 import warnings
 import unittest
 import tempfile
+import os
 import pandas as pd
 import shutil
 import numpy as np
@@ -14,6 +15,7 @@ from inferelator.tests.artifacts.test_data import TestDataSingleCellLike, TEST_D
 from inferelator.tests.artifacts.test_stubs import TaskDataStub, create_puppet_workflow
 from inferelator.regression.bbsr_multitask import BBSRByTaskRegressionWorkflow
 from inferelator.regression.elasticnet_multitask import ElasticNetByTaskRegressionWorkflow
+from inferelator import utils
 from inferelator.utils import InferelatorData
 from inferelator.preprocessing.metadata_parser import MetadataHandler
 
@@ -101,6 +103,87 @@ class TestSingleTaskRegressionFactory(SetUpDenseData):
         self.workflow.run()
         self.assertEqual(self.workflow.results.score, 1)
 
+    def test_bbsr_cache_mi(self):
+        self.workflow = create_puppet_workflow(base_class="tfa", regression_class="bbsr")
+        self.workflow = self.workflow(self.data, self.prior, self.gold_standard)
+        self.workflow.set_regression_parameters(cache_mi_discretization=True)
+        self.workflow.tf_names = self.tf_names
+        self.workflow.run()
+        self.assertEqual(self.workflow.results.score, 1)
+        self.assertEqual(list(self.workflow._mi_cache.keys()), [None])
+
+    def test_bbsr_cache_mi_stale(self):
+        self.workflow = create_puppet_workflow(base_class="tfa", regression_class="bbsr")
+        self.workflow = self.workflow(self.data, self.prior, self.gold_standard)
+        self.workflow.set_regression_parameters(cache_mi_discretization=True)
+        self.workflow.tf_names = self.tf_names
+        self.workflow.run()
+
+        design, stale_bins = self.workflow.design, self.workflow._mi_cache[None][2]
+        bootstrap = list(range(design.num_obs))
+
+        # Reusing the same data keeps the bins
+        self.workflow._calculate_clr(self.workflow.response, design, self.workflow.response, design, bootstrap)
+        self.assertIs(self.workflow._mi_cache[None][2], stale_bins)
+
+        # Replacing the data rebuilds them
+        response = self.workflow.response.copy()
+        self.workflow._calculate_clr(response, design, response, design, bootstrap)
+        self.assertIs(self.workflow._mi_cache[None][0], response)
+        self.assertIsNot(self.workflow._mi_cache[None][2], stale_bins)
+
+    def test_bbsr_incremental_bic(self):
+        self.workflow = create_puppet_workflow(base_class="tfa", regression_class="bbsr")
+        self.workflow = self.workflow(self.data, self.prior, self.gold_standard)
+        self.workflow.set_regression_parameters(incremental_bic=True)
+        self.workflow.tf_names = self.tf_names
+        self.workflow.run()
+        self.assertEqual(self.workflow.results.score, 1)
+
+    def test_bbsr_sparse_betas(self):
+        self.workflow = create_puppet_workflow(base_class="tfa", regression_class="bbsr")
+        self.workflow = self.workflow(self.data, self.prior, self.gold_standard)
+        self.workflow.set_run_parameters(use_sparse_betas=True)
+        self.workflow.tf_names = self.tf_names
+        self.workflow.run()
+        self.assertEqual(self.workflow.results.score, 1)
+
+    def test_bbsr_online_aggregation(self):
+        self.workflow = create_puppet_workflow(base_class="tfa", regression_class="bbsr")
+        self.workflow = self.workflow(self.data, self.prior, self.gold_standard)
+        self.workflow.set_run_parameters(online_bootstrap_aggregation=True)
+        self.workflow.tf_names = self.tf_names
+        self.workflow.run()
+        self.assertEqual(self.workflow.results.score, 1)
+
+    def test_bbsr_background_output(self):
+        self.workflow = create_puppet_workflow(base_class="tfa", regression_class="bbsr")
+        self.workflow = self.workflow(self.data, self.prior, self.gold_standard)
+        self.workflow.set_output_writers(write_in_background=True)
+        self.workflow.tf_names = self.tf_names
+        self.workflow.output_dir = tempfile.mkdtemp()
+        self.workflow.run()
+        self.assertEqual(self.workflow.results.score, 1)
+        self.assertFalse(utils.OutputQueue.background)
+        self.assertTrue(os.path.exists(os.path.join(self.workflow.output_dir, "network.tsv")))
+        shutil.rmtree(self.workflow.output_dir)
+
+    def test_background_output_error_during_run(self):
+        self.workflow = create_puppet_workflow(base_class=tfa_workflow.TFAWorkFlow)
+        self.workflow = self.workflow(self.data, self.prior, self.gold_standard)
+        self.workflow.set_output_writers(write_in_background=True)
+
+        def fail():
+            raise IOError("Disk full")
+
+        # A failed background write shouldn't replace the exception from the run
+        self.workflow.startup = lambda: utils.OutputQueue.submit(fail)
+        with self.assertRaises(NotImplementedError):
+            self.workflow.run()
+
+        self.assertFalse(utils.OutputQueue.background)
+        utils.OutputQueue.shutdown()
+
     def test_elasticnet(self):
         self.workflow = create_puppet_workflow(base_class="tfa", regression_class="elasticnet")
         self.workflow = self.workflow(self.data, self.prior, self.gold_standard)
@@ -134,6 +217,22 @@ class TestMultitaskFactory(SetUpDenseDataMTL):
         self.workflow.run()
         self.assertAlmostEqual(self.workflow.results.score, 0.84166, places=4)
 
+    def test_amusr_sparse_betas(self):
+        self.workflow = workflow.inferelator_workflow(workflow="amusr", regression="amusr")
+        self.workflow.set_run_parameters(use_sparse_betas=True)
+        self.reset_workflow()
+
+        self.workflow.run()
+        self.assertAlmostEqual(self.workflow.results.score, 0.84166, places=4)
+
+    def test_amusr_online_aggregation(self):
+        self.workflow = workflow.inferelator_workflow(workflow="amusr", regression="amusr")
+        self.workflow.set_run_parameters(online_bootstrap_aggregation=True)
+        self.reset_workflow()
+
+        self.workflow.run()
+        self.assertAlmostEqual(self.workflow.results.score, 0.84166, places=4)
+
     def test_mtl_bbsr(self):
         self.workflow = workflow.inferelator_workflow(workflow="amusr", regression=BBSRByTaskRegressionWorkflow)
         self.workflow.set_regression_parameters(prior_weight=1.)
@@ -142,6 +241,15 @@ class TestMultitaskFactory(SetUpDenseDataMTL):
         self.workflow.run()
         self.assertEqual(self.workflow.results.score, 1)
 
+    def test_mtl_bbsr_cache_mi(self):
+        self.workflow = workflow.inferelator_workflow(workflow="amusr", regression=BBSRByTaskRegressionWorkflow)
+        self.workflow.set_regression_parameters(prior_weight=1., cache_mi_discretization=True)
+        self.reset_workflow()
+
+        self.workflow.run()
+        self.assertEqual(self.workflow.results.score, 1)
+        self.assertEqual(sorted(self.workflow._mi_cache.keys()), [0, 1])
+
     def test_mtl_elasticnet(self):
         self.workflow = workflow.inferelator_workflow(workflow="amusr", regression=ElasticNetByTaskRegressionWorkflow)
         self.workflow.set_regression_parameters(copy_X=True)
@@ -207,3 +315,51 @@ class TestMTLDask(TestMultitaskFactory, SwitchToDask):
 @unittest.skipIf(not TEST_DASK_LOCAL, "Dask not installed")
 class TestMTLSparseDask(TestMultitaskFactorySparse, SwitchToDask):
     pass
+
+
+class SwitchToSharedMemory(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        MPControl.shutdown()
+        MPControl.set_multiprocess_engine("shared-memory")
+        MPControl.set_processes(2)
+        MPControl.connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        MPControl.shutdown()
+        MPControl.set_multiprocess_engine("local")
+        MPControl.connect()
+
+
+class TestSTLSharedMemory(TestSingleTaskRegressionFactory, SwitchToSharedMemory):
+    pass
+
+
+class TestSTLSparseSharedMemory(TestSingleTaskRegressionFactorySparse, SwitchToSharedMemory):
+    pass
+
+
+class SwitchToThreads(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        MPControl.shutdown()
+        MPControl.set_multiprocess_engine("threads")
+        MPControl.set_processes(2)
+        MPControl.connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        MPControl.shutdown()
+        MPControl.set_multiprocess_engine("local")
+        MPControl.connect()
+
+
+class TestSTLThreads(TestSingleTaskRegressionFactory, SwitchToThreads):
+    pass
+
+
+class TestMTLThreads(TestMultitaskFactory, SwitchToThreads):
+    pass
@@ -6,13 +6,23 @@ from inferelator.postprocessing import GOLD_STANDARD_COLUMN, CONFIDENCE_COLUMN,
 from inferelator.postprocessing import results_processor
 from inferelator.postprocessing import results_processor_mtl
 from inferelator.postprocessing import model_performance
+from inferelator.postprocessing import output_writers
 import pandas as pd
 import pandas.testing as pdt
 import numpy as np
+import scipy.sparse as sps
 import os
 import tempfile
 import shutil
 
+# Run the binary table writer tests only when pyarrow is installed
+try:
+    import pyarrow
+
+    TEST_PYARROW = True
+except ImportError:
+    TEST_PYARROW = False
+
 
 class TestResults(unittest.TestCase):
 
@@ -49,6 +59,7 @@ class TestResultsProcessor(TestResults):
         rp = results_processor.ResultsProcessor([self.beta], [self.beta_resc])
         result = rp.summarize_network(None, self.gold_standard, self.prior)
         self.assertEqual(result.score, 1)
+        self.assertTrue(pd.api.types.is_integer_dtype(result.network[GOLD_STANDARD_COLUMN]))
 
     def test_combining_confidences_two_betas_negative_values_assert_nonzero_betas(self):
         _, _, betas_non_zero = results_processor.ResultsProcessor.threshold_and_summarize([self.beta1, self.beta2], 0.5)
@@ -94,6 +105,138 @@ class TestResultsProcessor(TestResults):
         np.testing.assert_equal(median, np.array([[1.5, 1.5], [1.5, 1.5]]))
 
 
+class TestSparseResultsProcessor(TestResults):
+
+    def setUp(self):
+        super(TestSparseResultsProcessor, self).setUp()
+        rng = np.random.RandomState(12)
+        self.betas = [pd.DataFrame(rng.randn(6, 4) * (rng.rand(6, 4) > 0.6), ['g' + str(i) for i in range(6)],
+                                   ['tf' + str(i) for i in range(4)]) for _ in range(5)]
+        self.sparse_betas = [utils.make_sparse_frame(b) for b in self.betas]
+
+    def test_sparse_frame(self):
+        self.assertTrue(all(utils.is_sparse_frame(b) for b in self.sparse_betas))
+        self.assertFalse(any(utils.is_sparse_frame(b) for b in self.betas))
+        pdt.assert_frame_equal(self.sparse_betas[0].sparse.to_dense(), self.betas[0])
+
+    def test_threshold_and_summarize(self):
+        dense = results_processor.ResultsProcessor.threshold_and_summarize(self.betas, 0.5)
+        sparse = results_processor.ResultsProcessor.threshold_and_summarize(self.sparse_betas, 0.5)
+        for d, s in zip(dense, sparse):
+            pdt.assert_frame_equal(d, s)
+
+    def test_mean_and_median(self):
+        dense = results_processor.ResultsProcessor.mean_and_median(self.betas)
+        sparse = results_processor.ResultsProcessor.mean_and_median(self.sparse_betas)
+        for d, s in zip(dense, sparse):
+            pdt.assert_frame_equal(d, s)
+
+    def test_mean_and_median_all_zero(self):
+        zeros = [utils.make_sparse_frame(b * 0) for b in self.betas]
+        mean, median = results_processor.ResultsProcessor.mean_and_median(zeros)
+        np.testing.assert_equal(mean.values, np.zeros((6, 4)))
+        np.testing.assert_equal(median.values, np.zeros((6, 4)))
+
+    def test_rank_summing(self):
+        dense = model_performance.RankSummingMetric.compute_combined_confidences(self.betas)
+        sparse = model_performance.RankSummingMetric.compute_combined_confidences(self.sparse_betas)
+        pdt.assert_frame_equal(dense, sparse)
+
+    def test_full_stack(self):
+        rp = results_processor.ResultsProcessor([utils.make_sparse_frame(self.beta)],
+                                                [utils.make_sparse_frame(self.beta_resc)])
+        result = rp.summarize_network(None, self.gold_standard, self.prior)
+        self.assertEqual(result.score, 1)
+
+
+class TestBootstrapAggregator(TestResults):
+
+    def setUp(self):
+        super(TestBootstrapAggregator, self).setUp()
+        rng = np.random.RandomState(12)
+        self.betas = [pd.DataFrame(rng.randn(6, 4) * (rng.rand(6, 4) > 0.6), ['g' + str(i) for i in range(6)],
+                                   ['tf' + str(i) for i in range(4)]) for _ in range(5)]
+        self.rescaled_betas = [b.abs() for b in self.betas]
+        self.aggregator = utils.BootstrapAggregator()
+        for i, (b, b_resc) in enumerate(zip(self.betas, self.rescaled_betas)):
+            # Mix dense and sparse-backed bootstraps
+            if i % 2:
+                b, b_resc = utils.make_sparse_frame(b), utils.make_sparse_frame(b_resc)
+            self.aggregator.add(b, b_resc)
+
+    def test_aggregator_length(self):
+        self.assertEqual(len(self.aggregator), 5)
+        self.assertEqual(self.aggregator.shape, (6, 4))
+
+    def test_aggregator_threshold_and_summarize(self):
+        stacked = results_processor.ResultsProcessor.threshold_and_summarize(self.betas, 0.5)
+        aggregated = results_processor.ResultsProcessor.threshold_and_summarize(self.aggregator, 0.5)
+        for d, s in zip(stacked, aggregated):
+            pdt.assert_frame_equal(d, s)
+
+    def test_aggregator_mean_and_median(self):
+        stacked = results_processor.ResultsProcessor.mean_and_median(self.rescaled_betas)
+        aggregated = results_processor.ResultsProcessor.mean_and_median(self.aggregator)
+        for d, s in zip(stacked, aggregated):
+            pdt.assert_frame_equal(d, s)
+
+    def test_aggregator_rank_summing(self):
+        stacked = model_performance.RankSummingMetric.compute_combined_confidences(self.rescaled_betas)
+        aggregated = model_performance.RankSummingMetric.compute_combined_confidences(self.aggregator)
+        pdt.assert_frame_equal(stacked, aggregated)
+
+    def test_aggregator_sparse_summaries(self):
+        for summary in (self.aggregator.betas_sign, self.aggregator.betas_non_zero, self.aggregator.rescaled_sum,
+                        self.aggregator.rank_offset_sum):
+            self.assertTrue(sps.isspmatrix(summary))
+
+    def test_median_sketch_exact(self):
+        rng = np.random.RandomState(3)
+        stack = rng.randn(9, 5, 4) * (rng.rand(9, 5, 4) > 0.5)
+
+        for sketch_size in (None, 9, 20):
+            sketch = utils.bootstrap_aggregator.MedianSketch(sketch_size=sketch_size)
+            for b in stack:
+                sketch.add(np.flatnonzero(b), b.ravel()[np.flatnonzero(b)])
+            np.testing.assert_array_almost_equal(sketch.median(9, (5, 4)), np.median(stack, axis=0))
+
+    def test_median_sketch_bounded(self):
+        rng = np.random.RandomState(4)
+        stack = rng.rand(200, 5, 4) * (rng.rand(200, 5, 4) > 0.3)
+
+        aggregator = utils.BootstrapAggregator(median_sketch_size=20)
+        for b in stack:
+            b = pd.DataFrame(b)
+            aggregator.add(b, b)
+
+        self.assertEqual(aggregator.median_sketch.values.shape, (20, 20))
+        _, median = aggregator.mean_and_median()
+        self.assertLess(np.mean(np.abs(median.values - np.median(stack, axis=0))), 0.1)
+
+    def test_aggregator_exact_median(self):
+        rng = np.random.RandomState(5)
+        stack = rng.rand(30, 5, 4) * (rng.rand(30, 5, 4) > 0.3)
+
+        aggregator = utils.BootstrapAggregator(median_sketch_size=None)
+        for b in stack:
+            b = pd.DataFrame(b)
+            aggregator.add(b, b)
+
+        _, median = aggregator.mean_and_median()
+        np.testing.assert_array_almost_equal(median.values, np.median(stack, axis=0))
+
+    def test_aggregator_misaligned(self):
+        with self.assertRaises(ValueError):
+            self.aggregator.add(self.betas[0].T, self.rescaled_betas[0].T)
+
+    def test_aggregator_full_stack(self):
+        aggregator = utils.BootstrapAggregator()
+        aggregator.add(self.beta, self.beta_resc)
+        result = results_processor.ResultsProcessor(aggregator, None).summarize_network(None, self.gold_standard,
+                                                                                        self.prior)
+        self.assertEqual(result.score, 1)
+
+
 class TestNetworkCreator(TestResults):
 
     def setUp(self):
@@ -111,6 +254,15 @@ class TestNetworkCreator(TestResults):
         self.assertListEqual(net['target'].tolist(), ['gene1'] * 3)
         self.assertListEqual(net['combined_confidences'].tolist(), [0.6, 0.3, 0.1])
 
+    def test_process_network_unaligned_priors(self):
+        priors = pd.DataFrame([[1, 0, 1], [0, 1, 1]], ['gene1', 'gene2'], ['tf5', 'tf1', 'tf6'])
+        extra = {'beta.sign.sum': self.beta_sign}
+        net = results_processor.ResultsProcessor.process_network(self.pr_calc, priors, extra_columns=extra)
+        self.assertListEqual(net['regulator'].tolist(), ['tf5', 'tf4', 'tf1'])
+        np.testing.assert_array_equal(net['prior'].values, np.array([1, np.nan, 0]))
+        np.testing.assert_array_equal(net['beta.sign.sum'].values, np.array([2, -1, -1]))
+        self.assertListEqual(net.columns.tolist()[-2:], ['prior', 'beta.sign.sum'])
+
     def test_network_summary(self):
         temp_dir = tempfile.mkdtemp()
         net = results_processor.ResultsProcessor.process_network(self.pr_calc, self.prior,
@@ -162,6 +314,17 @@ class TestRankSummary(TestResults):
         np.testing.assert_equal(confidences.values,
                                 np.array([[0.4, 0.2, 0.8], [0.6, 1.0, 0]]))
 
+    def test_rank_replicate(self):
+        replicate = pd.DataFrame([[0, -1.5, 2, 0], [2, np.nan, 0, -0.5], [-1.5, 0, 3, 2]])
+        expected = np.reshape(pd.DataFrame(replicate.values.flatten()).rank().values, replicate.shape)
+        np.testing.assert_array_equal(self.metric.rank_replicate(replicate), expected)
+        np.testing.assert_array_equal(self.metric.rank_replicate(utils.make_sparse_frame(replicate)), expected)
+
+    def test_rank_replicate_no_zeros(self):
+        replicate = pd.DataFrame([[1, -1], [3, 1]])
+        np.testing.assert_array_equal(self.metric.rank_replicate(replicate), np.array([[2.5, 1], [4, 2.5]]))
+        self.assertEqual(self.metric.rank_replicate(replicate).dtype, np.float32)
+
     def test_combining_confidences_one_beta_with_negative_values(self):
         confidences = self.metric.compute_combined_confidences([self.rescaled_beta1])
         np.testing.assert_equal(confidences.values, np.array([[0.75, 0, 0.25, 1, 0.5]]))
@@ -178,6 +341,21 @@ class TestRankSummary(TestResults):
         filter_data = self.metric.filter_to_left_size(GOLD_STANDARD_COLUMN, CONFIDENCE_COLUMN, data)
         self.assertEqual(data.shape, filter_data.shape)
 
+    def test_align_gold_standard(self):
+        idx, cols, conf, gs, present = self.metric.align_gold_standard(self.beta_resc, self.gold_standard_unaligned)
+        self.assertListEqual(idx.tolist(), ['gene1', 'gene2', 'gene3'])
+        self.assertListEqual(cols.tolist(), ['tf1', 'tf2'])
+        np.testing.assert_array_equal(conf, np.array([0, 1, np.nan, 1, 0.05, np.nan]))
+        np.testing.assert_array_equal(gs, np.array([0, np.nan, 0, 1, np.nan, 0]))
+        self.assertTrue(present.all())
+
+    def test_sorted_arrays(self):
+        calc = self.metric([self.beta_resc, self.beta_resc], self.gold_standard_unaligned, filter_method="overlap")
+        self.assertIsNone(calc._confidence_data)
+        np.testing.assert_array_equal(calc.sorted_gold_standard[calc.filter_index], np.array([1, 0]))
+        self.assertEqual(calc.filtered_data.shape[0], 2)
+        self.assertListEqual(calc.confidence_data[TARGET_COLUMN].tolist()[:2], ['gene2', 'gene1'])
+
 
 class TestPrecisionRecallMetric(TestResults):
 
@@ -268,6 +446,25 @@ class TestPrecisionRecallMetric(TestResults):
         aupr = self.metric.calculate_aupr(data)
         np.testing.assert_approx_equal(aupr, 5. / 16)
 
+    def test_precision_recall_arrays(self):
+        gs = self.gold_standard_unaligned.copy()
+        confidences = pd.DataFrame(np.array([[0, 1], [0.5, 0]]), ['gene1', 'gene2'], ['tf1', 'tf2'])
+        data = self.make_PR_data(gs, confidences).sort_values(by=CONFIDENCE_COLUMN, ascending=False)
+        precision, recall = self.metric.precision_recall_arrays(data[CONFIDENCE_COLUMN].values,
+                                                                data[GOLD_STANDARD_COLUMN].values)
+        data = self.metric.calculate_precision_recall(data)
+        np.testing.assert_array_equal(precision, data['precision'].values)
+        np.testing.assert_array_equal(recall, data['recall'].values)
+        self.assertEqual(self.metric.aupr_from_curve(*self.metric.modify_pr_arrays(precision, recall)),
+                         self.metric.calculate_aupr(data))
+
+    def test_metric_arrays(self):
+        pr_calc = self.metric([self.rescaled_beta1, self.rescaled_beta2], self.gold_standard, "keep_all_gold_standard")
+        self.assertIsNone(pr_calc._confidence_data)
+        curve = pr_calc.curve_dataframe()
+        pdt.assert_frame_equal(curve, pr_calc.filtered_data.loc[:, ['precision', 'recall']])
+        self.assertEqual(pr_calc.num_over_conf_threshold(0.3), 2)
+
     def test_rank_sum_increasing(self):
         rankable_data = [pd.DataFrame(np.array([[2.0, 4.0], [6.0, 8.0]]))]
         combine_conf = self.metric.compute_combined_confidences(rankable_data)
@@ -311,6 +508,94 @@ class TestPrecisionRecallMetric(TestResults):
         shutil.rmtree(temp_dir)
 
 
+class TestOutputWriters(TestNetworkCreator):
+
+    def setUp(self):
+        super(TestOutputWriters, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.network = results_processor.ResultsProcessor.process_network(self.pr_calc, self.prior)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def read_file(self, file_name):
+        with open(os.path.join(self.temp_dir, file_name)) as fh:
+            return fh.read()
+
+    def test_chunked_tsv(self):
+        output_writers.TSVWriter().write(self.network, self.temp_dir, "network.tsv")
+        output_writers.TSVWriter(chunksize=2).write(self.network, self.temp_dir, "network_chunked.tsv")
+        self.assertEqual(self.read_file("network.tsv"), self.read_file("network_chunked.tsv"))
+
+    def test_gzip_tsv(self):
+        file_path = output_writers.TSVWriter(compression="gzip").write(self.network, self.temp_dir, "network.tsv")
+        self.assertEqual(file_path, os.path.join(self.temp_dir, "network.tsv.gz"))
+        pdt.assert_frame_equal(pd.read_csv(file_path, sep="\t"), self.network.reset_index(drop=True))
+
+    def test_no_output(self):
+        self.assertIsNone(output_writers.TSVWriter().write(self.network, None, "network.tsv"))
+        self.assertIsNone(output_writers.TSVWriter().write(self.network, self.temp_dir, None))
+        self.assertEqual(len(os.listdir(self.temp_dir)), 0)
+
+    def test_npz_matrix(self):
+        file_path = output_writers.SparseNPZWriter().write(self.beta, self.temp_dir, "betas_stack.tsv")
+        self.assertEqual(file_path, os.path.join(self.temp_dir, "betas_stack.npz"))
+        np.testing.assert_array_equal(sps.load_npz(file_path).A, self.beta.values)
+        with np.load(file_path) as npz:
+            self.assertListEqual(npz['index'].tolist(), ['gene1', 'gene2'])
+            self.assertListEqual(npz['columns'].tolist(), ['tf1', 'tf2'])
+
+    def test_npz_sparse_matrix(self):
+        file_path = output_writers.SparseNPZWriter().write(utils.make_sparse_frame(self.beta), self.temp_dir, "b.tsv")
+        np.testing.assert_array_equal(sps.load_npz(file_path).A, self.beta.values)
+
+    def test_hdf5_matrix(self):
+        file_path = output_writers.HDF5Writer().write(self.beta, self.temp_dir, "betas_stack.tsv")
+        self.assertEqual(file_path, os.path.join(self.temp_dir, "betas_stack.h5"))
+        pdt.assert_frame_equal(pd.read_hdf(file_path, key="data"), self.beta)
+
+    @unittest.skipIf(not TEST_PYARROW, "pyarrow not installed")
+    def test_parquet_network(self):
+        file_path = output_writers.ParquetWriter().write(self.network, self.temp_dir, "network.tsv")
+        pdt.assert_frame_equal(pd.read_parquet(file_path), self.network.reset_index(drop=True))
+
+    @unittest.skipIf(not TEST_PYARROW, "pyarrow not installed")
+    def test_feather_network(self):
+        file_path = output_writers.FeatherWriter().write(self.network, self.temp_dir, "network.tsv")
+        pdt.assert_frame_equal(pd.read_feather(file_path), self.network.reset_index(drop=True))
+
+    def test_writer_handler(self):
+        self.assertIsInstance(output_writers.WriterHandler.get_writer("npz"), output_writers.SparseNPZWriter)
+        self.assertEqual(output_writers.WriterHandler.get_writer("tsv.gz").compression, "gzip")
+        writer = output_writers.TSVWriter(chunksize=10)
+        self.assertIs(output_writers.WriterHandler.get_writer(writer), writer)
+        self.assertIsInstance(output_writers.WriterHandler.get_writer(output_writers.HDF5Writer),
+                              output_writers.HDF5Writer)
+        with self.assertRaises(ValueError):
+            output_writers.WriterHandler.get_writer("xlsx")
+
+    def test_result_writers(self):
+        result = results_processor.InferelatorResults(self.network, self.beta_threshold, self.pr_calc.all_confidences,
+                                                      self.pr_calc)
+        result.set_output_writers(network_writer="tsv.gz", matrix_writer="npz")
+        result.write_result_files(self.temp_dir)
+        self.assertListEqual(sorted(os.listdir(self.temp_dir)), ["betas_stack.npz", "combined_confidences.npz",
+                                                                 "network.tsv.gz", "pr_curve.pdf"])
+        self.assertIsInstance(results_processor.InferelatorResults.matrix_writer, output_writers.TSVWriter)
+
+    def test_result_writers_background(self):
+        result = results_processor.InferelatorResults(self.network, self.beta_threshold, self.pr_calc.all_confidences,
+                                                      self.pr_calc)
+        utils.OutputQueue.set_background(True)
+        try:
+            result.write_result_files(self.temp_dir)
+            utils.OutputQueue.flush()
+        finally:
+            utils.OutputQueue.set_background(False)
+        self.assertListEqual(sorted(os.listdir(self.temp_dir)), ["betas_stack.tsv", "combined_confidences.tsv",
+                                                                 "network.tsv", "pr_curve.pdf"])
+
+
 class TestMTLResults(TestResults):
 
     def test_mtl_multiple_priors(self):
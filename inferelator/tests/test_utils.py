@@ -6,6 +6,7 @@ import numpy as np
 import tempfile
 import shutil
 import os
+import threading
 
 
 class TestUtils(unittest.TestCase):
@@ -33,6 +34,57 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(data_frame.sum().sum(), 190)
 
 
+class TestOutputQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.written = []
+
+    def tearDown(self):
+        utils.OutputQueue.set_background(False)
+        utils.OutputQueue.shutdown()
+
+    def write(self, value):
+        self.written.append((value, threading.current_thread().name))
+
+    @staticmethod
+    def fail():
+        raise IOError("Disk full")
+
+    def test_foreground(self):
+        utils.OutputQueue.submit(self.write, 1)
+        self.assertListEqual(self.written, [(1, threading.current_thread().name)])
+
+    def test_background(self):
+        utils.OutputQueue.set_background(True)
+        for i in range(5):
+            utils.OutputQueue.submit(self.write, i)
+        utils.OutputQueue.flush()
+        self.assertListEqual([w[0] for w in self.written], list(range(5)))
+        self.assertTrue(all(w[1] == "inferelator-writer" for w in self.written))
+
+    def test_background_off_flushes(self):
+        utils.OutputQueue.set_background(True)
+        utils.OutputQueue.submit(self.write, 1)
+        utils.OutputQueue.set_background(False)
+        self.assertEqual(len(self.written), 1)
+
+    def test_error_on_flush(self):
+        utils.OutputQueue.set_background(True)
+        utils.OutputQueue.submit(self.fail)
+        utils.OutputQueue.submit(self.write, 1)
+        with self.assertRaises(IOError):
+            utils.OutputQueue.flush()
+        self.assertEqual(len(self.written), 1)
+        utils.OutputQueue.flush()
+
+    def test_error_on_shutdown(self):
+        utils.OutputQueue.set_background(True)
+        utils.OutputQueue.submit(self.fail)
+        with self.assertRaises(IOError):
+            utils.OutputQueue.shutdown()
+        self.assertIsNone(utils.OutputQueue._thread)
+
+
 class TestValidator(unittest.TestCase):
 
     def setUp(self):
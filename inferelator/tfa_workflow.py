@@ -100,14 +100,30 @@ class TFAWorkFlow(workflow.WorkflowBase):
         # Set the random seed (for bootstrap selection)
         np.random.seed(self.random_seed)
 
-        # Call the startup workflow
-        self.startup()
+        # Write output files from a background thread if set
+        utils.OutputQueue.set_background(self.write_in_background)
 
-        # Run regression after startup
-        betas, rescaled_betas = self.run_regression()
+        try:
+            # Call the startup workflow
+            self.startup()
 
-        # Write the results out to a file
-        return self.emit_results(betas, rescaled_betas, self.gold_standard, self.priors_data)
+            # Run regression after startup
+            betas, rescaled_betas = self.run_regression()
+
+            # Write the results out to a file
+            results = self.emit_results(betas, rescaled_betas, self.gold_standard, self.priors_data)
+
+        except BaseException:
+            # Wait for the queued output files, but don't let a write error replace the exception from the run
+            try:
+                utils.OutputQueue.set_background(False)
+            except Exception as write_err:
+                utils.Debug.vprint("Output file write failed: {e}".format(e=str(write_err)), level=0)
+            raise
+
+        # Wait for all of the output files to be written
+        utils.OutputQueue.set_background(False)
+        return results
 
     def startup_run(self):
         self.get_data()
@@ -140,7 +156,9 @@ class TFAWorkFlow(workflow.WorkflowBase):
 
         if self._tfa_output_file is not None and self.is_master():
             self.create_output_dir()
-            self.design.to_csv(self.output_path(self._tfa_output_file), sep="\t")
+            # Write a copy so that the output isn't changed by any further processing of the design data
+            utils.OutputQueue.submit(self.design.subset_copy().to_csv, self.output_path(self._tfa_output_file),
+                                     sep="\t")
 
         utils.Debug.vprint("Rebuilt design matrix {d} with TF activity".format(d=self.design.shape), level=1)
 
@@ -152,6 +170,7 @@ class TFAWorkFlow(workflow.WorkflowBase):
             self.create_output_dir()
             rp = self._result_processor_driver(betas, rescaled_betas, filter_method=self.gold_standard_filter_method,
                                                metric=self.metric)
+            rp.network_writer, rp.matrix_writer = self.network_writer, self.matrix_writer
             self.results = rp.summarize_network(self.output_dir, gold_standard, priors)
             return self.results
         else:
@@ -1,6 +1,9 @@
 from inferelator.utils.validator import Validator, is_string
 from inferelator.utils.debug import Debug, slurm_envs
+from inferelator.utils.output_queue import OutputQueue
 from inferelator.utils.loader import InferelatorDataLoader, DEFAULT_PANDAS_TSV_SETTINGS
 from inferelator.utils.data import (InferelatorData, df_from_tsv, array_set_diag, df_set_diag,
-                                    melt_and_reindex_dataframe, make_array_2d, scale_vector, dot_product)
+                                    melt_and_reindex_dataframe, make_array_2d, scale_vector, dot_product,
+                                    is_sparse_frame, make_sparse_frame, frame_to_sparse_matrix)
+from inferelator.utils.bootstrap_aggregator import BootstrapAggregator
 
@@ -0,0 +1,359 @@
+"""
+BootstrapAggregator folds the model betas from each bootstrap into running summaries as each bootstrap finishes.
+This is used by both the regression workflows (which fill it) and the postprocessing (which reads it), so it only
+depends on the data utilities. The ranking functions used for rank summing live here for the same reason.
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sps
+import scipy.stats
+
+from inferelator.utils import Validator as check
+from inferelator.utils.data import is_sparse_frame, frame_to_sparse_matrix
+
+# Largest number of values which can be ranked into float32 (average ranks are exact half-integers up to 2 ** 23)
+RANK_FLOAT32_LIMIT = 2 ** 23
+
+# Number of nonzero values to keep for each edge for the median. The median is exact up to this many bootstraps
+DEFAULT_MEDIAN_SKETCH_SIZE = 100
+
+
+def nonzero_ranks(replicate):
+    """
+    Rank all of the values in a dataframe together, without making sparse-backed data dense. Ties get their average
+    rank and NaNs are not ranked. Every zero has the same (average) rank, so only the nonzero values are sorted.
+
+    :param replicate: pd.DataFrame [M x N]
+        Dense or sparse-backed dataframe
+    :return zero_rank: float
+        The rank of every zero
+    :return flat_idx: np.ndarray
+        The flat positions of the nonzero values
+    :return ranks: np.ndarray
+        The ranks of the nonzero values
+    :return nan_idx: np.ndarray
+        The flat positions of the NaNs
+    """
+
+    # Get the nonzero values and their flat positions without making sparse-backed data dense
+    if is_sparse_frame(replicate):
+        coo = replicate.sparse.to_coo()
+        values = coo.data.astype(float)
+        flat_idx = np.ravel_multi_index((coo.row, coo.col), replicate.shape)
+    else:
+        values = np.asarray(replicate.values, dtype=float).ravel()
+        flat_idx = np.flatnonzero(values != 0)
+        values = values[flat_idx]
+
+    # Explicit zeros can be stored in sparse data
+    keep = values != 0
+    values, flat_idx = values[keep], flat_idx[keep]
+
+    is_nan = np.isnan(values)
+    values, nan_idx, flat_idx = values[~is_nan], flat_idx[is_nan], flat_idx[~is_nan]
+
+    # All zeros are tied between the negative and the positive values
+    n_zero = replicate.size - len(nan_idx) - len(values)
+    n_negative = np.sum(values < 0)
+
+    ranks = scipy.stats.rankdata(values)
+    ranks[values > 0] += n_zero
+
+    return n_negative + (n_zero + 1) / 2, flat_idx, ranks, nan_idx
+
+
+def rank_replicate(replicate):
+    """
+    Rank all of the values in a dataframe together. Ties get their average rank and NaNs are not ranked.
+
+    :param replicate: pd.DataFrame [M x N]
+        Dense or sparse-backed dataframe
+    :return: np.ndarray [M x N]
+        Ranks (float32 if they are exact in float32, float64 otherwise)
+    """
+
+    zero_rank, flat_idx, ranks, nan_idx = nonzero_ranks(replicate)
+
+    dense_ranks = np.full(replicate.size, zero_rank,
+                          dtype=np.float32 if replicate.size <= RANK_FLOAT32_LIMIT else np.float64)
+    dense_ranks[flat_idx] = ranks
+    dense_ranks[nan_idx] = np.nan
+
+    return dense_ranks.reshape(replicate.shape)
+
+
+def rank_sum_to_confidences(combine_conf, num_replicates):
+    """
+    Convert summed rankings to confidence values
+
+    :param combine_conf: pd.DataFrame [M x N]
+        Rankings summed over all replicates
+    :param num_replicates: int
+        The number of replicates which were summed
+    :return combine_conf: pd.DataFrame [M x N]
+    """
+
+    min_element = np.nanmin(combine_conf.values)
+    return (combine_conf - min_element) / (num_replicates * combine_conf.size - min_element)
+
+
+class MedianSketch(object):
+    """
+    Keep up to sketch_size nonzero values for each edge (as a uniform reservoir sample of that edge's nonzero values)
+    so that the median of every edge can be estimated with memory that doesn't grow with the number of bootstraps.
+    The number of zeros for each edge is counted exactly, so the median is exact for any edge which has been nonzero in
+    sketch_size or fewer bootstraps. If sketch_size is None, every nonzero value is kept and the median is exact.
+    """
+
+    sketch_size = DEFAULT_MEDIAN_SKETCH_SIZE
+
+    # Flat positions of edges which have been nonzero in any bootstrap (sorted) [E]
+    keys = None
+
+    # Number of nonzero values which have been added for each edge [E]
+    seen = None
+
+    # Kept nonzero values for each edge [E x C]
+    values = None
+
+    def __init__(self, sketch_size=DEFAULT_MEDIAN_SKETCH_SIZE, random_seed=42):
+        """
+        :param sketch_size: int
+            Number of nonzero values to keep for each edge. If None, keep every value
+        :param random_seed: int
+            Seed for the reservoir sampling
+        """
+
+        assert check.argument_integer(sketch_size, low=1, allow_none=True)
+        assert check.argument_integer(random_seed)
+
+        self.sketch_size = sketch_size
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.seen = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros((0, 1), dtype=float)
+        self._rng = np.random.RandomState(random_seed)
+
+    def add(self, flat_idx, values):
+        """
+        Add the nonzero values from one bootstrap
+
+        :param flat_idx: np.ndarray
+            Unique flat positions of the nonzero values
+        :param values: np.ndarray
+            Nonzero values
+        """
+
+        self._add_keys(flat_idx)
+
+        pos = np.searchsorted(self.keys, flat_idx)
+        count = self.seen[pos]
+
+        # Fill the sketch for each edge, and then replace kept values with probability sketch_size / seen
+        if self.sketch_size is None:
+            slot = count
+        else:
+            slot = np.where(count < self.sketch_size, count,
+                            np.floor(self._rng.random_sample(len(count)) * (count + 1)).astype(np.int64))
+
+        keep = slot < (np.inf if self.sketch_size is None else self.sketch_size)
+        self._add_capacity(slot[keep].max() + 1 if np.any(keep) else 0)
+
+        self.values[pos[keep], slot[keep]] = values[keep]
+        self.seen[pos] += 1
+
+    def _add_keys(self, flat_idx):
+        new_keys = np.setdiff1d(flat_idx, self.keys, assume_unique=True)
+
+        if len(new_keys) == 0:
+            return
+
+        keys = np.union1d(self.keys, new_keys)
+        old_pos = np.searchsorted(keys, self.keys)
+
+        seen, values = np.zeros(len(keys), dtype=np.int64), np.zeros((len(keys), self.values.shape[1]), dtype=float)
+        seen[old_pos], values[old_pos, :] = self.seen, self.values
+
+        self.keys, self.seen, self.values = keys, seen, values
+
+    def _add_capacity(self, capacity):
+        if capacity <= self.values.shape[1]:
+            return
+
+        capacity = max(capacity, 2 * self.values.shape[1])
+        capacity = capacity if self.sketch_size is None else min(capacity, self.sketch_size)
+
+        values = np.zeros((self.values.shape[0], capacity), dtype=float)
+        values[:, :self.values.shape[1]] = self.values
+        self.values = values
+
+    def median(self, n, shape):
+        """
+        Calculate the median of every edge
+
+        :param n: int
+            The number of bootstraps (the number of zeros for an edge is n - the number of nonzero values)
+        :param shape: tuple
+            The shape of the data (M, N)
+        :return: np.ndarray [M x N]
+        """
+
+        median_data = np.zeros(shape)
+
+        if len(self.keys) == 0:
+            return median_data
+
+        kept = self.seen if self.sketch_size is None else np.minimum(self.seen, self.sketch_size)
+        values = np.where(np.arange(self.values.shape[1])[None, :] < kept[:, None], self.values, np.inf)
+        values.sort(axis=1)
+
+        # Each kept value stands in for seen / kept values (exactly one unless the sketch is full)
+        weight = self.seen / kept
+        n_zero = n - self.seen
+        n_negative = np.sum(values < 0, axis=1) * weight
+
+        def order_statistic(p):
+            is_zero = (p >= n_negative) & (p < n_negative + n_zero)
+            idx = np.where(p < n_negative, np.floor(p / weight), np.floor((p - n_zero) / weight))
+            idx = np.clip(idx, 0, kept - 1).astype(np.int64)
+
+            stat = np.take_along_axis(values, idx[:, None], axis=1).ravel()
+            stat[is_zero] = 0.
+            return stat
+
+        median = (order_statistic((n - 1) // 2) + order_statistic(n // 2)) / 2
+        median[np.any(np.isnan(values), axis=1)] = np.nan
+
+        median_data.flat[self.keys] = median
+        return median_data
+
+
+class BootstrapAggregator(object):
+    """
+    Fold the betas and rescaled betas from each bootstrap into running summaries as each bootstrap finishes, instead
+    of keeping every bootstrap for the ResultsProcessor. Sign sums, nonzero counts, and rescaled beta sums are kept as
+    sparse [G x K] matrices. Rank sums are kept as the summed rank of zeros and a sparse matrix of the difference for
+    nonzero values. The median is calculated from a MedianSketch, so memory doesn't grow with the number of bootstraps
+    unless the exact median is requested (median_sketch_size=None).
+
+    This can be passed to the ResultsProcessor in place of the lists of betas and rescaled betas
+    """
+
+    # Labels
+    index = None  # pd.Index [G]
+    columns = None  # pd.Index [K]
+
+    # Number of bootstraps which have been added
+    n = 0
+
+    # Running summaries
+    betas_sign = None  # sp.csr_matrix [G x K]
+    betas_non_zero = None  # sp.csr_matrix [G x K]
+    rescaled_sum = None  # sp.csr_matrix [G x K]
+
+    # Summed ranks are zero_rank_sum + rank_offset_sum (and NaN where rank_nan_count is nonzero)
+    zero_rank_sum = 0.
+    rank_offset_sum = None  # sp.csr_matrix [G x K]
+    rank_nan_count = None  # sp.csr_matrix [G x K]
+
+    # Nonzero rescaled betas for the median
+    median_sketch = None  # MedianSketch
+
+    def __init__(self, median_sketch_size=DEFAULT_MEDIAN_SKETCH_SIZE, random_seed=42):
+        """
+        :param median_sketch_size: int
+            Number of nonzero rescaled betas to keep for each edge to estimate the median. The median is exact up to
+            this many bootstraps. If None, every nonzero rescaled beta is kept and the median is always exact
+        :param random_seed: int
+            Seed for sampling the values kept for the median
+        """
+        self.n = 0
+        self.zero_rank_sum = 0.
+        self.median_sketch = MedianSketch(sketch_size=median_sketch_size, random_seed=random_seed)
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def shape(self):
+        return len(self.index), len(self.columns)
+
+    def add(self, betas, rescaled_betas):
+        """
+        Add the results from one bootstrap
+
+        :param betas: Model weights for this bootstrap (dense or sparse-backed)
+        :type betas: pd.DataFrame [G x K]
+        :param rescaled_betas: Variance explained by each parameter for this bootstrap (dense or sparse-backed)
+        :type rescaled_betas: pd.DataFrame [G x K]
+        """
+
+        assert check.argument_type(betas, pd.DataFrame)
+        assert check.argument_type(rescaled_betas, pd.DataFrame)
+        assert check.dataframes_align([betas, rescaled_betas])
+
+        if self.n == 0:
+            self.index, self.columns = betas.index, betas.columns
+            self.betas_sign = sps.csr_matrix(betas.shape, dtype=float)
+            self.betas_non_zero = sps.csr_matrix(betas.shape, dtype=float)
+            self.rescaled_sum = sps.csr_matrix(betas.shape, dtype=float)
+            self.rank_offset_sum = sps.csr_matrix(betas.shape, dtype=float)
+            self.rank_nan_count = sps.csr_matrix(betas.shape, dtype=float)
+        elif not (self.index.equals(betas.index) and self.columns.equals(betas.columns)):
+            raise ValueError("Bootstrap results are not aligned with previous bootstraps")
+
+        betas = frame_to_sparse_matrix(betas)
+        rescaled = frame_to_sparse_matrix(rescaled_betas)
+        rescaled.eliminate_zeros()
+
+        # Convert betas to -1,0,1 based on signing and tally the non-zeros
+        self.betas_sign = self.betas_sign + betas.sign()
+        self.betas_non_zero = self.betas_non_zero + (betas != 0).astype(float)
+        self.rescaled_sum = self.rescaled_sum + rescaled
+
+        zero_rank, flat_idx, ranks, nan_idx = nonzero_ranks(rescaled_betas)
+        self.zero_rank_sum += zero_rank
+        self.rank_offset_sum = self.rank_offset_sum + self._flat_to_sparse(flat_idx, ranks - zero_rank)
+        self.rank_nan_count = self.rank_nan_count + self._flat_to_sparse(nan_idx, np.ones(len(nan_idx)))
+
+        rescaled.sort_indices()
+        rescaled = rescaled.tocoo()
+        self.median_sketch.add(np.ravel_multi_index((rescaled.row, rescaled.col), self.shape), rescaled.data)
+
+        self.n += 1
+
+    def _flat_to_sparse(self, flat_idx, values):
+        return sps.csr_matrix((values, np.unravel_index(flat_idx, self.shape)), shape=self.shape)
+
+    def summarize(self):
+        """
+        :return betas_sign: pd.DataFrame [G x K]
+            A dataframe with the summation of np.sign() for each bootstrap
+        :return betas_non_zero: pd.DataFrame [G x K]
+            A dataframe with a count of the number of non-zero betas for an interaction
+        """
+
+        return (pd.DataFrame(self.betas_sign.A, index=self.index, columns=self.columns),
+                pd.DataFrame(self.betas_non_zero.A, index=self.index, columns=self.columns))
+
+    def mean_and_median(self):
+        """
+        :return mean_data: pd.DataFrame [G x K]
+            Mean rescaled betas
+        :return median_data: pd.DataFrame [G x K]
+            Median rescaled betas
+        """
+
+        return (pd.DataFrame(self.rescaled_sum.A / self.n, index=self.index, columns=self.columns),
+                pd.DataFrame(self.median_sketch.median(self.n, self.shape), index=self.index, columns=self.columns))
+
+    def combined_confidences(self):
+        """
+        :return combine_conf: pd.DataFrame [G x K]
+            Confidences calculated from the summed ranks of the rescaled betas
+        """
+
+        rank_sum = self.rank_offset_sum.A + self.zero_rank_sum
+        rank_sum[self.rank_nan_count.A > 0] = np.nan
+
+        return rank_sum_to_confidences(pd.DataFrame(rank_sum, index=self.index, columns=self.columns), self.n)
@@ -98,6 +98,52 @@ def array_set_diag(arr, val, row_labels, col_labels):
     return len(isect)
 
 
+def is_sparse_frame(data_frame):
+    """
+    Check if a dataframe is backed by sparse arrays (in every column)
+
+    :param data_frame: pd.DataFrame
+    :return: bool
+    """
+
+    return data_frame.shape[1] > 0 and all(isinstance(d, pd.SparseDtype) for d in data_frame.dtypes)
+
+
+def make_sparse_frame(data, index=None, columns=None):
+    """
+    Make a dataframe which is backed by sparse arrays with a fill value of 0
+
+    :param data: A dense dataframe or a scipy sparse matrix
+    :type data: pd.DataFrame, sp.spmatrix
+    :param index: Row labels (if data is a scipy sparse matrix)
+    :type index: pd.Index
+    :param columns: Column labels (if data is a scipy sparse matrix)
+    :type columns: pd.Index
+    :return: pd.DataFrame
+    """
+
+    if isinstance(data, pd.DataFrame):
+        if is_sparse_frame(data):
+            return data
+        index, columns, data = data.index, data.columns, sparse.csr_matrix(data.values)
+
+    return pd.DataFrame.sparse.from_spmatrix(data, index=index, columns=columns)
+
+
+def frame_to_sparse_matrix(data_frame):
+    """
+    Get a scipy CSR matrix from a dataframe (without making a dense copy if it is backed by sparse arrays)
+
+    :param data_frame: pd.DataFrame
+    :return: sp.csr_matrix
+    """
+
+    if is_sparse_frame(data_frame):
+        return data_frame.sparse.to_coo().tocsr()
+    else:
+        return sparse.csr_matrix(data_frame.values)
+
+
 def make_array_2d(arr):
     """
     Changes array shape from 1d to 2d if needed (in-place)
@@ -0,0 +1,135 @@
+from __future__ import print_function, unicode_literals, division
+
+import atexit
+import queue
+import threading
+
+from inferelator.utils.debug import Debug
+
+
+class OutputQueue:
+    """
+    This class serializes file output onto a single background writer thread, so that writing files doesn't block
+    the master process. Writes are run immediately (on the calling thread) unless background writing is enabled.
+
+    Any exception raised by a background write is re-raised on the calling thread by the next call to .submit(),
+    .flush(), or .shutdown()
+    """
+
+    background = False
+
+    _queue = None
+    _thread = None
+    _errors = []
+
+    @classmethod
+    def set_background(cls, background):
+        """
+        Turn background writing on or off. Turning it off will flush any queued writes.
+        :param background: bool
+        """
+
+        try:
+            if not background:
+                cls.flush()
+        finally:
+            cls.background = background
+
+    @classmethod
+    def submit(cls, func, *args, **kwargs):
+        """
+        Run an output function on the writer thread (or immediately if background writing is off)
+        :param func: callable
+            Function which writes output
+        :param args: Arguments for func
+        :param kwargs: Keyword arguments for func
+        """
+
+        cls._raise_errors()
+
+        if not cls.background:
+            func(*args, **kwargs)
+            return
+
+        cls._start()
+        cls._queue.put((func, args, kwargs))
+
+    @classmethod
+    def flush(cls):
+        """
+        Block until all queued writes have finished. Raise the first exception from any failed write.
+        """
+
+        if cls._queue is not None:
+            cls._queue.join()
+
+        cls._raise_errors()
+
+    @classmethod
+    def shutdown(cls):
+        """
+        Flush all queued writes and stop the writer thread
+        """
+
+        try:
+            cls.flush()
+        finally:
+            if cls._thread is not None:
+                cls._queue.put(None)
+                cls._thread.join()
+                cls._thread, cls._queue = None, None
+
+    @classmethod
+    def _start(cls):
+        """
+        Start the writer thread if it isn't running
+        """
+
+        if cls._thread is not None:
+            return
+
+        cls._queue = queue.Queue()
+        cls._thread = threading.Thread(target=cls._writer, args=(cls._queue,), name="inferelator-writer")
+        cls._thread.daemon = True
+        cls._thread.start()
+
+        Debug.vprint("Started background output writer", level=2)
+
+    @classmethod
+    def _writer(cls, task_queue):
+        """
+        Run output functions from the queue until a None is received
+        """
+
+        while True:
+            task = task_queue.get()
+
+            try:
+                if task is None:
+                    return
+
+                func, args, kwargs = task
+                func(*args, **kwargs)
+
+            # Keep the exception so it can be raised on the thread that submitted the write
+            except BaseException as err:
+                Debug.vprint("Background output failed: {e}".format(e=str(err)), level=0)
+                cls._errors.append(err)
+
+            finally:
+                task_queue.task_done()
+
+    @classmethod
+    def _raise_errors(cls):
+        """
+        Raise the first exception from any failed background write (and forget the rest)
+        """
+
+        if len(cls._errors) > 0:
+            err = cls._errors[0]
+            cls._errors = []
+            raise err
+
+
+# Don't lose queued output when the interpreter exits
+atexit.register(OutputQueue.shutdown)
@@ -632,6 +632,11 @@ class WorkflowBase(WorkflowBaseLoader):
     gold_standard_filter_method = "keep_all_gold_standard"
     metric = "aupr"
 
+    # Output file writers (None uses TSV files)
+    network_writer = None
+    matrix_writer = None
+    write_in_background = False
+
     # Output results in an InferelatorResults object
     results = None
 
@@ -695,7 +700,30 @@ class WorkflowBase(WorkflowBaseLoader):
         self._set_with_warning("gold_standard_filter_method", gold_standard_filter_method)
         self._set_with_warning("metric", metric)
 
-    def set_run_parameters(self, num_bootstraps=None, random_seed=None):
+    def set_output_writers(self, network_writer=None, matrix_writer=None, write_in_background=None):
+        """
+        Set the file formats used to write results
+
+        :param network_writer: The writer for the long-format network (and curve data) tables. "tsv" writes a TSV file,
+            "tsv.gz" writes a gzipped TSV file in chunks, and "parquet" or "feather" write binary tables (these
+            require pyarrow). An OutputWriter instance can also be passed. Defaults to "tsv".
+        :type network_writer: str, OutputWriter
+        :param matrix_writer: The writer for the genes x regulators matrices (combined confidences and thresholded
+            betas). "tsv" and "tsv.gz" write TSV files, "npz" writes a sparse CSR matrix with labels, and "hdf5"
+            writes a compressed HDF5 store (which requires pytables). An OutputWriter instance can also be passed.
+            Defaults to "tsv".
+        :type matrix_writer: str, OutputWriter
+        :param write_in_background: Write output files from a background thread so that the workflow doesn't wait on
+            them. All files are written by the end of the workflow run. Defaults to False.
+        :type write_in_background: bool
+        """
+
+        self._set_with_warning("network_writer", network_writer)
+        self._set_with_warning("matrix_writer", matrix_writer)
+        self._set_without_warning("write_in_background", write_in_background)
+
+    def set_run_parameters(self, num_bootstraps=None, random_seed=None, use_sparse_betas=None,
+                           online_bootstrap_aggregation=None, median_sketch_size=None, exact_median=None):
         """
         Set parameters used during runtime
 
@@ -703,10 +731,27 @@ class WorkflowBase(WorkflowBaseLoader):
         :type num_bootstraps: int
         :param random_seed: The random number seed to use. Defaults to 42.
         :type random_seed: int
+        :param use_sparse_betas: Keep the model betas from each bootstrap as sparse-backed dataframes, so that memory
+            use scales with the number of edges instead of with genes x regulators. Defaults to False.
+        :type use_sparse_betas: bool
+        :param online_bootstrap_aggregation: Summarize the model betas from each bootstrap as it finishes (sign sums,
+            nonzero counts, and rank sums), instead of keeping every bootstrap until the end. Defaults to False.
+        :type online_bootstrap_aggregation: bool
+        :param median_sketch_size: The number of nonzero values to keep for each edge to calculate the median when
+            online_bootstrap_aggregation is set. The median is exact up to this many bootstraps, and is estimated from
+            a random sample of this many values for each edge after that. Defaults to 100.
+        :type median_sketch_size: int
+        :param exact_median: Keep every nonzero value when online_bootstrap_aggregation is set, so that the median is
+            exact for any number of bootstraps. Memory use grows with the number of bootstraps. Defaults to False.
+        :type exact_median: bool
         """
 
         self._set_without_warning("num_bootstraps", num_bootstraps)
         self._set_without_warning("random_seed", random_seed)
+        self._set_without_warning("use_sparse_betas", use_sparse_betas)
+        self._set_without_warning("online_bootstrap_aggregation", online_bootstrap_aggregation)
+        self._set_without_warning("median_sketch_size", median_sketch_size)
+        self._set_without_warning("exact_median", exact_median)
 
     def initialize_multiprocessing(self):
         """